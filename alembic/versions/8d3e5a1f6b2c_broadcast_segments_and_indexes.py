@@ -0,0 +1,49 @@
+"""broadcast segments and audience indexes
+
+Revision ID: 8d3e5a1f6b2c
+Revises: 4f1c2b7d9a10
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3e5a1f6b2c'
+down_revision: Union[str, Sequence[str], None] = '4f1c2b7d9a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'broadcast_jobs',
+        sa.Column(
+            'segment',
+            sa.Enum('ALL', 'LOCALE', 'ACTIVE_SUBSCRIPTION', 'EXPIRED_SUBSCRIPTION', 'TRIAL_ONLY',
+                    'NEVER_PAID', 'EXPIRING_SOON', name='broadcastsegment'),
+            nullable=False,
+            server_default='ALL'
+        )
+    )
+    op.add_column('broadcast_jobs', sa.Column('segment_param', sa.String(), nullable=True))
+
+    op.create_index('ix_users_is_active_language_code', 'users', ['is_active', 'language_code'], unique=False)
+    op.create_index('ix_users_had_first_purchase_has_trial', 'users', ['had_first_purchase', 'has_trial'], unique=False)
+    op.create_index('ix_subscriptions_telegram_id_status', 'subscriptions', ['telegram_id', 'status'], unique=False)
+    op.create_index('ix_subscriptions_status_end_date', 'subscriptions', ['status', 'end_date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_subscriptions_status_end_date', table_name='subscriptions')
+    op.drop_index('ix_subscriptions_telegram_id_status', table_name='subscriptions')
+    op.drop_index('ix_users_had_first_purchase_has_trial', table_name='users')
+    op.drop_index('ix_users_is_active_language_code', table_name='users')
+
+    op.drop_column('broadcast_jobs', 'segment_param')
+    op.drop_column('broadcast_jobs', 'segment')
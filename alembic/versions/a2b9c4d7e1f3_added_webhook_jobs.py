@@ -0,0 +1,44 @@
+"""added webhook_jobs
+
+Revision ID: a2b9c4d7e1f3
+Revises: 8d3e5a1f6b2c
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2b9c4d7e1f3'
+down_revision: Union[str, Sequence[str], None] = '8d3e5a1f6b2c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('webhook_jobs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('event', sa.String(), nullable=False),
+    sa.Column('remna_uuid', sa.String(length=36), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'PROCESSING', 'DONE', 'FAILED', name='webhookjobstatus'), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_webhook_jobs'))
+    )
+    op.create_index(op.f('ix_webhook_jobs_remna_uuid'), 'webhook_jobs', ['remna_uuid'], unique=False)
+    op.create_index('ix_webhook_jobs_status_id', 'webhook_jobs', ['status', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_jobs_status_id', table_name='webhook_jobs')
+    op.drop_index(op.f('ix_webhook_jobs_remna_uuid'), table_name='webhook_jobs')
+    op.drop_table('webhook_jobs')
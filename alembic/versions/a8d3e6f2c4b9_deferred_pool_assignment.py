@@ -0,0 +1,30 @@
+"""deferred pool assignment
+
+Revision ID: a8d3e6f2c4b9
+Revises: c9a3f5e1b7d4
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3e6f2c4b9'
+down_revision: Union[str, Sequence[str], None] = 'c9a3f5e1b7d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('remna_deferred_updates', sa.Column('telegram_id', sa.Integer(), nullable=True))
+    op.add_column('remna_deferred_updates', sa.Column('username', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('remna_deferred_updates', 'username')
+    op.drop_column('remna_deferred_updates', 'telegram_id')
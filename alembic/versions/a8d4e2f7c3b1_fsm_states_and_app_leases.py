@@ -0,0 +1,41 @@
+"""fsm_states and app_leases
+
+Revision ID: a8d4e2f7c3b1
+Revises: f3b8c1d5a9e2
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d4e2f7c3b1'
+down_revision: Union[str, Sequence[str], None] = 'f3b8c1d5a9e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('fsm_states',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('state', sa.String(), nullable=True),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('key', name=op.f('pk_fsm_states'))
+    )
+    op.create_table('app_leases',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('owner', sa.String(length=128), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name', name=op.f('pk_app_leases'))
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('app_leases')
+    op.drop_table('fsm_states')
@@ -0,0 +1,28 @@
+"""payment processing_started_at
+
+Revision ID: b4e7c2a9d1f6
+Revises: d6f2a9c4e8b5
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e7c2a9d1f6'
+down_revision: Union[str, Sequence[str], None] = 'd6f2a9c4e8b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payments_gateways', sa.Column('processing_started_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payments_gateways', 'processing_started_at')
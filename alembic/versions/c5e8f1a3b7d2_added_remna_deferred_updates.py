@@ -0,0 +1,37 @@
+"""added remna_deferred_updates
+
+Revision ID: c5e8f1a3b7d2
+Revises: a2b9c4d7e1f3
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e8f1a3b7d2'
+down_revision: Union[str, Sequence[str], None] = 'a2b9c4d7e1f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('remna_deferred_updates',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('remna_uuid', sa.String(length=36), nullable=False),
+    sa.Column('expire_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_remna_deferred_updates')),
+    sa.UniqueConstraint('remna_uuid', name=op.f('uq_remna_deferred_updates_remna_uuid'))
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('remna_deferred_updates')
@@ -0,0 +1,30 @@
+"""broadcast job owner
+
+Revision ID: c9a3f5e1b7d4
+Revises: b4e7c2a9d1f6
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9a3f5e1b7d4'
+down_revision: Union[str, Sequence[str], None] = 'b4e7c2a9d1f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('broadcast_jobs', sa.Column('owner', sa.String(length=128), nullable=True))
+    op.add_column('broadcast_jobs', sa.Column('locked_until', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('broadcast_jobs', 'locked_until')
+    op.drop_column('broadcast_jobs', 'owner')
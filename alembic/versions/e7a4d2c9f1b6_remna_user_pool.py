@@ -0,0 +1,41 @@
+"""remna user pool, nullable payment subscription
+
+Revision ID: e7a4d2c9f1b6
+Revises: c5e8f1a3b7d2
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a4d2c9f1b6'
+down_revision: Union[str, Sequence[str], None] = 'c5e8f1a3b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('remna_pool_users',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('remna_uuid', sa.String(length=36), nullable=False),
+    sa.Column('remna_short_uuid', sa.String(length=48), nullable=False),
+    sa.Column('username', sa.String(), nullable=False),
+    sa.Column('subscription_url', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_remna_pool_users')),
+    sa.UniqueConstraint('remna_uuid', name=op.f('uq_remna_pool_users_remna_uuid'))
+    )
+    with op.batch_alter_table('payments_gateways') as batch_op:
+        batch_op.alter_column('subscription_id', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('payments_gateways') as batch_op:
+        batch_op.alter_column('subscription_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_table('remna_pool_users')
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Request, Response
 from aiogram import types
 from app.logger import logger
 from app.core.config import settings
+from app.services.update_queue import update_queue
 
 
 router = APIRouter()
@@ -11,7 +12,7 @@ router = APIRouter()
 async def bot_webhook(update: dict, request: Request):
     """
     Принимает вебхуки от Telegram, проверяет секретный токен
-    и передает обновление в диспетчер aiogram.
+    и передает обновление в диспетчер aiogram (через update_queue, если включен BOT_UPDATES_ASYNC).
     """
     telegram_secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
     if telegram_secret_token != settings.WEBHOOK_SECRET:
@@ -24,6 +25,10 @@ async def bot_webhook(update: dict, request: Request):
     )
     logger.bind(source="bot").debug(f"Полный update: {update}")
     telegram_update = types.Update(**update)
-    await settings.DP_BOT.feed_update(bot=settings.BOT, update=telegram_update)
+    if update_queue.running:
+        # Отвечаем сразу, апдейт обработают воркеры очереди
+        await update_queue.put(telegram_update)
+    else:
+        await settings.DP_BOT.feed_update(bot=settings.BOT, update=telegram_update)
 
     return Response(status_code=200)
\ No newline at end of file
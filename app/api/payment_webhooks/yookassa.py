@@ -3,12 +3,8 @@ from yookassa.domain.notification import WebhookNotification
 import json
 
 from app.logger import logger
-from app.services.payment_service import payment_service
-from database.session import get_session
+from app.services.payment_service import payment_service, PaymentOutcome
 from app.core.config import settings
-from app.bot.keyboards.inlines import get_config_webapp_button
-from aiogram.utils.i18n import gettext as _
-from app.bot.middlewares.i18n import i18n
 
 yookassa_router = APIRouter(prefix=settings.PAYMENTS_PATH)
 
@@ -31,46 +27,13 @@ async def yookassa_webhook(request: Request):
     external_payment_id = notification.object.id
 
     logger.bind(source="payments_gateways").info(f"Получен вебхук от ЮKassa: ID={external_payment_id}, Статус={payment_status}")
-    # Находим наш внутренний платеж по внешнему ID
-    internal_payment = await payment_service.get_by_external_id(external_payment_id)
-
-    if not internal_payment:
-        logger.bind(source="payments_gateways").error(f"Не найден платеж с external_id={external_payment_id} в нашей БД.")
-        return Response(status_code=200)
-    if internal_payment.status != "pending":
-        logger.bind(source="payments_gateways").warning(f"Платеж {internal_payment.id} уже был обработан. Текущий статус: {internal_payment.status}")
+    if payment_status not in ['succeeded', 'canceled', 'failed']:
         return Response(status_code=200)
-    subscription = internal_payment.subscription
-    tariff = internal_payment.tariff
-    if payment_status == 'succeeded':
-        await payment_service.confirm_payment(internal_payment.id)
-        try:
-            i18n.current_locale = internal_payment.user.language_code
-            with i18n.context():
-                await settings.BOT.send_message(
-                    chat_id=internal_payment.user_id,
-                    text=_("subscription_purchased_with_config_message").format(
-                        tariff_name=tariff.name,
-                        sub_name=subscription.subscription_name,
-                        logo_name=settings.LOGO_NAME
-                    ),
-                    message_effect_id="5159385139981059251",
-                    reply_markup=get_config_webapp_button(subscription.subscription_url)
-                )
-        except Exception as e:
-            logger.bind(source="payments_gateways").error(f"Не удалось отправить уведомление об оплате пользователю {internal_payment.user_id}: {e}")
 
-    elif payment_status in ['canceled', 'failed']:
-        try:
-            await payment_service.fail_payment(internal_payment.id)
-            i18n.current_locale = internal_payment.user.language_code
-            with i18n.context():
-                await settings.BOT.send_message(
-                    chat_id=internal_payment.user_id,
-                    text=_("payment_cancelled_message").format(
-                        tariff_name=tariff.name
-                    )
-                )
-        except Exception as e:
-            logger.bind(source="payments_gateways").error(f"Не удалось отправить уведомление об оплате пользователю {internal_payment.user_id}: {e}")
+    # Поиск, смена статуса и продление подписки за один проход. Уведомление пользователю
+    # сохраняется в той же транзакции и отправляется в фоне, поэтому отвечаем сразу после коммита
+    result = await payment_service.process_payment(external_payment_id, succeeded=payment_status == 'succeeded')
+    if result.outcome in (PaymentOutcome.DEFERRED, PaymentOutcome.IN_PROGRESS):
+        # Подписка еще не выдана: ЮKassa повторит уведомление (выдачу повторяет и фоновая задача)
+        return Response(status_code=500)
     return Response(status_code=200)
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Request, Header, Response, HTTPException
 from typing import Optional
 from app.services.webhook_remna_validator import webhook_validator
-from app.services.webhook_remna_service import webhook_service
+from app.services.webhook_queue import webhook_queue
 from app.logger import logger
 
 
@@ -14,7 +14,8 @@ async def handle_remnawave_webhook(
         x_remnawave_signature: Optional[str] = Header(None)
 ):
     """
-    Принимает, валидирует и обрабатывает вебхуки от панели Remnawave.
+    Принимает и валидирует вебхуки от панели Remnawave.
+    Обработка выполняется в фоне очередью webhook_queue, панель получает ответ сразу.
     """
     if not x_remnawave_signature:
         logger.warning("Получен вебхук без заголовка подписи. Отклонено.")
@@ -29,8 +30,8 @@ async def handle_remnawave_webhook(
 
     try:
         payload = await request.json()
-        await webhook_service.process_webhook(payload)
+        await webhook_queue.enqueue(payload, body=body_bytes)
         return Response(status_code=200)
     except Exception as e:
-        logger.critical(f"Критическая ошибка при обработке вебхука Remnawave: {e}")
+        logger.critical(f"Критическая ошибка при приеме вебхука Remnawave: {e}")
         return Response(status_code=500)
\ No newline at end of file
@@ -6,9 +6,10 @@ from app.bot.handlers.profile import (profile_command, get_action_profile, get_s
 from app.bot.handlers.referral import referral_command
 from app.bot.handlers.help import help_command, navigate_help_menu, show_install_guide
 from aiogram.filters import Command
-from app.bot.utils.commands import start_bot
 from app.logger import logger
 from app.bot.utils.throttling import ThrottlingMiddleware
+from app.core.config import settings
+from app.core.limiter import rate_limit_store
 from app.bot.utils.statesforms import StepForm
 from app.bot.handlers.stars_handlers import pre_checkout_handler, successful_payment_handler
 from app.bot.middlewares.i18n import i18n_middleware
@@ -20,11 +21,11 @@ def setup_bot_logic(dp: Dispatcher, bot: Bot) -> None:
 
     logger.info("Инициализация бота")
     dp.message.filter(F.chat.type == "private")
-    dp.startup.register(start_bot)
 
     # Антиспам
-    dp.message.middleware(ThrottlingMiddleware(limit=0.2))
-    dp.callback_query.middleware(ThrottlingMiddleware(limit=0.2))
+    throttling = ThrottlingMiddleware(store=rate_limit_store, limits=settings.THROTTLE_LIMITS)
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
     # Переводчик
     dp.update.middleware(i18n_middleware)
 
@@ -39,6 +40,9 @@ def setup_bot_logic(dp: Dispatcher, bot: Bot) -> None:
 
     # --- Админские команды ---
     admin_router = Router(name="admin_commands")
+    # Апдейты не-админов отсекаются по ADMIN_IDS без запросов к БД
+    admin_router.message.filter(F.from_user.id.in_(settings.ADMIN_IDS))
+    admin_router.callback_query.filter(F.from_user.id.in_(settings.ADMIN_IDS))
     admin_router.include_router(broadcast.router)
     admin_router.include_router(refund.router)
     admin_router.include_router(statistics.router)
@@ -1,105 +1,106 @@
-import asyncio
 from aiogram import Router, Bot, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 
-from app.bot.keyboards.inlines import broadcast_confirmation_buttons
+from app.bot.keyboards.inlines import (broadcast_confirmation_buttons, broadcast_segment_buttons,
+                                       broadcast_segment_param_buttons)
+from app.bot.middlewares.i18n import i18n
+from app.bot.utils.admin_messages import broadcast_segment_titles
 from app.bot.utils.statesforms import StepForm
-from app.logger import logger
-from app.services.user_service import user_service
-from database.models import User
-from database.session import get_session
+from app.services.broadcast_service import broadcast_service
+from database.enums import BroadcastSegment
 
 router = Router(name=__name__)
 
 
-async def _send_broadcast_task(bot: Bot, original_message: Message, user_ids: list[int], admin_id: int):
-    """Приватная фоновая задача для отправки сообщения всем пользователям."""
-    success_count, failed_count = 0, 0
-    user_ids_to_send = [uid for uid in user_ids if uid != admin_id]
-    async with get_session() as session:
-        for user_id in user_ids_to_send:
-            try:
-                await original_message.send_copy(chat_id=user_id)
-                success_count += 1
-                await asyncio.sleep(0.05)  # Защита от Flood Limits
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Ошибка при отправке рассылки пользователю {user_id}: {e}")
-                if "Too Many Requests" in str(e):
-                    await asyncio.sleep(1.5)
-                # Если ошибка связана с блокировкой бота или удалённым пользователем
-                if "bot was blocked" in str(e).lower() or "user is deactivated" in str(e).lower():
-                    # Помечаем пользователя как неактивного
-                    user = await User.get_by_telegram_id(session, user_id)
-                    if user:
-                        await user.update(session, is_active=False)
-
-                if "Too Many Requests" in str(e):
-                    await asyncio.sleep(1.5)
-
-        report_text = (
-            "📢 Рассылка завершена.\n\n"
-            f"✅ Успешно доставлено: {success_count}\n"
-            f"❌ Ошибок: {failed_count}"
-        )
-        try:
-            await bot.send_message(admin_id, report_text)
-        except Exception as e:
-            logger.error(f"Не удалось отправить отчет о рассылке админу {admin_id}: {e}")
-
-
 @router.message(Command("broadcast"))
 async def broadcast_command(message: Message, state: FSMContext):
-    """Точка входа в режим рассылки."""
-    user_db = await user_service.register_or_update_user(message)
-    if not user_db.is_admin:
-        return
-
+    """Точка входа в режим рассылки (только для ADMIN_IDS, см. admin_router)."""
     await message.answer(
         "📢 <b>Режим рассылки</b>\n\n"
-        "Отправьте сообщение, которое вы хотите разослать всем пользователям. "
-        "Можно использовать форматирование и медиа."
+        "Отправьте сообщение, которое вы хотите разослать. "
+        "Можно использовать форматирование и медиа. Аудиторию выберете на следующем шаге."
     )
     await state.set_state(StepForm.WAITING_BROADCAST_MESSAGE)
 
 
 @router.message(StepForm.WAITING_BROADCAST_MESSAGE)
 async def receive_broadcast_message(message: Message, state: FSMContext):
-    """Получает сообщение от админа и просит подтверждение."""
-    await state.update_data(broadcast_message=message)
+    """Получает сообщение от админа и предлагает выбрать аудиторию."""
+    # Храним только координаты сообщения: рассылка копирует его через copy_message
+    await state.update_data(broadcast_chat_id=message.chat.id, broadcast_message_id=message.message_id)
     await message.reply(
-        text="✅ Сообщение получено. Начать рассылку?",
+        text="✅ Сообщение получено. Кому отправить?",
+        reply_markup=broadcast_segment_buttons()
+    )
+    await state.set_state(StepForm.CHOOSE_BROADCAST_SEGMENT)
+
+
+@router.callback_query(F.data.startswith("segment:"), StepForm.CHOOSE_BROADCAST_SEGMENT)
+async def choose_broadcast_segment(call: CallbackQuery, state: FSMContext):
+    """Принимает сегмент аудитории, показывает размер аудитории и просит подтверждение."""
+    _pass, segment_value, *params = call.data.split(":")
+    segment = BroadcastSegment(segment_value)
+    segment_param = params[0] if params else None
+
+    # Для сегментов с параметром сначала спрашиваем параметр
+    if segment_param is None and segment == BroadcastSegment.LOCALE:
+        await call.message.edit_text(
+            "🌐 Выберите язык аудитории:",
+            reply_markup=broadcast_segment_param_buttons(segment, list(i18n.available_locales))
+        )
+        return
+    if segment_param is None and segment == BroadcastSegment.EXPIRING_SOON:
+        await call.message.edit_text(
+            "⏰ Подписка истекает в течение:",
+            reply_markup=broadcast_segment_param_buttons(segment, ["1", "3", "7"])
+        )
+        return
+
+    audience_size = await broadcast_service.count_audience(segment, segment_param)
+    await state.update_data(broadcast_segment=segment.value, broadcast_segment_param=segment_param)
+
+    title = broadcast_segment_titles[segment]
+    if segment_param:
+        title = f"{title} ({segment_param})"
+    await call.message.edit_text(
+        f"🎯 Аудитория: <b>{title}</b>\n"
+        f"👥 Получателей: <code>{audience_size}</code>\n\n"
+        "Начать рассылку?",
         reply_markup=broadcast_confirmation_buttons()
     )
     await state.set_state(StepForm.CONFIRM_BROADCAST)
 
 
-@router.callback_query(F.data.startswith("broadcast:"), StepForm.CONFIRM_BROADCAST)
+@router.callback_query(
+    F.data.startswith("broadcast:"),
+    StateFilter(StepForm.CHOOSE_BROADCAST_SEGMENT, StepForm.CONFIRM_BROADCAST)
+)
 async def confirm_broadcast_handler(call: CallbackQuery, state: FSMContext, bot: Bot):
     """Обрабатывает подтверждение или отмену рассылки."""
     action = call.data.split(":")[1]
 
     if action == "start":
         data = await state.get_data()
-        original_message: Message = data.get("broadcast_message")
+        broadcast_chat_id = data.get("broadcast_chat_id")
+        broadcast_message_id = data.get("broadcast_message_id")
 
-        if not original_message:
+        if not broadcast_message_id:
             await call.answer("❌ Сообщение для рассылки не найдено.", show_alert=True)
             await state.clear()
             return
 
-        async with get_session() as session:
-            # Используем метод модели для получения всех ID
-            user_ids = await User.get_all_telegram_ids(session)
-
-        admin_id = call.from_user.id
-
-        # Запускаем отправку в фоновом режиме
-        asyncio.create_task(_send_broadcast_task(bot, original_message, user_ids, admin_id))
-
-        await call.message.edit_text("📤 Рассылка запущена. Отчёт будет отправлен по завершении.")
+        await call.message.edit_text("📤 Рассылка запущена. Прогресс будет обновляться, отчёт придёт по завершении.")
+        await broadcast_service.start_broadcast(
+            bot=bot,
+            admin_id=call.from_user.id,
+            from_chat_id=broadcast_chat_id,
+            message_id=broadcast_message_id,
+            segment=BroadcastSegment(data.get("broadcast_segment", BroadcastSegment.ALL.value)),
+            segment_param=data.get("broadcast_segment_param"),
+            progress_message_id=call.message.message_id
+        )
 
     elif action == "cancel":
         await call.message.edit_text("❌ Рассылка отменена.")
@@ -7,7 +7,6 @@ from aiogram.exceptions import TelegramBadRequest
 
 from app.core.config import settings
 from app.logger import logger
-from app.services.user_service import user_service # Используем только для проверки на админа
 
 router = Router(name=__name__)
 
@@ -20,12 +19,7 @@ async def refund_command(message: Message, command: CommandObject):
 
     Пример использования: /refund 758107031 3256044908709981615_some_hash
     """
-    # 1. Проверяем, что команду вызывает администратор
-    user_db = await user_service.register_or_update_user(message)
-    if not user_db.is_admin:
-        logger.warning(f"Попытка несанкционированного использования /refund от {message.from_user.id}")
-        return
-
+    # 1. Вызывать команду могут только администраторы: не-админов отсекает фильтр admin_router (ADMIN_IDS)
     # 2. Проверяем наличие и количество аргументов
     args = command.args
     if not args or len(args.split()) != 2:
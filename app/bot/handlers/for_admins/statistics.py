@@ -3,19 +3,72 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from app.bot.keyboards.inlines import admin_panel_buttons, back_to_admin_panel_button
-from app.services.user_service import user_service
 from app.services.admin_service import admin_service
+from app.services.sync_service import sync_service
+from app.core.remna_client import remna_metrics
+from app.services.payment_service import checkout_metrics
+from app.services.update_queue import update_queue_metrics
 from aiogram.fsm.context import FSMContext
+from app.logger import logger
 
 router = Router(name=__name__)
 
 
+def _format_seconds(value) -> str:
+    return f"{value:.2f}" if value is not None else ">30"
+
+
+def format_remna_metrics() -> str:
+    """Сводка по запросам к панели Remnawave с момента запуска процесса."""
+    if not remna_metrics.endpoints:
+        return "📡 Запросов к Remnawave еще не было."
+    lines = [f"<b>📡 Запросы к Remnawave</b> (в полете: <code>{remna_metrics.in_flight}</code>)\n"]
+    endpoints = sorted(remna_metrics.endpoints.items(), key=lambda item: item[1].latency.total, reverse=True)
+    for endpoint, stats in endpoints:
+        latency = stats.latency
+        avg = latency.sum / latency.total if latency.total else 0
+        lines.append(
+            f"<code>{endpoint}</code>\n"
+            f"  - Запросов: {latency.total}, ошибок: {stats.errors}, в полете: {stats.in_flight}\n"
+            f"  - Среднее {avg:.2f} с, p50 ≤ {_format_seconds(latency.quantile(0.5))} с, "
+            f"p95 ≤ {_format_seconds(latency.quantile(0.95))} с"
+        )
+    return "\n".join(lines)
+
+
+def format_checkout_metrics() -> str:
+    """Длительность этапов оформления оплаты с момента запуска процесса."""
+    if not checkout_metrics.stages:
+        return "💳 Оплату еще не оформляли."
+    lines = ["<b>💳 Оформление оплаты</b>\n"]
+    for stage, latency in checkout_metrics.stages.items():
+        lines.append(
+            f"<code>{stage}</code>: {latency.total} раз, "
+            f"p50 ≤ {_format_seconds(latency.quantile(0.5))} с, "
+            f"p99 ≤ {_format_seconds(latency.quantile(0.99))} с"
+        )
+    return "\n".join(lines)
+
+
+def format_update_queue_metrics() -> str:
+    """Состояние очереди апдейтов Telegram с момента запуска процесса."""
+    m = update_queue_metrics
+    if not m.enqueued:
+        return "📨 Апдейтов через очередь еще не было."
+    return (
+        "<b>📨 Очередь апдейтов Telegram</b>\n"
+        f"  - В очереди: {m.depth} (максимум {m.max_depth}), принято: {m.enqueued}, ошибок: {m.failed}\n"
+        f"  - Ожиданий места: {m.full_waits}, всего {m.full_wait_seconds:.1f} с\n"
+        f"  - В очереди p50 ≤ {_format_seconds(m.wait.quantile(0.5))} с, "
+        f"p99 ≤ {_format_seconds(m.wait.quantile(0.99))} с\n"
+        f"  - Обработка p50 ≤ {_format_seconds(m.handle.quantile(0.5))} с, "
+        f"p99 ≤ {_format_seconds(m.handle.quantile(0.99))} с"
+    )
+
+
 @router.message(Command("admin"))
 async def admin_command(message: Message, state: FSMContext):
-    """Точка входа в админ-панель."""
-    user_db = await user_service.register_or_update_user(message)
-    if not user_db.is_admin:
-        return
+    """Точка входа в админ-панель (только для ADMIN_IDS, см. admin_router)."""
     await state.clear()
     await message.answer(
         "<b>👑 Панель администратора</b>\nВыберите раздел для просмотра.",
@@ -53,8 +106,28 @@ async def navigate_admin_panel(call: CallbackQuery):
         )
     if action == "sinc":
         await call.message.edit_text("Запуск синхронизации...")
-        status = await admin_service.sinc_users_from_remna()
-        text = "✅ Синхронизация выполнена" if status else "‼️ Ошибка синхронизации"
+        try:
+            report = await sync_service.reconcile()
+        except Exception as e:
+            logger.warning(f"Синхронизация не выполнена: {e}")
+            text = "‼️ Ошибка синхронизации"
+        else:
+            text = (
+                f"{'✅ Синхронизация выполнена' if report.ok else '⚠️ Синхронизация выполнена частично'}\n\n"
+                f"  - Пользователей в панели: <code>{report.panel_total}</code>\n"
+                f"  - Добавлено подписок: <code>{report.created}</code> "
+                f"(новых пользователей: <code>{report.users_created}</code>)\n"
+                f"  - Обновлено: <code>{report.updated}</code>\n"
+                f"  - Без изменений: <code>{report.unchanged}</code>\n"
+                f"  - Нет в панели: <code>{report.orphaned}</code>\n"
+                f"  - Без Telegram ID: <code>{report.skipped}</code>\n"
+                f"  - Ошибочных чанков: <code>{report.failed_chunks}</code>\n\n"
+                f"⏱ Выгрузка {report.fetch_seconds:.1f} с, сверка {report.diff_seconds:.1f} с, "
+                f"запись {report.apply_seconds:.1f} с"
+            )
+
+    if action == "remna":
+        text = f"{format_remna_metrics()}\n\n{format_checkout_metrics()}\n\n{format_update_queue_metrics()}"
 
     # Для всех остальных кнопок (finance, users и т.д.) будет использовано сообщение-заглушка
 
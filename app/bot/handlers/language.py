@@ -6,7 +6,8 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from app.bot.keyboards.inlines import language_selection_buttons
 from aiogram.utils.i18n import gettext as _, I18n
-from database.models import User
+from app.bot.middlewares.i18n import locale_cache
+from app.bot.middlewares.user_context import UserContext
 from database.session import get_session
 
 router = Router(name=__name__)
@@ -23,17 +24,19 @@ async def language_command(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("set_lang:"))
-async def set_language_callback(call: CallbackQuery, i18n: I18n):
+async def set_language_callback(call: CallbackQuery, i18n: I18n, user_ctx: UserContext):
     """Обрабатывает нажатие на кнопку выбора языка."""
     lang_code = call.data.split(":")[1]
 
     if lang_code not in i18n.available_locales:
         return await call.answer("This language is not supported.", show_alert=True)
 
-    async with get_session() as session:
-        user = await User.get_by_telegram_id(session, call.from_user.id)
-        if user:
+    user = await user_ctx.get()
+    if user:
+        async with get_session() as session:
+            session.add(user)
             await user.update(session, language_code=lang_code)
+        locale_cache.set(call.from_user.id, lang_code)
 
     # Устанавливаем новую локаль для текущего запроса, чтобы ответ пришел на новом языке
     i18n.current_locale = lang_code
@@ -4,6 +4,7 @@ from app.logger import logger
 from app.bot.keyboards.inlines import (profile_buttons, active_subscriptions_buttons, payments_buttons,
                                        tariff_buttons, make_pay_link_button, tariff_buttons_buy,
                                        get_config_webapp_button, user_subscriptions_webapp_buttons)
+from app.bot.middlewares.user_context import UserContext
 from app.bot.utils.statesforms import StepForm
 from app.core.config import settings
 from app.services.subscription_service import subscription_service
@@ -13,16 +14,17 @@ from app.services.payment_service import payment_service
 from aiogram.utils.i18n import gettext as _
 
 
-async def profile_command(message: Message, state: FSMContext):
+async def profile_command(message: Message, state: FSMContext, user_ctx: UserContext):
     logger.bind(source="bot").info(f"{message.from_user.id} {message.from_user.first_name}")
-    user_db = await user_service.register_or_update_user(message)
+    user_db = await user_service.register_or_update_user(message, user_ctx=user_ctx)
+    active_subscriptions_count = await user_service.count_active_subscriptions(user_db.telegram_id)
     await message.answer(
         text=_("profile_message").format(
             referral_earnings=user_db.balance,
-            active_subscriptions_count=user_db.active_subscriptions_count
+            active_subscriptions_count=active_subscriptions_count
         ),
         reply_markup=profile_buttons(
-            active_subscriptions_count=user_db.active_subscriptions_count,
+            active_subscriptions_count=active_subscriptions_count,
             has_trial=user_db.has_trial
         )
     )
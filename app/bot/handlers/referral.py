@@ -1,6 +1,7 @@
 from aiogram.types import Message, FSInputFile
 from aiogram.fsm.context import FSMContext
 from app.bot.keyboards.inlines import referral_share_button
+from app.bot.middlewares.user_context import UserContext
 from app.logger import logger
 from app.services.user_service import user_service
 from app.core.config import settings
@@ -8,13 +9,14 @@ from aiogram.utils.i18n import gettext as _
 
 
 
-async def referral_command(message: Message, state: FSMContext):
+async def referral_command(message: Message, state: FSMContext, user_ctx: UserContext):
     logger.bind(source="bot").info(f"{message.from_user.id} {message.from_user.first_name}")
-    user_db = await user_service.register_or_update_user(message)
+    user_db = await user_service.register_or_update_user(message, user_ctx=user_ctx)
+    referrals_count = await user_service.count_invited_users(user_db.telegram_id)
     referral_image = FSInputFile("app/bot/media/referral.jpg")
     await message.answer_photo(
         caption=_("referral_message").format(
-            referrals_count=user_db.invited_users_count,
+            referrals_count=referrals_count,
             earned=user_db.balance,
             bot_name=settings.BOT_NAME,
             referral_code=user_db.referral_code,
@@ -1,8 +1,7 @@
 from aiogram.types import Message, PreCheckoutQuery
 from app.logger import logger
 from app.core.config import settings
-from app.services.payment_service import payment_service
-from app.bot.keyboards.inlines import get_config_webapp_button
+from app.services.payment_service import payment_service, PaymentOutcome
 from aiogram.utils.i18n import gettext as _
 
 async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
@@ -39,23 +38,15 @@ async def successful_payment_handler(message: Message):
         f"с payload: {external_id} от пользователя {message.from_user.id}"
     )
 
-    payment = await payment_service.get_by_external_id(external_id)
+    # Сообщение с конфигурацией отправит notification_service из outbox
+    result = await payment_service.process_payment(external_id, succeeded=True)
 
-    if not payment:
+    if result.outcome == PaymentOutcome.NOT_FOUND:
         logger.error(f"Критическая ошибка: не найден платеж с external_id/payload={external_id} после успешной оплаты.")
+    if result.outcome in (PaymentOutcome.DEFERRED, PaymentOutcome.IN_PROGRESS):
+        # Telegram не повторяет successful_payment: платеж сохранен как оплаченный, подписку
+        # выдаст фоновая задача, а сообщение с конфигурацией придет из outbox
+        await message.answer(_("payment_deferred_message"))
+    elif result.outcome != PaymentOutcome.SUCCEEDED:
         # Произошла ошибка при обработке вашего платежа. Пожалуйста, свяжитесь с поддержкой.
         await message.answer(_("error_payment"))
-        return
-    await payment_service.confirm_payment(payment.id)
-    subscription = payment.subscription
-    tariff = payment.tariff
-
-    await message.answer(
-        text=_("subscription_purchased_with_config_message").format(
-            tariff_name=tariff.name,
-            sub_name=subscription.subscription_name,
-            logo_name=settings.LOGO_NAME
-        ),
-        message_effect_id="5159385139981059251",
-        reply_markup=get_config_webapp_button(subscription.subscription_url)
-    )
@@ -1,12 +1,13 @@
 from aiogram.types import Message, FSInputFile
 from aiogram.fsm.context import FSMContext
+from app.bot.middlewares.user_context import UserContext
 from app.logger import logger
 from app.core.config import settings
 from app.services.user_service import user_service
 from aiogram.utils.i18n import gettext as _
 
 
-async def start_command(message: Message, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, user_ctx: UserContext):
     logger.bind(source="bot").info(f"{message.from_user.id} {message.from_user.first_name}")
     referral_code = None
     welcome_image = FSInputFile("app/bot/media/welcome.jpg")
@@ -15,7 +16,8 @@ async def start_command(message: Message, state: FSMContext):
 
     user_db = await user_service.register_or_update_user(
         message=message,
-        referral_code=referral_code
+        referral_code=referral_code,
+        user_ctx=user_ctx
     )
     try:
         await message.answer_photo(
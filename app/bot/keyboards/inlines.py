@@ -1,7 +1,9 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app.core.config import settings
+from database.enums import BroadcastSegment
 from database.models import Subscription, Tariff
+from app.bot.utils.admin_messages import broadcast_segment_titles
 from typing import List
 from aiogram.utils.i18n import gettext as _
 
@@ -140,6 +142,25 @@ def extend_subscription_button() -> InlineKeyboardMarkup:
     kb.button(text=_("extend_now"), callback_data="profile:extend")
     return kb.as_markup()
 
+def broadcast_segment_buttons() -> InlineKeyboardMarkup:
+    """Кнопки выбора аудитории рассылки."""
+    kb = InlineKeyboardBuilder()
+    for segment, title in broadcast_segment_titles.items():
+        kb.button(text=title, callback_data=f"segment:{segment.value}")
+    kb.button(text="❌ Отмена", callback_data="broadcast:cancel")
+    kb.adjust(1)
+    return kb.as_markup()
+
+def broadcast_segment_param_buttons(segment: BroadcastSegment, params: List[str]) -> InlineKeyboardMarkup:
+    """Кнопки выбора параметра сегмента (язык или количество дней)."""
+    kb = InlineKeyboardBuilder()
+    for param in params:
+        text = f"{param} дн." if segment == BroadcastSegment.EXPIRING_SOON else param
+        kb.button(text=text, callback_data=f"segment:{segment.value}:{param}")
+    kb.button(text="❌ Отмена", callback_data="broadcast:cancel")
+    kb.adjust(len(params), 1)
+    return kb.as_markup()
+
 def broadcast_confirmation_buttons() -> InlineKeyboardMarkup:
     """Кнопки для подтверждения или отмены рассылки."""
     kb = InlineKeyboardBuilder()
@@ -162,7 +183,8 @@ def admin_panel_buttons() -> InlineKeyboardMarkup:
     kb.button(text="💰 Финансы", callback_data="admin:finance")
     kb.button(text="🗣️ Рефералы", callback_data="admin:referrals")
     kb.button(text="📣 Рассылка", callback_data="admin:broadcast")
-    kb.adjust(1, 1, 2, 2)
+    kb.button(text="⏱ Задержки запросов", callback_data="admin:remna")
+    kb.adjust(1, 1, 2, 2, 1)
     return kb.as_markup()
 
 def back_to_admin_panel_button() -> InlineKeyboardMarkup:
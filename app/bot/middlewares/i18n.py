@@ -3,12 +3,20 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from aiogram.utils.i18n import I18n
 
+from app.bot.middlewares.user_context import UserContext
+from app.core.cache import TTLCache
 from app.core.config import settings
-from database.models import User
-from database.session import get_session
 
 i18n = I18n(path=settings.LOCALES_DIR, default_locale=settings.DEFAULT_LANGUAGE, domain="messages")
 
+# Кэш языка пользователя по telegram_id, чтобы не ходить в БД на каждый апдейт.
+# Кэш живет в процессе, поэтому при нескольких воркерах TTL короткий (см. LOCALE_CACHE_TTL_MULTIWORKER)
+locale_cache: TTLCache[str] = TTLCache(
+    maxsize=settings.LOCALE_CACHE_SIZE,
+    ttl=settings.LOCALE_CACHE_TTL if settings.WEB_CONCURRENCY <= 1
+    else min(settings.LOCALE_CACHE_TTL, settings.LOCALE_CACHE_TTL_MULTIWORKER)
+)
+
 
 class I18nMiddleware(BaseMiddleware):
     async def __call__(
@@ -22,9 +30,18 @@ class I18nMiddleware(BaseMiddleware):
         if not user:
             user_locale = settings.DEFAULT_LANGUAGE
         else:
-            async with get_session() as session:
-                db_user = await User.get_by_telegram_id(session, user.id)
-                user_locale = db_user.language_code if db_user else user.language_code
+            # Контекст пользователя на время апдейта, хендлеры получают его как user_ctx
+            user_ctx = UserContext(user.id)
+            data["user_ctx"] = user_ctx
+
+            user_locale = locale_cache.get(user.id)
+            if user_locale is None:
+                db_user = await user_ctx.get()
+                if db_user:
+                    user_locale = db_user.language_code
+                    locale_cache.set(user.id, user_locale)
+                else:
+                    user_locale = user.language_code
 
         if user_locale not in i18n.available_locales:
             user_locale = settings.DEFAULT_LANGUAGE
@@ -38,4 +55,4 @@ class I18nMiddleware(BaseMiddleware):
             return await handler(event, data)
 
 
-i18n_middleware = I18nMiddleware()
\ No newline at end of file
+i18n_middleware = I18nMiddleware()
@@ -0,0 +1,37 @@
+from typing import Optional
+
+from database.models import User
+from database.session import get_session
+
+
+class UserContext:
+    """
+    Пользователь из нашей БД в рамках обработки одного апдейта.
+    Создается в I18nMiddleware и передается в хендлеры через data["user_ctx"],
+    чтобы middleware и хендлеры не загружали одного и того же пользователя несколько раз.
+    """
+
+    def __init__(self, telegram_id: int):
+        self.telegram_id = telegram_id
+        self._user: Optional[User] = None
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def get(self) -> Optional[User]:
+        """
+        Загружает профиль пользователя из БД при первом обращении и дальше отдает закэшированный объект.
+        Связи (подписки, рефералы) не загружаются, см. User.get_profile.
+        """
+        if not self._loaded:
+            async with get_session() as session:
+                self._user = await User.get_profile(session, self.telegram_id)
+            self._loaded = True
+        return self._user
+
+    def set(self, user: Optional[User]) -> None:
+        """Подменяет пользователя в контексте (например, после регистрации)."""
+        self._user = user
+        self._loaded = True
@@ -1,3 +1,5 @@
+from database.enums import BroadcastSegment
+
 broadcast_start_message = """
 📢 <b>Режим рассылки</b>
 
@@ -10,4 +12,15 @@ broadcast_start_message = """
 admin_panel_start_message = """
 <b>👑 Панель администратора</b>
 Выберите раздел для просмотра статистики.
-"""
\ No newline at end of file
+"""
+
+
+broadcast_segment_titles = {
+    BroadcastSegment.ALL: "👥 Все активные",
+    BroadcastSegment.LOCALE: "🌐 По языку",
+    BroadcastSegment.ACTIVE_SUBSCRIPTION: "✅ С активной подпиской",
+    BroadcastSegment.EXPIRED_SUBSCRIPTION: "⌛ Подписка истекла",
+    BroadcastSegment.TRIAL_ONLY: "🎁 Только триал",
+    BroadcastSegment.NEVER_PAID: "💸 Ни разу не платили",
+    BroadcastSegment.EXPIRING_SOON: "⏰ Подписка скоро истекает",
+}
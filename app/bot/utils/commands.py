@@ -1,9 +1,39 @@
 # app/bot/utils/commands.py
 
-from aiogram.types import BotCommand, BotCommandScopeDefault
-# from aiogram import Bot
+import asyncio
+import hashlib
+import json
+from typing import List, Optional, Tuple
+
+from aiogram.types import BotCommand, BotCommandScopeChat, BotCommandScopeDefault, BotCommandScopeUnion
 from app.core.config import settings
 from app.bot.middlewares.i18n import i18n  # <-- Импортируем наш i18n объект
+from app.logger import logger
+from database.models import AppSetting
+from database.session import get_session
+
+# Команды для всех пользователей: команда -> ключ перевода описания
+USER_COMMANDS = {
+    "start": "command-start-description",
+    "profile": "command-profile-description",
+    "referral": "command-referral-description",
+    "help": "command-help-description",
+    "about": "command-about-description",
+    "language": "command-language-description",
+}
+
+# Команды администраторов (ADMIN_IDS). Админ-панель не локализована, описания на русском
+ADMIN_COMMANDS = {
+    "admin": "Панель администратора",
+    "broadcast": "Рассылка",
+    "refund": "Возврат Telegram Stars",
+}
+
+# Ключ в app_settings: хэши зарегистрированных наборов команд по (область, язык)
+# и админы, которым выданы админские команды
+COMMANDS_SETTING_KEY = "bot_commands"
+
+CommandSet = Tuple[BotCommandScopeUnion, Optional[str], List[BotCommand]]
 
 
 async def start_bot() -> None:
@@ -13,40 +43,107 @@ async def start_bot() -> None:
     await set_commands()
 
 
-async def set_commands():
+def command_languages() -> List[Optional[str]]:
     """
-    Устанавливает локализованные команды для каждого поддерживаемого языка.
+    Языки, для которых регистрируются команды. None — набор без language_code на языке
+    DEFAULT_LANGUAGE: его видят пользователи, чей язык Telegram не поддерживается.
     """
-    commands = {
-        "start": "command-start-description",
-        "profile": "command-profile-description",
-        "referral": "command-referral-description",
-        "help": "command-help-description",
-        "about": "command-about-description",
-        "language": "command-language-description",
-    }
+    return [*i18n.available_locales, None]
 
-    # Устанавливаем команды для каждого языка из нашего списка
-    for lang_code in i18n.available_locales:
-        # Устанавливаем контекст для функции _()
-        with i18n.context(lang_code):
-            # Создаем список объектов BotCommand с переведенными описаниями
+
+def build_command_sets() -> List[CommandSet]:
+    """
+    Собирает команды для каждой пары (область, язык): общие команды для всех
+    и расширенный список в личном чате каждого администратора.
+    """
+    command_sets = []
+    for lang_code in command_languages():
+        # Переключаем язык для gettext на время сборки описаний
+        with i18n.use_locale(lang_code or settings.DEFAULT_LANGUAGE):
             localized_commands = [
-                BotCommand(
-                    command=command_name,
-                    description=i18n.gettext(description_key)
-                )
-                for command_name, description_key in commands.items()
+                BotCommand(command=command_name, description=i18n.gettext(description_key))
+                for command_name, description_key in USER_COMMANDS.items()
             ]
+        command_sets.append((BotCommandScopeDefault(), lang_code, localized_commands))
+
+        admin_commands = localized_commands + [
+            BotCommand(command=command_name, description=description)
+            for command_name, description in ADMIN_COMMANDS.items()
+        ]
+        for admin_id in settings.ADMIN_IDS:
+            command_sets.append((BotCommandScopeChat(chat_id=admin_id), lang_code, admin_commands))
+    return command_sets
+
+
+def command_set_key(scope: BotCommandScopeUnion, lang_code: Optional[str]) -> str:
+    """Ключ набора команд в сохраненных хэшах: область и язык."""
+    return json.dumps([scope.model_dump(mode="json"), lang_code], sort_keys=True)
+
+
+def hash_commands(commands: List[BotCommand]) -> str:
+    """Хэш списка команд. Учитывает бота: при смене токена команды регистрируются заново."""
+    payload = [settings.WEBHOOK_SECRET, [[c.command, c.description] for c in commands]]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+
+async def set_commands() -> None:
+    """
+    Устанавливает локализованные команды для каждого поддерживаемого языка.
+
+    Хэш каждого набора (область, язык) хранится в БД (app_settings): Telegram вызывается
+    только для изменившихся наборов, вызовы set_my_commands выполняются параллельно.
+    У администраторов, исключенных из ADMIN_IDS, админские команды удаляются.
+    Сохраняются только успешные вызовы, поэтому неудавшиеся (например, админ еще не писал боту)
+    повторяются при следующем запуске.
+    """
+    command_sets = {
+        command_set_key(scope, lang_code): (scope, lang_code, commands)
+        for scope, lang_code, commands in build_command_sets()
+    }
+    hashes = {key: hash_commands(commands) for key, (_scope, _lang, commands) in command_sets.items()}
+
+    async with get_session() as session:
+        stored = await AppSetting.get_value(session, COMMANDS_SETTING_KEY) or {}
+    stored_hashes = stored.get("hashes", {})
+    changed_keys = [key for key, commands_hash in hashes.items() if stored_hashes.get(key) != commands_hash]
+    removed = [
+        (admin_id, lang_code)
+        for admin_id in set(stored.get("admin_ids", [])) - set(settings.ADMIN_IDS)
+        for lang_code in command_languages()
+    ]
+    if not changed_keys and not removed:
+        logger.info("Команды бота не изменились, регистрация пропущена")
+        return
+
+    semaphore = asyncio.Semaphore(settings.BOT_COMMANDS_CONCURRENCY)
+
+    async def call(method, **kwargs) -> bool:
+        async with semaphore:
+            try:
+                await method(**kwargs)
+                return True
+            except Exception as e:
+                logger.warning(f"Не удалось зарегистрировать команды бота ({kwargs['scope']}): {e}")
+                return False
+
+    results = await asyncio.gather(*[
+        call(settings.BOT.set_my_commands, scope=scope, language_code=lang_code, commands=commands)
+        for scope, lang_code, commands in (command_sets[key] for key in changed_keys)
+    ] + [
+        call(settings.BOT.delete_my_commands, scope=BotCommandScopeChat(chat_id=admin_id), language_code=lang_code)
+        for admin_id, lang_code in removed
+    ])
+    set_results, delete_results = results[:len(changed_keys)], results[len(changed_keys):]
+
+    # Сохраняем хэши только успешно зарегистрированных наборов, остальные повторим при следующем запуске
+    failed_keys = {key for key, ok in zip(changed_keys, set_results) if not ok}
+    new_hashes = {key: commands_hash for key, commands_hash in hashes.items() if key not in failed_keys}
+    # Админов, у которых не удалось удалить команды, оставляем в списке, чтобы повторить удаление
+    failed_admins = {admin_id for (admin_id, _lang), ok in zip(removed, delete_results) if not ok}
 
-            # Устанавливаем команды для конкретного языка
-            await settings.BOT.set_my_commands(
-                commands=localized_commands,
-                scope=BotCommandScopeDefault(),
-                language_code=lang_code
-            )
-
-    # Опционально: можно установить команды для языка по умолчанию (для тех, у кого нет нашего языка)
-    # with i18n.context(settings.DEFAULT_LANGUAGE):
-    #     default_commands = [ ... ]
-    #     await bot.set_my_commands(commands=default_commands, scope=BotCommandScopeDefault())
\ No newline at end of file
+    async with get_session() as session:
+        await AppSetting.set_value(
+            session, COMMANDS_SETTING_KEY,
+            {"hashes": new_hashes, "admin_ids": list(settings.ADMIN_IDS) + sorted(failed_admins)}
+        )
+    logger.info(f"Команды бота зарегистрированы: {len(results)} вызовов, ошибок: {results.count(False)}")
@@ -0,0 +1,67 @@
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database.models import FsmState
+
+
+def _session():
+    # database.session импортирует settings, а хранилище создается внутри Settings,
+    # поэтому модуль сессий подключаем при первом обращении
+    from database.session import get_session
+    return get_session()
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в нашей БД (таблица fsm_states). Общее для всех воркеров uvicorn,
+    поэтому сценарии вроде оформления покупки (StepForm) работают при --workers > 1 без Redis.
+    """
+
+    def __init__(self):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        async with _session() as session:
+            await FsmState.save(session, self.key_builder.build(key), state=value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with _session() as session:
+            record = await FsmState.get(session, self.key_builder.build(key))
+            return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with _session() as session:
+            if data:
+                await FsmState.save(session, self.key_builder.build(key), data=dict(data))
+            else:
+                await FsmState.clear_data(session, self.key_builder.build(key))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with _session() as session:
+            record = await FsmState.get(session, self.key_builder.build(key))
+            return dict(record.data) if record and record.data else {}
+
+    async def close(self) -> None:
+        pass
+
+
+def build_fsm_storage(uri: str) -> BaseStorage:
+    """
+    Создает FSM-хранилище по URI: memory:// (в процессе), database:// (наша БД)
+    или redis://host:port/db (нужен пакет redis).
+    """
+    if uri.startswith("memory://"):
+        return MemoryStorage()
+    if uri.startswith("database://"):
+        return DatabaseStorage()
+    if uri.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError(f"Для FSM-хранилища {uri} нужен пакет redis") from e
+        return RedisStorage.from_url(uri)
+    raise ValueError(f"Неподдерживаемое FSM-хранилище: {uri}")
@@ -23,6 +23,7 @@ class StepForm(StatesGroup):
 
     # Админская рассылка
     WAITING_BROADCAST_MESSAGE = State() # Ожидание сообщения от админа
+    CHOOSE_BROADCAST_SEGMENT = State()  # Выбор аудитории рассылки
     CONFIRM_BROADCAST = State()         # Ожидание подтверждения рассылки
 
     # Подписка
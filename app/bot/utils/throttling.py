@@ -1,18 +1,31 @@
-from collections import defaultdict
-import time
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, Optional, Tuple
 
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
+from app.core.rate_limit import RateLimitStore
 from app.logger import logger
 
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, limit: float = 0.5, key_prefix: str = 'antiflood_'):
-        self.limit = limit
+    """
+    Антиспам: ограничивает частоту действий пользователя скользящим окном в RateLimitStore.
+
+    :param store: Хранилище окон (в памяти процесса или общее в Redis).
+    :param limits: Лимиты по действиям: действие -> (число действий, окно в секундах).
+        Для команды сначала ищется "command:<команда>", для callback — "callback:<префикс data>",
+        затем общие "message" и "callback". Действия без лимита не ограничиваются.
+    """
+
+    def __init__(
+            self,
+            store: RateLimitStore,
+            limits: Dict[str, Tuple[int, float]],
+            key_prefix: str = 'antiflood'
+    ):
+        self.store = store
+        self.limits = limits
         self.key_prefix = key_prefix
-        self.user_calls = defaultdict(list)
         super().__init__()
 
     async def __call__(
@@ -21,30 +34,33 @@ class ThrottlingMiddleware(BaseMiddleware):
         event: Message | CallbackQuery,
         data: Dict[str, Any]
     ):
-        user_id = event.from_user.id
-        current_time = time.time()
-
-        action = "message" if isinstance(event, Message) else "callback"
-        key = f"{self.key_prefix}_{user_id}_{action}"
-
-        if key in self.user_calls:
-            time_diff = current_time - self.user_calls[key][-1]
-            if time_diff < self.limit:
+        action = self._resolve_action(event)
+        if action is not None:
+            limit, window = self.limits[action]
+            key = f"{self.key_prefix}:{event.from_user.id}:{action}"
+            if not await self.store.hit(key, limit, window):
                 await self.handle_throttle(event)
                 return  # пропускаем хендлер
 
-        self.user_calls[key].append(current_time)
-
-        # Чистим лишние записи
-        if len(self.user_calls[key]) > 10:
-            self.user_calls[key] = self.user_calls[key][-5:]
-
         return await handler(event, data)
 
+    def _resolve_action(self, event: Message | CallbackQuery) -> Optional[str]:
+        """Возвращает самое точное действие, для которого задан лимит."""
+        if isinstance(event, Message):
+            general = "message"
+            text = event.text or ""
+            specific = f"command:{text.split()[0][1:].split('@')[0]}" if text.startswith("/") else None
+        else:
+            general = "callback"
+            specific = f"callback:{event.data.split(':')[0]}" if event.data else None
+        if specific in self.limits:
+            return specific
+        return general if general in self.limits else None
+
     async def handle_throttle(self, event: Message | CallbackQuery):
         if isinstance(event, Message):
             logger.bind(source="bot").warning(f"Spam {event.from_user.id} {event.from_user.first_name}")
             await event.answer("⚠️ Слишком много запросов! Пожалуйста, подождите.")
         elif isinstance(event, CallbackQuery):
             logger.bind(source="bot").warning(f"Spam {event.from_user.id} {event.from_user.first_name}")
-            await event.answer("⏳ Не так быстро! Подождите немного.", show_alert=True)
\ No newline at end of file
+            await event.answer("⏳ Не так быстро! Подождите немного.", show_alert=True)
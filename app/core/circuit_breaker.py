@@ -0,0 +1,73 @@
+import enum
+import time
+from typing import Optional
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"        # Запросы идут как обычно
+    OPEN = "open"            # Запросы сразу отклоняются
+    HALF_OPEN = "half_open"  # Пропускается пробный запрос
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонен, потому что цепь разомкнута."""
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты для вызовов внешнего сервиса.
+
+    После `failure_threshold` ошибок подряд цепь размыкается на `reset_timeout` секунд.
+    Затем пропускается один пробный запрос (half-open): успех замыкает цепь,
+    ошибка снова размыкает ее на `reset_timeout`.
+    Рассчитан на использование из asyncio-кода одного процесса, поэтому без блокировок.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = CircuitState.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        """Через сколько секунд цепь разрешит пробный запрос (None, если не разомкнута)."""
+        if self.state != CircuitState.OPEN:
+            return None
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас. В half-open разрешает только один пробный запрос."""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Возвращает право на пробный запрос, если он был отменен, не дав результата."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
@@ -1,10 +1,13 @@
 import os
-from typing import List, Optional
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from remnawave import RemnawaveSDK
+
+if TYPE_CHECKING:
+    import httpx
+    from aiogram import Bot, Dispatcher
+    from remnawave import RemnawaveSDK
 
 
 class Settings(BaseSettings):
@@ -42,9 +45,15 @@ class Settings(BaseSettings):
     # --- Payments ---
     YOOKASSA_TOKEN: Optional[str] = None
     YOOKASSA_SHOP_ID: Optional[str] = None
+    YOOKASSA_API_URL: str = "https://api.yookassa.ru/v3"
+    YOOKASSA_TIMEOUT: float = 10.0
+    YOOKASSA_MAX_RETRIES: int = 3
+    YOOKASSA_RETRY_DELAY: float = 0.5  # Базовая задержка повтора (сек), растет экспоненциально
     CRYPTO_TOKEN: Optional[str] = None
     TELEGRAM_STARS: bool = False
     RUB_PER_STAR: float = 1.79
+    PAYMENT_PROCESSING_TIMEOUT: int = 300  # Через сколько секунд незавершенную обработку платежа можно повторить
+    PAYMENT_RETRY_INTERVAL: int = 60  # Как часто повторять выдачу подписок по оплаченным платежам (сек)
 
     # --- Infrastructure ---
     DOMAIN_API: str
@@ -54,12 +63,111 @@ class Settings(BaseSettings):
     REMNAWAVE_BASE_URL: str
     REMNAWAVE_TOKEN: str
     REMNAWAVE_WEBHOOK_SECRET: Optional[str] = None
-
-    # --- Application State Objects (не из .env, будут инициализированы ниже) ---
-    # Мы объявляем их здесь, чтобы иметь доступ через settings.BOT, settings.REMNA_SDK
-    BOT: Optional[Bot] = None
-    DP_BOT: Optional[Dispatcher] = None
-    REMNA_SDK: Optional[RemnawaveSDK] = None
+    # Пул соединений к панели
+    REMNA_HTTP_TIMEOUT: float = 10.0
+    REMNA_HTTP_MAX_CONNECTIONS: int = 50
+    REMNA_HTTP_MAX_KEEPALIVE: int = 20
+    REMNA_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    REMNA_HTTP2: bool = True  # Работает, только если установлен пакет h2
+    # Таймауты отдельных эндпоинтов (ключ — префикс "МЕТОД /api/путь")
+    REMNA_HTTP_ENDPOINT_TIMEOUTS: Dict[str, float] = {
+        "GET /api/users": 30.0,
+        "GET /api/internal-squads": 5.0,
+    }
+
+    # --- Рассылки ---
+    # Telegram допускает ~30 сообщений в секунду на бота и ~1 в секунду в один чат.
+    # Каждый чат получает одно сообщение за рассылку, поэтому ограничиваем только общий поток.
+    BROADCAST_RATE_PER_SECOND: float = 25
+    BROADCAST_WORKERS: int = 8
+    BROADCAST_PAGE_SIZE: int = 500
+    BROADCAST_MAX_RETRIES: int = 3
+    BROADCAST_PROGRESS_INTERVAL: int = 15  # Как часто (сек) обновлять прогресс у админа
+    BROADCAST_AUDIENCE_CACHE_TTL: int = 60  # Сколько секунд держим посчитанный размер аудитории
+    # Сколько секунд процесс держит рассылку без сохранения прогресса. Должно с запасом превышать
+    # время отправки одной страницы (BROADCAST_PAGE_SIZE / BROADCAST_RATE_PER_SECOND)
+    BROADCAST_LEASE_TTL: int = 300
+
+    # --- Очередь вебхуков Remnawave ---
+    REMNA_WEBHOOK_WORKERS: int = 4
+    REMNA_WEBHOOK_MAX_ATTEMPTS: int = 5
+    REMNA_WEBHOOK_RETRY_DELAY: int = 5  # Базовая задержка ретрая (сек), растет экспоненциально
+    REMNA_WEBHOOK_POLL_INTERVAL: float = 2.0
+    REMNA_WEBHOOK_LOCK_TIMEOUT: int = 300  # Через сколько секунд зависшая задача возвращается в очередь
+    REMNA_WEBHOOK_DEDUP_TTL: int = 300  # Сколько секунд помним уже принятые вебхуки
+    REMNA_WEBHOOK_DEDUP_SIZE: int = 10_000
+    REMNA_WEBHOOK_DEBOUNCE: float = 1.5  # Окно склейки событий одного UUID (сек)
+    REMNA_WEBHOOK_COALESCE_EVENTS: List[str] = ["user.modified"]  # События, которые можно склеивать
+    REMNA_WEBHOOK_RETENTION_DAYS: int = 7  # Сколько дней хранить обработанные задачи webhook_jobs
+
+    # --- Несколько воркеров uvicorn ---
+    # Та же переменная задает число воркеров uvicorn по умолчанию (--workers)
+    WEB_CONCURRENCY: int = 1
+    # FSM-хранилище: memory:// (только один воркер), database:// (наша БД) или redis://host:port/db
+    FSM_STORAGE_URI: str = "memory://"
+    STARTUP_LEASE_TTL: float = 60.0  # Сколько секунд после старта другие процессы не повторяют общую настройку
+
+    # --- Обработка апдейтов Telegram ---
+    BOT_UPDATES_ASYNC: bool = True  # Отвечать Telegram сразу, обрабатывая апдейты в фоне
+    BOT_UPDATE_QUEUE_SIZE: int = 1000  # При переполнении вебхук ждет места (backpressure)
+    BOT_UPDATE_WORKERS: int = 16
+    BOT_UPDATE_DRAIN_TIMEOUT: float = 10.0  # Сколько секунд дорабатывать очередь при остановке
+    BOT_COMMANDS_CONCURRENCY: int = 5  # Параллельных вызовов set_my_commands при регистрации команд
+
+    # --- Ограничение частоты запросов ---
+    # Общее хранилище для антиспама бота и лимитов API: memory:// (в процессе) или redis://host:port/db
+    RATE_LIMIT_STORAGE_URI: str = "memory://"
+    RATE_LIMIT_MEMORY_MAX_KEYS: int = 100_000
+    # Лимиты действий в боте: действие -> [число действий, окно в секундах].
+    # Действие: "message", "callback", а также точнее "command:<команда>" и "callback:<префикс data>"
+    THROTTLE_LIMITS: Dict[str, Tuple[int, float]] = {
+        "message": (1, 0.2),
+        "callback": (1, 0.2),
+    }
+
+    # --- Уведомления пользователям (outbox) ---
+    # Вместе с BROADCAST_RATE_PER_SECOND не должно превышать общий лимит Telegram на бота
+    NOTIFY_RATE_PER_SECOND: float = 5
+    NOTIFY_WORKERS: int = 4
+    NOTIFY_MAX_ATTEMPTS: int = 5
+    NOTIFY_RETRY_DELAY: int = 5  # Базовая задержка ретрая (сек), растет экспоненциально
+    NOTIFY_POLL_INTERVAL: float = 2.0
+    NOTIFY_LOCK_TIMEOUT: int = 300  # Через сколько секунд зависшее уведомление возвращается в очередь
+    NOTIFY_RETENTION_DAYS: int = 7  # Сколько дней хранить отправленные уведомления
+
+    # --- Защита от недоступности Remnawave ---
+    REMNA_CALL_TIMEOUT: float = 8.0  # Предельное время вызова панели на пути покупки (сек)
+    REMNA_BREAKER_FAILURE_THRESHOLD: int = 5  # Ошибок подряд до размыкания цепи
+    REMNA_BREAKER_RESET_TIMEOUT: float = 30.0  # Через сколько секунд пробовать панель снова
+    REMNA_DEFERRED_REPLAY_INTERVAL: float = 15.0  # Как часто досылать отложенные изменения
+    REMNA_DEFERRED_MAX_ATTEMPTS: int = 20
+
+    # --- Пул заранее созданных пользователей Remnawave ---
+    REMNA_POOL_SIZE: int = 10  # 0 — пул выключен, пользователь создается при оплате
+    REMNA_POOL_REFILL_INTERVAL: float = 30.0
+    REMNA_POOL_REFILL_CONCURRENCY: int = 2
+    REMNA_PENDING_TTL_HOURS: int = 24  # Через сколько часов удалять неоплаченные заготовки
+    REMNA_PENDING_REAP_INTERVAL: float = 3600.0
+
+    # --- Кэш отрядов Remnawave ---
+    REMNA_SQUADS_CACHE_TTL: int = 300
+    REMNA_SQUADS_STALE_WHILE_REVALIDATE: bool = True  # Отдавать устаревший список, обновляя его в фоне
+    # События, после которых список отрядов нужно перечитать
+    REMNA_SQUADS_INVALIDATE_EVENTS: List[str] = [
+        "node.created", "node.modified", "node.deleted", "node.enabled", "node.disabled", "service.panel_started",
+    ]
+
+    # --- Синхронизация с Remnawave ---
+    REMNA_SYNC_PAGE_SIZE: int = 500
+    REMNA_SYNC_CONCURRENCY: int = 5  # Сколько страниц панели запрашиваем одновременно
+    REMNA_SYNC_CHUNK_SIZE: int = 500  # Строк в одной транзакции при записи в БД
+
+    # --- Кэширование ---
+    LOCALE_CACHE_TTL: int = 600  # Сколько секунд держим язык пользователя в памяти
+    # При WEB_CONCURRENCY > 1 кэш языка в каждом воркере свой, и смену языка видит только
+    # воркер, обработавший /language: держим язык недолго, чтобы остальные быстро подхватили ее
+    LOCALE_CACHE_TTL_MULTIWORKER: int = 5
+    LOCALE_CACHE_SIZE: int = 50_000
 
     # Конфигурация Pydantic: указываем, что нужно читать из файла .env
     model_config = SettingsConfigDict(
@@ -68,23 +176,45 @@ class Settings(BaseSettings):
         extra='ignore'  # Игнорировать лишние переменные в .env
     )
 
-    def __init__(self, **values):
-        """
-        Инициализатор, который сначала загружает переменные из .envex,
-        а затем инициализирует сложные объекты, такие как Bot и SDK.
-        """
-        super().__init__(**values)
+    # --- Application State Objects (не из .env) ---
+    # Создаются при первом обращении (обычно в lifespan), а не при импорте настроек:
+    # импорт aiogram и SDK занимает секунды, а Alembic и скриптам они не нужны.
+
+    @cached_property
+    def BOT(self) -> "Bot":
+        from aiogram import Bot
+        from aiogram.client.default import DefaultBotProperties
+
+        return Bot(token=self.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
 
-        # --- Инициализация сложных объектов ПОСЛЕ загрузки всех переменных ---
+    @cached_property
+    def DP_BOT(self) -> "Dispatcher":
+        from aiogram import Dispatcher
+        from app.bot.utils.fsm_storage import build_fsm_storage
 
-        # 1. Инициализация Aiogram Bot и Dispatcher
-        self.BOT = Bot(token=self.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-        self.DP_BOT = Dispatcher()
-        self.REMNA_SDK = RemnawaveSDK(
+        return Dispatcher(storage=build_fsm_storage(self.FSM_STORAGE_URI))
+
+    @cached_property
+    def REMNA_HTTP_CLIENT(self) -> "httpx.AsyncClient":
+        from app.core.remna_client import build_remna_client
+
+        return build_remna_client(
             base_url=self.REMNAWAVE_BASE_URL,
             token=self.REMNAWAVE_TOKEN,
+            timeout=self.REMNA_HTTP_TIMEOUT,
+            max_connections=self.REMNA_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=self.REMNA_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=self.REMNA_HTTP_KEEPALIVE_EXPIRY,
+            http2=self.REMNA_HTTP2,
+            endpoint_timeouts=self.REMNA_HTTP_ENDPOINT_TIMEOUTS,
         )
 
+    @cached_property
+    def REMNA_SDK(self) -> "RemnawaveSDK":
+        from remnawave import RemnawaveSDK
+
+        return RemnawaveSDK(client=self.REMNA_HTTP_CLIENT)
+
     @property
     def WEBHOOK_BOT_PATH(self) -> str:
         return f"/bot/webhook/{self.BOT_TOKEN}"
@@ -1,5 +1,10 @@
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
+from app.core.config import settings
+from app.core.rate_limit import build_rate_limit_store
 
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+# Лимиты API и антиспам бота хранятся в одном хранилище (RATE_LIMIT_STORAGE_URI),
+# поэтому при нескольких воркерах uvicorn и с Redis они общие для всех процессов
+limiter = Limiter(key_func=get_remote_address, storage_uri=settings.RATE_LIMIT_STORAGE_URI, key_prefix="api")
+rate_limit_store = build_rate_limit_store(settings.RATE_LIMIT_STORAGE_URI, max_keys=settings.RATE_LIMIT_MEMORY_MAX_KEYS)
@@ -0,0 +1,139 @@
+import bisect
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Границы корзин гистограммы задержек (сек)
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами, как в Prometheus."""
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    counts: List[int] = field(default_factory=list)
+    total: int = 0
+    sum: float = 0.0
+
+    def __post_init__(self):
+        if not self.counts:
+            # Последняя корзина — все, что больше верхней границы
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по верхней границе корзины. Для последней корзины — None (больше максимума)."""
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else None
+        return None
+
+
+@dataclass
+class EndpointStats:
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    errors: int = 0
+    in_flight: int = 0
+
+
+class HttpMetrics:
+    """
+    Метрики исходящих HTTP-запросов в памяти процесса:
+    гистограмма задержек, число ошибок и запросов в полете для каждого эндпоинта.
+    """
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+
+    def _get(self, endpoint: str) -> EndpointStats:
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def started(self, endpoint: str) -> None:
+        self._get(endpoint).in_flight += 1
+
+    def finished(self, endpoint: str, duration: float, error: bool) -> None:
+        stats = self._get(endpoint)
+        stats.in_flight -= 1
+        stats.latency.observe(duration)
+        if error:
+            stats.errors += 1
+
+    @property
+    def in_flight(self) -> int:
+        return sum(stats.in_flight for stats in self.endpoints.values())
+
+    def reset(self) -> None:
+        self.endpoints.clear()
+
+
+class StageMetrics:
+    """Гистограммы длительности этапов многошагового процесса (например, оформления оплаты)."""
+
+    def __init__(self):
+        self.stages: Dict[str, LatencyHistogram] = {}
+
+    def observe(self, stage: str, duration: float) -> None:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = LatencyHistogram()
+        histogram.observe(duration)
+
+    @contextmanager
+    def measure(self, stage: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+        """
+        Замеряет длительность блока как этапа stage.
+
+        :param timings: Словарь, куда дополнительно записать длительность (для лога конкретного запроса).
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self.observe(stage, duration)
+            if timings is not None:
+                timings[stage] = duration
+
+    def reset(self) -> None:
+        self.stages.clear()
+
+
+@dataclass
+class QueueMetrics:
+    """Метрики очереди в памяти процесса: глубина, ожидание места (backpressure), время в очереди и обработки."""
+    depth: int = 0
+    max_depth: int = 0
+    enqueued: int = 0
+    processed: int = 0
+    failed: int = 0
+    # Сколько раз постановка ждала свободного места и сколько всего ждала
+    full_waits: int = 0
+    full_wait_seconds: float = 0.0
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)
+    handle: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def enqueue(self) -> None:
+        self.enqueued += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def done(self, waited: float, duration: float, error: bool) -> None:
+        self.depth -= 1
+        self.processed += 1
+        self.wait.observe(waited)
+        self.handle.observe(duration)
+        if error:
+            self.failed += 1
@@ -0,0 +1,150 @@
+import asyncio
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Deque
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket: не более `rate` операций в секунду с запасом `capacity`.
+    Поддерживает общую паузу (например, на время TelegramRetryAfter), которая
+    останавливает всех, кто ждет токен.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Ждет, пока появится свободный токен, и забирает его."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов на указанное время и сбрасывает накопленный запас."""
+        paused_until = time.monotonic() + seconds
+        if paused_until > self._paused_until:
+            self._paused_until = paused_until
+            self._tokens = 0
+            self._updated_at = paused_until
+
+
+class RateLimitStore(ABC):
+    """
+    Хранилище скользящих окон для ограничения частоты действий.
+    Реализации: в памяти процесса (MemoryRateLimitStore) и в Redis (RedisRateLimitStore),
+    общее для всех воркеров приложения.
+    """
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        """
+        Засчитывает действие, если за последние window секунд по ключу было меньше limit действий.
+
+        :return: False, если лимит исчерпан (действие не засчитывается).
+        """
+
+    async def close(self) -> None:
+        """Освобождает ресурсы хранилища."""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Скользящее окно в памяти процесса. Хранит не больше max_keys ключей:
+    при переполнении вытесняются ключи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = time.monotonic()
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque()
+            if len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+        else:
+            self._hits.move_to_end(key)
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= limit:
+            return False
+        hits.append(now)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+
+# Скользящее окно на sorted set: проверка и запись одной атомарной операцией
+_REDIS_HIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return 1
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Скользящее окно в Redis (или совместимом сервере с поддержкой EVAL).
+    Ключи живут не дольше окна, поэтому память не растет с числом пользователей.
+    """
+
+    def __init__(self, client, key_prefix: str = "ratelimit:"):
+        self._client = client
+        self._key_prefix = key_prefix
+        self._script = client.register_script(_REDIS_HIT_SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = time.time()
+        allowed = await self._script(
+            keys=[self._key_prefix + key],
+            args=[now, window, limit, f"{now}:{uuid.uuid4().hex[:8]}"]
+        )
+        return bool(allowed)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def build_rate_limit_store(uri: str, max_keys: int = 100_000) -> RateLimitStore:
+    """
+    Создает хранилище по URI в формате limits/slowapi: memory:// или redis://host:port/db.
+    """
+    if uri.startswith("memory://"):
+        return MemoryRateLimitStore(max_keys=max_keys)
+    if uri.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError(f"Для хранилища лимитов {uri} нужен пакет redis") from e
+        return RedisRateLimitStore(Redis.from_url(uri))
+    raise ValueError(f"Неподдерживаемое хранилище лимитов: {uri}")
@@ -0,0 +1,102 @@
+import importlib.util
+import re
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from app.core.metrics import HttpMetrics
+
+# UUID, числовые id и короткие UUID/токены (длинные сегменты, содержащие цифру)
+_ID_SEGMENT = re.compile(r"/(?:[0-9a-fA-F-]{32,36}|\d+|(?=[A-Za-z_-]*\d)[A-Za-z0-9_-]{12,})(?=/|$)")
+
+remna_metrics = HttpMetrics()
+
+
+def endpoint_name(request: httpx.Request) -> str:
+    """Имя эндпоинта для метрик: метод и путь с заменой идентификаторов на {id}."""
+    return f"{request.method} {_ID_SEGMENT.sub('/{id}', request.url.path)}"
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт-обертка: подставляет таймаут эндпоинта и пишет метрики в HttpMetrics.
+    Задержка считается до получения заголовков ответа.
+    """
+
+    def __init__(
+            self,
+            transport: httpx.AsyncBaseTransport,
+            metrics: HttpMetrics,
+            endpoint_timeouts: Optional[Dict[str, float]] = None
+    ):
+        self._transport = transport
+        self._metrics = metrics
+        self._endpoint_timeouts = endpoint_timeouts or {}
+
+    def _timeout_for(self, endpoint: str) -> Optional[float]:
+        # Ключи вида "GET /api/users" сравниваются по префиксу, побеждает самый длинный
+        matches = [key for key in self._endpoint_timeouts if endpoint.startswith(key)]
+        if not matches:
+            return None
+        return self._endpoint_timeouts[max(matches, key=len)]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_name(request)
+        timeout = self._timeout_for(endpoint)
+        if timeout is not None:
+            request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+
+        self._metrics.started(endpoint)
+        started = time.perf_counter()
+        error = True
+        try:
+            response = await self._transport.handle_async_request(request)
+            error = response.status_code >= 400
+            return response
+        finally:
+            self._metrics.finished(endpoint, time.perf_counter() - started, error)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def build_remna_client(
+        base_url: str,
+        token: str,
+        timeout: float,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http2: bool,
+        endpoint_timeouts: Optional[Dict[str, float]] = None,
+        metrics: HttpMetrics = remna_metrics,
+) -> httpx.AsyncClient:
+    """
+    Создает httpx-клиент для RemnawaveSDK с пулом соединений и метриками.
+    Адрес и заголовки формируются так же, как это делает сам SDK.
+    HTTP/2 включается, только если установлен пакет h2.
+    """
+    base_url = base_url.rstrip("/")
+    if not base_url.endswith("/api"):
+        base_url += "/api"
+
+    headers = {"Authorization": token if token.startswith("Bearer ") else f"Bearer {token}"}
+    if base_url.startswith("http://"):
+        headers["x-forwarded-proto"] = "https"
+        headers["x-forwarded-for"] = "127.0.0.1"
+
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        http2=http2 and importlib.util.find_spec("h2") is not None,
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        timeout=timeout,
+        transport=InstrumentedTransport(transport, metrics, endpoint_timeouts),
+    )
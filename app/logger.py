@@ -4,15 +4,17 @@ import sys
 from pathlib import Path
 
 # --- Директории ---
+# Loguru сам создает каталоги и файлы при первой записи (delay=True),
+# поэтому импорт логгера ничего не трогает на диске
 log_root = Path("logs")
-(bot_dir := log_root / "bot").mkdir(parents=True, exist_ok=True)
-(api_dir := log_root / "api").mkdir(parents=True, exist_ok=True)
-(payments_dir := log_root / "payments_gateways").mkdir(parents=True, exist_ok=True)
-(access_dir := log_root / "access").mkdir(parents=True, exist_ok=True)
-(errors_dir := log_root / "errors").mkdir(parents=True, exist_ok=True)
+bot_dir = log_root / "bot"
+api_dir = log_root / "api"
+payments_dir = log_root / "payments_gateways"
+access_dir = log_root / "access"
+errors_dir = log_root / "errors"
 
-(uvicorn_dir := log_root / "uvicorn").mkdir(parents=True, exist_ok=True)
-(httpx_dir := log_root / "httpx").mkdir(parents=True, exist_ok=True)
+uvicorn_dir = log_root / "uvicorn"
+httpx_dir = log_root / "httpx"
 
 logger.remove()
 
@@ -25,6 +27,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="DEBUG",
     filter=lambda record: record["extra"].get("source") == "bot"
 )
@@ -34,6 +37,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="DEBUG",
     filter=lambda record: record["extra"].get("source") == "api"
 )
@@ -43,6 +47,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="DEBUG",
     filter=lambda record: record["extra"].get("source") == "yookassa"
 )
@@ -52,6 +57,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="INFO",
     filter=lambda record: record["extra"].get("source") == "access"
 )
@@ -62,6 +68,7 @@ logger.add(
     rotation="00:00",
     retention="14 days",
     compression="zip",
+    delay=True,
     level="ERROR"
 )
 
@@ -69,6 +76,7 @@ logger.add("logs/all_logs_{time:YYYY-MM-DD}.log",
            rotation="00:00",
            retention="7 days",
            compression="zip",
+           delay=True,
            level="DEBUG")
 
 logger.add(
@@ -76,6 +84,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="DEBUG",
     filter=lambda r: r["extra"].get("source") == "uvicorn"
 )
@@ -85,6 +94,7 @@ logger.add(
     rotation="00:00",
     retention="7 days",
     compression="zip",
+    delay=True,
     level="DEBUG",
     filter=lambda r: r["extra"].get("source") == "httpx"
 )
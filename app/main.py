@@ -3,7 +3,7 @@ from fastapi import FastAPI
 from yookassa import Configuration
 
 from app.core.config import settings
-from app.core.limiter import limiter
+from app.core.limiter import limiter, rate_limit_store
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
 
@@ -12,24 +12,32 @@ from app.api.bot_api import router as bot_router
 from app.api.head import head_router
 from app.api.media import media_router
 from app.api.payment_webhooks.yookassa import yookassa_router
+from app.payments_gateways.yookassa_gateway import YooKassaGateway
 from app.api.remnawave_webhook import remna_webhook_router
 from app.bot.bot_logic import setup_bot_logic
 from app.logger import logger
 from app.services.tariff_service import tariff_service
+from app.services.broadcast_service import broadcast_service
+from app.services.webhook_queue import webhook_queue
+from app.services.remnawave_service import remna_service
+from app.services.pool_service import pool_service
+from app.services.payment_service import payment_service
+from app.services.notification_service import notification_service
+from app.services.update_queue import update_queue
+from app.services.lease_service import lease_service
+from app.bot.utils.commands import set_commands
 
 
 Configuration.account_id = settings.YOOKASSA_SHOP_ID
 Configuration.secret_key = settings.YOOKASSA_TOKEN
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-
+async def run_startup_tasks() -> None:
+    """
+    Разовая настройка при запуске: тарифы, вебхук, команды бота и проверка связи с панелью.
+    Все шаги идемпотентны. Ожидающие апдейты не сбрасываются, чтобы не терять их при деплое.
+    """
     await tariff_service.load_and_sync_tariffs("database/tariffs.json")
-
-    setup_bot_logic(settings.DP_BOT, settings.BOT)
-    await settings.BOT.delete_webhook(drop_pending_updates=True)
-
     await settings.BOT.set_webhook(
         url=settings.WEBHOOK_BOT_URL,
         secret_token=settings.WEBHOOK_SECRET,
@@ -42,7 +50,13 @@ async def lifespan(app: FastAPI):
         ]
     )
     logger.bind(source="bot").info(f"Вебхук установлен на: {settings.WEBHOOK_BOT_PATH} + secret")
-    stats = await settings.REMNA_SDK.system.get_stats()
+    await set_commands()
+
+    try:
+        stats = await settings.REMNA_SDK.system.get_stats()
+    except Exception as e:
+        logger.error(f"Remnawave недоступна при запуске: {e}")
+        return
     # Если запрос успешен, выводим полезную информацию
     total_users = stats.users.total_users
     total_nodes = stats.nodes.total_online
@@ -50,10 +64,65 @@ async def lifespan(app: FastAPI):
                 f"Всего пользователей в панели: {total_users}\n"
                 f"Нод онлайн: {total_nodes}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+
+    if settings.WEB_CONCURRENCY > 1:
+        if settings.FSM_STORAGE_URI.startswith("memory://"):
+            logger.warning("Несколько воркеров с FSM_STORAGE_URI=memory://: сценарии бота будут теряться между воркерами")
+        if settings.RATE_LIMIT_STORAGE_URI.startswith("memory://"):
+            logger.warning("Несколько воркеров с RATE_LIMIT_STORAGE_URI=memory://: лимиты считаются в каждом воркере отдельно")
+
+    setup_bot_logic(settings.DP_BOT, settings.BOT)
+    if settings.BOT_UPDATES_ASYNC:
+        # Апдейты могут прийти сразу: вебхук уже установлен предыдущим запуском или другой репликой
+        await update_queue.start(settings.DP_BOT, settings.BOT)
+
+    # Общую настройку выполняет только один процесс среди всех воркеров и реплик (лидер аренды "startup"),
+    # остальные сразу начинают обслуживать запросы
+    async with lease_service.hold("startup", settings.STARTUP_LEASE_TTL) as startup_leader:
+        if startup_leader:
+            await run_startup_tasks()
+        else:
+            logger.info("Общая настройка при запуске выполняется другим процессом")
+
+    # Фоновые задачи запускаются в каждом процессе. Общую работу они не дублируют: уведомления
+    # и вебхуки забираются из БД условным UPDATE, рассылка — арендой в broadcast_jobs,
+    # а пул, досылка и повтор выдачи по оплаченным платежам выполняются только держателем своей аренды (lease_service)
+    # Продолжаем рассылки, которые никто не отправляет (в том числе прерванные прошлой остановкой)
+    await broadcast_service.start(settings.BOT)
+    # Отправка уведомлений пользователям из outbox
+    await notification_service.start()
+    # Фоновая обработка вебхуков Remnawave
+    await webhook_queue.start()
+    # Досылка изменений, отложенных пока панель была недоступна
+    await remna_service.start()
+    # Пул пользователей Remnawave для мгновенного оформления покупки
+    await pool_service.start()
+    # Повтор выдачи подписок по платежам, оплаченным пока панель была недоступна
+    await payment_service.start()
+
     yield
 
-    logger.bind(source="bot").info("Остановка приложения... Удаление вебхука.")
-    await settings.BOT.delete_webhook()
+    # Сначала дорабатываем принятые апдейты: их хендлеры пользуются остальными сервисами
+    await update_queue.stop()
+    await payment_service.stop()
+    await pool_service.stop()
+    await remna_service.stop()
+    await webhook_queue.stop()
+    await notification_service.stop()
+    await broadcast_service.stop()
+    await settings.REMNA_HTTP_CLIENT.aclose()
+    await YooKassaGateway.aclose()
+    await rate_limit_store.close()
+
+    if startup_leader:
+        # Следующий запуск (например, после деплоя) снова выполнит общую настройку
+        await lease_service.release("startup")
+    # Вебхук не удаляем: пока приложение перезапускается, Telegram копит апдейты
+    # и доставит их новому процессу (или уже работающим репликам)
+    logger.bind(source="bot").info("Остановка приложения.")
 
 
 app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
@@ -22,3 +22,13 @@ class BaseGateway(ABC):
         :return: Кортеж (external_id, payment_url) или None в случае ошибки.
         """
         pass
+
+    async def cancel_payment(self, external_id: str) -> bool:
+        """
+        Отменяет созданный платеж, если оформление не удалось завершить.
+        По умолчанию отменять нечего: ссылка на оплату просто не показывается пользователю.
+
+        :param external_id: Внешний ID платежа.
+        :return: True, если платеж отменен во внешней системе.
+        """
+        return False
@@ -1,8 +1,8 @@
-from functools import partial
 import asyncio
-from typing import Optional, Tuple
+import uuid
+from typing import Any, Dict, Optional, Tuple
 
-from yookassa import Payment
+import httpx
 
 from app.logger import logger
 from app.core.config import settings
@@ -10,8 +10,67 @@ from database.models import Tariff
 from .base_gateway import BaseGateway
 
 
+class YooKassaAPIError(Exception):
+    """Ошибка API ЮKassa, после которой повтор не поможет (4xx, кроме 429)."""
+
+
 class YooKassaGateway(BaseGateway):
-    """Платежный шлюз для YooKassa."""
+    """
+    Платежный шлюз для YooKassa.
+
+    Работает с API ЮKassa напрямую через общий httpx.AsyncClient с пулом соединений.
+    Каждая операция отправляется с ключом идемпотентности, поэтому сетевые ошибки,
+    429, 5xx и ответ 202 («запрос еще обрабатывается») безопасно повторяются с тем же ключом.
+    Для локальной проверки без доступа к ЮKassa есть заглушка yookassa_stub
+    (адрес задается в YOOKASSA_API_URL).
+    """
+
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                base_url=settings.YOOKASSA_API_URL,
+                auth=(settings.YOOKASSA_SHOP_ID or "", settings.YOOKASSA_TOKEN or ""),
+                timeout=settings.YOOKASSA_TIMEOUT,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return cls._client
+
+    @classmethod
+    async def aclose(cls) -> None:
+        """Закрывает общий клиент. Вызывается при остановке приложения."""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    async def _request(self, method: str, path: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Выполняет запрос с ключом идемпотентности и повторами."""
+        headers = {"Idempotence-Key": str(uuid.uuid4())} if method == "POST" else {}
+        delay = settings.YOOKASSA_RETRY_DELAY
+        for attempt in range(1, settings.YOOKASSA_MAX_RETRIES + 1):
+            retry_after = delay
+            try:
+                response = await self.get_client().request(method, path, json=json, headers=headers)
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code == 202:
+                    # ЮKassa еще обрабатывает запрос и просит повторить его через retry_after мс
+                    retry_after = response.json().get("retry_after", delay * 1000) / 1000
+                    error = "запрос в обработке"
+                elif response.status_code == 429 or response.status_code >= 500:
+                    error = f"HTTP {response.status_code}"
+                else:
+                    raise YooKassaAPIError(f"HTTP {response.status_code}: {response.text}")
+            except httpx.TransportError as e:
+                error = repr(e)
+
+            if attempt < settings.YOOKASSA_MAX_RETRIES:
+                logger.warning(f"ЮKassa {method} {path}: {error}, повтор {attempt} через {retry_after:.1f} сек.")
+                await asyncio.sleep(retry_after)
+                delay *= 2
+        raise YooKassaAPIError(f"{method} {path}: нет успешного ответа за {settings.YOOKASSA_MAX_RETRIES} попыток ({error})")
 
     async def create_payment(self, tariff: Tariff) -> Optional[Tuple[str, str]]:
         """Создает платеж в ЮKassa."""
@@ -28,16 +87,23 @@ class YooKassaGateway(BaseGateway):
             "description": f"Оплата подписки '{tariff.name}'"
         }
         try:
-            payment = await asyncio.to_thread(
-                partial(
-                    Payment.create,
-                    payload
-                )
-            )
-            external_id = payment.id
-            payment_url = payment.confirmation.confirmation_url
+            payment = await self._request("POST", "/payments", json=payload)
+            external_id = payment["id"]
+            payment_url = payment["confirmation"]["confirmation_url"]
 
             return external_id, payment_url
-        except BaseException as ex:
-            logger.exception(ex)
-            return None
\ No newline at end of file
+        except Exception as ex:
+            logger.error(f"Ошибка при создании платежа ЮKassa: {ex}")
+            return None
+
+    async def cancel_payment(self, external_id: str) -> bool:
+        """
+        Пытается отменить платеж в ЮKassa. Неоплаченный платеж в статусе pending
+        отменить нельзя — он истечет сам, а ссылку на него пользователь не получит.
+        """
+        try:
+            await self._request("POST", f"/payments/{external_id}/cancel", json={})
+            return True
+        except Exception as ex:
+            logger.warning(f"Платеж ЮKassa {external_id} не отменен: {ex}")
+            return False
@@ -0,0 +1,102 @@
+"""
+Локальная заглушка API ЮKassa для проверки YooKassaGateway без сети.
+
+Запуск:
+    python -m app.payments_gateways.yookassa_stub --port 8090
+и в .env:
+    YOOKASSA_API_URL=http://127.0.0.1:8090/v3
+
+Поддерживает создание, получение и отмену платежей с учетом Idempotence-Key.
+Переменная окружения YOOKASSA_STUB_FAIL_RATE (0..1) задает долю ответов 500
+для проверки повторов, YOOKASSA_STUB_DELAY — задержку ответа в секундах.
+"""
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+FAIL_RATE = float(os.getenv("YOOKASSA_STUB_FAIL_RATE", "0"))
+DELAY = float(os.getenv("YOOKASSA_STUB_DELAY", "0"))
+
+payments: Dict[str, Dict[str, Any]] = {}
+idempotence_cache: Dict[str, Dict[str, Any]] = {}
+
+
+async def _simulate() -> JSONResponse | None:
+    if DELAY:
+        await asyncio.sleep(DELAY)
+    if random.random() < FAIL_RATE:
+        return JSONResponse({"type": "error", "code": "internal_server_error"}, status_code=500)
+    return None
+
+
+def _error(code: str, status_code: int) -> JSONResponse:
+    return JSONResponse({"type": "error", "code": code}, status_code=status_code)
+
+
+@app.post("/v3/payments")
+async def create_payment(request: Request, idempotence_key: str = Header(None, alias="Idempotence-Key")):
+    if not idempotence_key:
+        return _error("invalid_request", 400)
+    if failure := await _simulate():
+        return failure
+    if idempotence_key in idempotence_cache:
+        return idempotence_cache[idempotence_key]
+
+    body = await request.json()
+    payment_id = str(uuid.uuid4())
+    payment = {
+        "id": payment_id,
+        "status": "pending",
+        "paid": False,
+        "amount": body["amount"],
+        "description": body.get("description"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "confirmation": {
+            "type": "redirect",
+            "confirmation_url": f"{request.base_url}checkout/{payment_id}",
+        },
+    }
+    payments[payment_id] = payment
+    idempotence_cache[idempotence_key] = payment
+    return payment
+
+
+@app.get("/v3/payments/{payment_id}")
+async def get_payment(payment_id: str):
+    payment = payments.get(payment_id)
+    return payment if payment else _error("not_found", 404)
+
+
+@app.post("/v3/payments/{payment_id}/cancel")
+async def cancel_payment(payment_id: str, idempotence_key: str = Header(None, alias="Idempotence-Key")):
+    if not idempotence_key:
+        return _error("invalid_request", 400)
+    if failure := await _simulate():
+        return failure
+    payment = payments.get(payment_id)
+    if not payment:
+        return _error("not_found", 404)
+    # Как и в ЮKassa, отменить можно только платеж, ожидающий подтверждения
+    if payment["status"] != "waiting_for_capture":
+        return _error("invalid_request", 400)
+    payment["status"] = "canceled"
+    return payment
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Заглушка API ЮKassa")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -5,8 +5,6 @@ from sqlalchemy import select, func
 from database.models import User, Subscription, Payment
 from database.enums import SubscriptionStatus
 from database.session import get_session
-from app.core.config import settings
-from app.logger import logger
 
 class AdminService:
     """
@@ -61,34 +59,6 @@ class AdminService:
                 "revenue_month": revenue_month_result.scalar_one_or_none() or 0,
             }
 
-    async def sinc_users_from_remna(self) -> bool:
-        """
-        Синхронизация юзеров с панели в БД.
-        """
-        try:
-            async with get_session() as session:
-                subscriptions_db = await Subscription.get_active(session)
-                for sub in subscriptions_db:
-                    subscription_from_remna = await settings.REMNA_SDK.users.get_user_by_short_uuid(sub.remnawave_short_uuid)
-                    await sub.update(
-                        session=session,
-                        telegram_id=subscription_from_remna.telegram_id,
-                        start_date=subscription_from_remna.created_at,
-                        end_date=subscription_from_remna.expire_at,
-                        subscription_name=subscription_from_remna.username,
-                        remnawave_uuid=str(subscription_from_remna.uuid),
-                        remnawave_short_uuid=subscription_from_remna.short_uuid,
-                        subscription_url=subscription_from_remna.subscription_url,
-                        status=subscription_from_remna.status,
-                        description=subscription_from_remna.description,
-                        hwidDeviceLimit=subscription_from_remna.hwidDeviceLimit,
-                        first_connected=subscription_from_remna.first_connected,
-                        updated_at=subscription_from_remna.updated_at
-                    )
-            return True
-        except BaseException as ex:
-            logger.warning(f"Синхронизация не выполнена{ex}")
-            return False
 
 # --- Единственный экземпляр сервиса ---
 admin_service = AdminService()
\ No newline at end of file
@@ -0,0 +1,308 @@
+import asyncio
+import enum
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.rate_limit import TokenBucket
+from app.logger import logger
+from app.services.lease_service import lease_service
+from database.enums import BroadcastStatus, BroadcastSegment
+from database.filters import UserFilter
+from database.models import BroadcastJob, User
+from database.session import get_session
+
+
+class SendResult(str, enum.Enum):
+    OK = "ok"
+    FAILED = "failed"
+    BLOCKED = "blocked"  # Пользователь заблокировал бота или удален
+
+
+def build_segment_filter(segment: BroadcastSegment, param: Optional[str] = None) -> UserFilter:
+    """
+    Преобразует сегмент аудитории в UserFilter.
+    Все сегменты ограничены активными пользователями (не заблокировавшими бота).
+
+    :param param: Код языка для LOCALE или количество дней для EXPIRING_SOON.
+    """
+    if segment == BroadcastSegment.LOCALE:
+        return UserFilter(language_code=param)
+    if segment == BroadcastSegment.ACTIVE_SUBSCRIPTION:
+        return UserFilter(has_active_subscription=True)
+    if segment == BroadcastSegment.EXPIRED_SUBSCRIPTION:
+        return UserFilter(has_any_subscription=True, has_active_subscription=False)
+    if segment == BroadcastSegment.TRIAL_ONLY:
+        # Одного has_trial=False мало: при TRIAL_DAYS=0 он снят у всех, кто регистрировался
+        return UserFilter(has_trial=False, took_trial=True, had_first_purchase=False)
+    if segment == BroadcastSegment.NEVER_PAID:
+        return UserFilter(had_first_purchase=False)
+    if segment == BroadcastSegment.EXPIRING_SOON:
+        days = int(param) if param else 3
+        return UserFilter(active_subscription_expires_before=datetime.now() + timedelta(days=days))
+    return UserFilter()
+
+
+class BroadcastService:
+    """
+    Сервис массовых рассылок.
+
+    Рассылка хранится в таблице broadcast_jobs вместе с курсором (последним обработанным telegram_id).
+    Пользователи читаются страницами по возрастанию telegram_id (User.get_telegram_id_page), каждая
+    в своей короткой сессии: память не зависит от числа пользователей, а соединение с БД
+    не занято на всю рассылку. Каждая страница отправляется пулом воркеров через общий
+    token bucket. После каждой страницы курсор сохраняется в БД, поэтому после рестарта
+    рассылка продолжается с места остановки.
+
+    Рассылку отправляет только процесс, который забрал ее (BroadcastJob.claim) и продлевает
+    аренду с каждой страницей. Все процессы периодически ищут незавершенные рассылки, поэтому
+    брошенную (процесс остановлен или упал) продолжит первый освободившийся.
+    """
+
+    def __init__(self):
+        self._bucket = TokenBucket(rate=settings.BROADCAST_RATE_PER_SECOND)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+        self._audience_cache: TTLCache[int] = TTLCache(maxsize=256, ttl=settings.BROADCAST_AUDIENCE_CACHE_TTL)
+
+    async def count_audience(self, segment: BroadcastSegment, param: Optional[str] = None) -> int:
+        """Возвращает размер аудитории сегмента. Результат кэшируется на BROADCAST_AUDIENCE_CACHE_TTL секунд."""
+        key = (segment, param)
+        count = self._audience_cache.get(key)
+        if count is None:
+            async with get_session() as session:
+                count = await User.count_by_filter(session, build_segment_filter(segment, param))
+            self._audience_cache.set(key, count)
+        return count
+
+    async def start_broadcast(
+            self,
+            bot: Bot,
+            admin_id: int,
+            from_chat_id: int,
+            message_id: int,
+            segment: BroadcastSegment = BroadcastSegment.ALL,
+            segment_param: Optional[str] = None,
+            progress_message_id: Optional[int] = None
+    ) -> BroadcastJob:
+        """
+        Создает рассылку в БД и запускает ее в фоне.
+
+        :param from_chat_id: Чат, из которого копируется сообщение.
+        :param message_id: ID копируемого сообщения.
+        :param segment: Аудитория рассылки.
+        :param segment_param: Параметр сегмента (язык или количество дней).
+        :param progress_message_id: Сообщение бота у админа, в котором показывается прогресс.
+        """
+        if progress_message_id is None:
+            progress_message = await bot.send_message(admin_id, "📤 Рассылка запущена. Подготовка...")
+            progress_message_id = progress_message.message_id
+        async with get_session() as session:
+            job = await BroadcastJob.create(
+                session=session,
+                admin_id=admin_id,
+                from_chat_id=from_chat_id,
+                message_id=message_id,
+                segment=segment,
+                segment_param=segment_param,
+                progress_message_id=progress_message_id
+            )
+        logger.info(f"Создана рассылка ID:{job.id} от администратора {admin_id}")
+        self._spawn(bot, job.id)
+        return job
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает поиск незавершенных рассылок. Вызывается в lifespan."""
+        self._resume_task = asyncio.create_task(self._resume_loop(bot))
+
+    async def _resume_loop(self, bot: Bot) -> None:
+        while True:
+            try:
+                await self.resume_unfinished(bot)
+            except Exception as e:
+                logger.error(f"Ошибка поиска незавершенных рассылок: {e}")
+            await asyncio.sleep(settings.BROADCAST_LEASE_TTL)
+
+    async def resume_unfinished(self, bot: Bot) -> None:
+        """Продолжает рассылки, которые никто не отправляет (прерванные остановкой или падением процесса)."""
+        async with get_session() as session:
+            jobs = await BroadcastJob.get_running(session)
+        now = datetime.now()
+        for job in jobs:
+            if job.id in self._tasks:
+                continue
+            if job.owner not in (None, lease_service.owner) and job.locked_until and job.locked_until > now:
+                # Рассылку отправляет другой процесс
+                continue
+            logger.info(f"Возобновление рассылки ID:{job.id} с telegram_id > {job.cursor}")
+            self._spawn(bot, job.id)
+
+    async def stop(self) -> None:
+        """Останавливает фоновые рассылки. Их состояние остается в БД, и их продолжит другой процесс."""
+        tasks = list(self._tasks.values())
+        if self._resume_task:
+            tasks.append(self._resume_task)
+            self._resume_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, bot: Bot, job_id: int) -> None:
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run_job(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _t: self._tasks.pop(job_id, None))
+
+    async def _run_job(self, bot: Bot, job_id: int) -> None:
+        async with get_session() as session:
+            if not await BroadcastJob.claim(session, job_id, lease_service.owner, settings.BROADCAST_LEASE_TTL):
+                # Рассылка завершена или ее отправляет другой процесс
+                return
+            job = await BroadcastJob.get_by_id(session, job_id)
+
+        last_progress_at = time.monotonic()
+        try:
+            user_filter = build_segment_filter(job.segment, job.segment_param)
+            while True:
+                # Отправка страницы занимает минуты, поэтому сессию держим только на время чтения
+                async with get_session() as session:
+                    user_ids = await User.get_telegram_id_page(
+                        session, user_filter, after_id=job.cursor, limit=settings.BROADCAST_PAGE_SIZE
+                    )
+                if not user_ids:
+                    break
+                if not await self._process_page(bot, job, user_ids):
+                    logger.warning(f"Рассылку ID:{job.id} забрал другой процесс, останавливаемся")
+                    return
+
+                if time.monotonic() - last_progress_at >= settings.BROADCAST_PROGRESS_INTERVAL:
+                    await self._report_progress(bot, job)
+                    last_progress_at = time.monotonic()
+                if len(user_ids) < settings.BROADCAST_PAGE_SIZE:
+                    break
+
+            finished_at = datetime.now()
+            async with get_session() as session:
+                if not await BroadcastJob.finish(session, job.id, lease_service.owner, finished_at):
+                    return
+            job.status, job.finished_at = BroadcastStatus.FINISHED, finished_at
+        except asyncio.CancelledError:
+            logger.info(f"Рассылка ID:{job.id} прервана, продолжится с telegram_id > {job.cursor}")
+            # Отпускаем рассылку, чтобы другой процесс продолжил ее сразу, не дожидаясь истечения аренды
+            try:
+                async with get_session() as session:
+                    await BroadcastJob.release(session, job.id, lease_service.owner)
+            except Exception as e:
+                logger.error(f"Не удалось отпустить рассылку ID:{job.id}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в рассылке ID:{job.id}: {e}")
+            return
+
+        await self._report_progress(bot, job)
+        report_text = (
+            "📢 Рассылка завершена.\n\n"
+            f"✅ Успешно доставлено: {job.success_count}\n"
+            f"❌ Ошибок: {job.failed_count}"
+        )
+        try:
+            await bot.send_message(job.admin_id, report_text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчет о рассылке админу {job.admin_id}: {e}")
+
+    async def _process_page(self, bot: Bot, job: BroadcastJob, user_ids: List[int]) -> bool:
+        """
+        Отправляет страницу, деактивирует заблокировавших бота и сохраняет курсор.
+        Возвращает False, если рассылку забрал другой процесс.
+        """
+        results = await self._send_page(bot, job, [uid for uid in user_ids if uid != job.admin_id])
+        blocked_ids = [uid for uid, result in results.items() if result == SendResult.BLOCKED]
+        stats = Counter(results.values())
+
+        if blocked_ids:
+            await self._deactivate_users(blocked_ids)
+
+        progress = dict(
+            cursor=user_ids[-1],
+            success_count=job.success_count + stats[SendResult.OK],
+            failed_count=job.failed_count + stats[SendResult.FAILED] + stats[SendResult.BLOCKED]
+        )
+        async with get_session() as session:
+            if not await BroadcastJob.save_progress(
+                session, job.id, lease_service.owner, settings.BROADCAST_LEASE_TTL, **progress
+            ):
+                return False
+        for key, value in progress.items():
+            setattr(job, key, value)
+        return True
+
+    async def _send_page(self, bot: Bot, job: BroadcastJob, user_ids: List[int]) -> Dict[int, SendResult]:
+        """Отправляет сообщение странице пользователей пулом из BROADCAST_WORKERS воркеров."""
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        results: Dict[int, SendResult] = {}
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results[user_id] = await self._send_one(bot, job, user_id)
+
+        await asyncio.gather(*(worker() for _ in range(settings.BROADCAST_WORKERS)))
+        return results
+
+    async def _send_one(self, bot: Bot, job: BroadcastJob, user_id: int) -> SendResult:
+        for _attempt in range(settings.BROADCAST_MAX_RETRIES):
+            await self._bucket.acquire()
+            try:
+                await bot.copy_message(chat_id=user_id, from_chat_id=job.from_chat_id, message_id=job.message_id)
+                return SendResult.OK
+            except TelegramRetryAfter as e:
+                # Flood control общий для бота, поэтому притормаживаем всех воркеров
+                logger.warning(f"Flood control при рассылке ID:{job.id}, пауза {e.retry_after} сек.")
+                self._bucket.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                logger.debug(f"Пользователь {user_id} недоступен для рассылки: {e.message}")
+                return SendResult.BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning(f"Ошибка при отправке рассылки пользователю {user_id}: {e.message}")
+                return SendResult.FAILED
+            except Exception as e:
+                logger.warning(f"Ошибка при отправке рассылки пользователю {user_id}: {e}")
+                return SendResult.FAILED
+        return SendResult.FAILED
+
+    async def _deactivate_users(self, user_ids: List[int]) -> None:
+        """Помечает пользователей, заблокировавших бота, как неактивных одним пакетным UPDATE."""
+        async with get_session() as session:
+            updated = await User.deactivate_many(session, user_ids)
+        logger.info(f"Помечено неактивными пользователей, заблокировавших бота: {updated}")
+
+    async def _report_progress(self, bot: Bot, job: BroadcastJob) -> None:
+        """Обновляет сообщение с прогрессом рассылки у администратора."""
+        if not job.progress_message_id:
+            return
+        text = (
+            f"📤 Рассылка #{job.id}\n\n"
+            f"✅ Доставлено: {job.success_count}\n"
+            f"❌ Ошибок: {job.failed_count}"
+        )
+        try:
+            await bot.edit_message_text(text=text, chat_id=job.admin_id, message_id=job.progress_message_id)
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки ID:{job.id}: {e}")
+
+
+# --- Единственный экземпляр сервиса ---
+broadcast_service = BroadcastService()
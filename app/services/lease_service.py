@@ -0,0 +1,66 @@
+import asyncio
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.logger import logger
+from database.models import AppLease
+from database.session import get_session
+
+
+class LeaseService:
+    """
+    Аренды (lease) ролей между процессами приложения через таблицу app_leases.
+    Позволяет среди нескольких воркеров и реплик выполнять общую работу только в одном процессе.
+    """
+
+    def __init__(self):
+        # Уникален для процесса: воркеры одного контейнера различаются pid, рестарты — суффиксом
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    async def acquire(self, name: str, ttl: float) -> bool:
+        """Захватывает или продлевает аренду на ttl секунд. Возвращает False, если ею владеет другой процесс."""
+        try:
+            async with get_session() as session:
+                return await AppLease.acquire(session, name, self.owner, ttl)
+        except Exception as e:
+            logger.error(f"Не удалось захватить аренду '{name}': {e}")
+            return False
+
+    @asynccontextmanager
+    async def hold(self, name: str, ttl: float) -> AsyncIterator[bool]:
+        """
+        Пытается захватить аренду и продлевает ее в фоне, пока выполняется блок.
+        После выхода аренда не освобождается и истекает сама через ttl секунд,
+        чтобы стартующие следом процессы не повторили уже сделанную работу.
+
+        :return: True внутри блока, если аренда досталась этому процессу.
+        """
+        acquired = await self.acquire(name, ttl)
+        renewer = asyncio.create_task(self._renew(name, ttl)) if acquired else None
+        try:
+            yield acquired
+        finally:
+            if renewer:
+                renewer.cancel()
+                await asyncio.gather(renewer, return_exceptions=True)
+
+    async def _renew(self, name: str, ttl: float) -> None:
+        while True:
+            await asyncio.sleep(ttl / 3)
+            if not await self.acquire(name, ttl):
+                logger.warning(f"Аренда '{name}' перехвачена другим процессом")
+                return
+
+    async def release(self, name: str) -> None:
+        try:
+            async with get_session() as session:
+                await AppLease.release(session, name, self.owner)
+        except Exception as e:
+            logger.error(f"Не удалось освободить аренду '{name}': {e}")
+
+
+# --- Единственный экземпляр сервиса ---
+lease_service = LeaseService()
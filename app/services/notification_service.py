@@ -0,0 +1,200 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Set
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.utils.i18n import gettext as _
+
+from app.bot.keyboards.inlines import get_config_webapp_button
+from app.bot.middlewares.i18n import i18n
+from app.core.config import settings
+from app.core.rate_limit import TokenBucket
+from app.logger import logger
+from database.enums import NotificationStatus
+from database.models import Notification, User
+from database.session import get_session
+
+
+class NotificationService:
+    """
+    Отправка уведомлений пользователям из таблицы notifications (outbox).
+
+    Вебхуки и хендлеры не отправляют сообщения сами: они добавляют Notification в ту же
+    транзакцию, что и изменение состояния (Notification.add), и отвечают сразу после коммита.
+    Диспетчер забирает готовые уведомления из БД и раздает их пулу воркеров, которые
+    отправляют их через общий token bucket. Ошибки повторяются с экспоненциальной задержкой,
+    flood control Telegram притормаживает всех воркеров. Отправленные уведомления старше
+    NOTIFY_RETENTION_DAYS раз в час удаляются.
+
+    При остановке процесс возвращает в очередь забранные, но не отправленные уведомления,
+    а уведомления упавшего процесса диспетчеры возвращают через NOTIFY_LOCK_TIMEOUT.
+    """
+    CLEANUP_INTERVAL = 3600  # Как часто удалять старые отправленные уведомления (сек)
+    RELEASE_STALE_INTERVAL = 60  # Как часто возвращать в очередь уведомления упавших процессов (сек)
+
+    def __init__(self):
+        self._bucket = TokenBucket(rate=settings.NOTIFY_RATE_PER_SECOND)
+        self._queue: asyncio.Queue[Notification] = asyncio.Queue(maxsize=settings.NOTIFY_WORKERS * 2)
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._held_ids: Set[int] = set()  # Уведомления, забранные этим процессом и еще не отправленные
+        self._last_cleanup_at = 0.0
+        self._last_release_at = 0.0
+
+    def wakeup(self) -> None:
+        """Будит диспетчер после коммита новых уведомлений, не дожидаясь опроса БД."""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        """Запускает диспетчер и воркеры. Вызывается в lifespan."""
+        self._tasks.append(asyncio.create_task(self._dispatcher()))
+        for _worker_index in range(settings.NOTIFY_WORKERS):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """
+        Останавливает отправку. Забранные, но не отправленные уведомления возвращаются в очередь,
+        и их сразу подхватит другой процесс или следующий запуск.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        if self._held_ids:
+            try:
+                async with get_session() as session:
+                    released = await Notification.release(session, self._held_ids)
+                logger.info(f"Возвращено в очередь неотправленных уведомлений: {released}")
+            except Exception as e:
+                logger.error(f"Не удалось вернуть в очередь неотправленные уведомления: {e}")
+            self._held_ids.clear()
+
+    async def _dispatcher(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._last_release_at >= self.RELEASE_STALE_INTERVAL:
+                    await self._release_stale()
+                    self._last_release_at = time.monotonic()
+                async with get_session() as session:
+                    for notification in await Notification.get_pending(session, limit=100):
+                        if await Notification.claim(session, notification.id):
+                            self._held_ids.add(notification.id)
+                            await self._queue.put(notification)
+                if time.monotonic() - self._last_cleanup_at >= self.CLEANUP_INTERVAL:
+                    await self._cleanup()
+                    self._last_cleanup_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка диспетчера уведомлений: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.NOTIFY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    @staticmethod
+    async def _release_stale() -> None:
+        """Возвращает в очередь уведомления, зависшие в отправке (например, у упавшего процесса)."""
+        locked_before = datetime.now() - timedelta(seconds=settings.NOTIFY_LOCK_TIMEOUT)
+        async with get_session() as session:
+            released = await Notification.release_stale(session, locked_before)
+        if released:
+            logger.warning(f"Возвращено в очередь зависших уведомлений: {released}")
+
+    @staticmethod
+    async def _cleanup() -> None:
+        created_before = datetime.now() - timedelta(days=settings.NOTIFY_RETENTION_DAYS)
+        async with get_session() as session:
+            deleted = await Notification.delete_sent(session, created_before)
+        if deleted:
+            logger.info(f"Удалено отправленных уведомлений: {deleted}")
+
+    async def _worker(self) -> None:
+        while True:
+            notification = await self._queue.get()
+            try:
+                await self._handle(notification)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления ID:{notification.id}: {e}")
+            finally:
+                self._queue.task_done()
+            # При отмене уведомление остается в _held_ids, и stop() вернет его в очередь
+            self._held_ids.discard(notification.id)
+
+    async def _handle(self, notification: Notification) -> None:
+        await self._bucket.acquire()
+        try:
+            await self._send(notification)
+        except TelegramRetryAfter as e:
+            # Flood control общий для бота: притормаживаем всех и повторяем без учета попытки
+            logger.warning(f"Flood control при отправке уведомления ID:{notification.id}, пауза {e.retry_after} сек.")
+            self._bucket.pause(e.retry_after)
+            await self._save_result(
+                notification.id, status=NotificationStatus.PENDING, locked_at=None,
+                next_attempt_at=datetime.now() + timedelta(seconds=e.retry_after)
+            )
+            return
+        except TelegramForbiddenError as e:
+            logger.debug(f"Пользователь {notification.chat_id} недоступен для уведомлений: {e.message}")
+            await self._save_result(
+                notification.id, status=NotificationStatus.FAILED, locked_at=None, last_error=e.message
+            )
+            async with get_session() as session:
+                await User.deactivate_many(session, [notification.chat_id])
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Уведомление ID:{notification.id} отклонено Telegram: {e.message}")
+            await self._save_result(
+                notification.id, status=NotificationStatus.FAILED, locked_at=None, last_error=e.message
+            )
+            return
+        except Exception as e:
+            await self._on_failure(notification, e)
+            return
+        await self._save_result(notification.id, status=NotificationStatus.SENT, locked_at=None)
+
+    @staticmethod
+    async def _send(notification: Notification) -> None:
+        i18n.current_locale = notification.locale or i18n.default_locale
+        with i18n.context():
+            text = _(notification.text_key).format(**notification.params)
+            reply_markup = get_config_webapp_button(notification.button_url) if notification.button_url else None
+        await settings.BOT.send_message(
+            chat_id=notification.chat_id,
+            text=text,
+            reply_markup=reply_markup,
+            message_effect_id=notification.message_effect_id
+        )
+
+    async def _on_failure(self, notification: Notification, error: Exception) -> None:
+        attempts = notification.attempts + 1
+        if attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+            logger.error(f"Уведомление ID:{notification.id} не отправлено за {attempts} попыток: {error}")
+            await self._save_result(
+                notification.id, status=NotificationStatus.FAILED, attempts=attempts,
+                locked_at=None, last_error=str(error)
+            )
+            return
+
+        delay = settings.NOTIFY_RETRY_DELAY * 2 ** (attempts - 1)
+        logger.warning(f"Ошибка отправки уведомления ID:{notification.id}, повтор через {delay} сек.: {error}")
+        await self._save_result(
+            notification.id, status=NotificationStatus.PENDING, attempts=attempts, locked_at=None,
+            next_attempt_at=datetime.now() + timedelta(seconds=delay), last_error=str(error)
+        )
+
+    @staticmethod
+    async def _save_result(notification_id: int, **values) -> None:
+        try:
+            async with get_session() as session:
+                await Notification.set_result(session, notification_id, **values)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить результат отправки уведомления ID:{notification_id}: {e}")
+
+
+# --- Единственный экземпляр сервиса ---
+notification_service = NotificationService()
@@ -1,30 +1,71 @@
+import asyncio
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from enum import Enum
 from typing import Dict, Optional, Tuple, Type
 
 from aiogram.types import User as UserTG
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 from alembic.util import status
 
 from app.core.config import settings
+from app.core.metrics import StageMetrics
 from app.logger import logger
 
 # --- Импортируем наши шлюзы и сервисы ---
 from app.payments_gateways.base_gateway import BaseGateway
 from app.payments_gateways.yookassa_gateway import YooKassaGateway
 from app.payments_gateways.telegram_stars_gateway import TelegramStarsGateway
+from app.services.lease_service import lease_service
+from app.services.notification_service import notification_service
 from app.services.subscription_service import subscription_service
 
 # --- Импортируем модели напрямую ---
 from database.enums import PaymentMethod, SubscriptionStatus
-from database.models import Payment, Subscription, Tariff, User
+from database.models import Notification, Payment, Subscription, Tariff, User
 from database.session import get_session
 from app.services.remnawave_service import remna_service
 
+# Длительность этапов оформления оплаты
+checkout_metrics = StageMetrics()
+
+
+class PaymentOutcome(str, Enum):
+    """Итог обработки уведомления о платеже."""
+    SUCCEEDED = "succeeded"
+    CANCELED = "canceled"
+    NOT_FOUND = "not_found"
+    ALREADY_PROCESSED = "already_processed"
+    # Платеж сейчас обрабатывает другой запрос: уведомление нужно повторить позже
+    IN_PROGRESS = "in_progress"
+    # Оплата получена, но подписку выдать не удалось: платеж отмечен 'paid',
+    # выдачу повторит фоновая задача (и повторное уведомление шлюза, если он их шлет)
+    DEFERRED = "deferred"
+
+
+@dataclass
+class PaymentResult:
+    """Результат process_payment. payment загружен вместе с пользователем, тарифом и подпиской."""
+    outcome: PaymentOutcome
+    payment: Optional[Payment] = None
+
+
 class PaymentService:
     """
     Класс-сервис для управления бизнес-логикой, связанной с платежами.
+
+    Если оплата получена, но подписку выдать не удалось (например, пул пуст и панель недоступна),
+    платеж остается в статусе 'paid'. Не все шлюзы повторяют уведомления (Telegram Stars
+    не повторяет), поэтому фоновая задача раз в PAYMENT_RETRY_INTERVAL секунд повторяет выдачу
+    по таким платежам. Выполняет ее только держатель аренды "payment_retry".
     """
 
+    RETRY_LEASE_NAME = "payment_retry"
+
     def __init__(self):
+        self._retry_task: Optional[asyncio.Task] = None
         self.gateways: Dict[PaymentMethod, Type[BaseGateway]] = {}
         if settings.YOOKASSA_TOKEN and settings.YOOKASSA_SHOP_ID:
             self.gateways[PaymentMethod.yookassa] = YooKassaGateway
@@ -32,6 +73,53 @@ class PaymentService:
             self.gateways[PaymentMethod.tg_stars] = TelegramStarsGateway
         logger.info(f"Зарегистрированные платежные шлюзы: {[gw.name for gw in self.gateways.keys()]}")
 
+    async def start(self) -> None:
+        """Запускает фоновый повтор выдачи подписок по оплаченным платежам. Вызывается в lifespan."""
+        self._retry_task = asyncio.create_task(self._retry_loop())
+
+    async def stop(self) -> None:
+        if self._retry_task:
+            self._retry_task.cancel()
+            await asyncio.gather(self._retry_task, return_exceptions=True)
+            self._retry_task = None
+            await lease_service.release(self.RETRY_LEASE_NAME)
+
+    async def _retry_loop(self) -> None:
+        lease_ttl = settings.PAYMENT_RETRY_INTERVAL * 3
+        while True:
+            await asyncio.sleep(settings.PAYMENT_RETRY_INTERVAL)
+            try:
+                if not await lease_service.acquire(self.RETRY_LEASE_NAME, lease_ttl):
+                    continue
+                await self.retry_unconfirmed()
+            except Exception as e:
+                logger.error(f"Ошибка повтора выдачи подписок по оплаченным платежам: {e}")
+
+    async def retry_unconfirmed(self, limit: int = 20) -> int:
+        """
+        Повторяет выдачу подписок по оплаченным платежам (см. Payment.get_unconfirmed_ids).
+        Останавливается на первой неудаче: скорее всего, панель все еще недоступна.
+
+        :return: Количество подтвержденных платежей.
+        """
+        stale_before = datetime.now() - timedelta(seconds=settings.PAYMENT_PROCESSING_TIMEOUT)
+        async with get_session() as session:
+            payment_ids = await Payment.get_unconfirmed_ids(session, stale_before, limit)
+        confirmed = 0
+        for payment_id in payment_ids:
+            async with get_session() as session:
+                payment = await Payment.get_for_update(session, payment_id)
+                if not payment:
+                    continue
+                result = await self._confirm(session, payment)
+            if result.outcome == PaymentOutcome.DEFERRED:
+                break
+            if result.outcome == PaymentOutcome.SUCCEEDED:
+                confirmed += 1
+        if confirmed:
+            logger.info(f"Выданы отложенные подписки по оплаченным платежам: {confirmed}")
+        return confirmed
+
     def _get_gateway(self, method: PaymentMethod) -> Optional[BaseGateway]:
         gateway_class = self.gateways.get(method)
         return gateway_class() if gateway_class else None
@@ -60,14 +148,19 @@ class PaymentService:
             tariff_id: int,
             method_str: str,
             sub_id_to_extend: Optional[int] = None,
-    ) -> Optional[Tuple[Payment, Tariff, Subscription, str]]:
+    ) -> Optional[Tuple[Payment, Tariff, Optional[Subscription], str]]:
         """
         Основной метод для создания платежа.
-        1. Находит или создает подписку.
-        2. Выбирает нужный платежный шлюз.
-        3. Создает платеж во внешней системе и возвращает ссылку на оплату.
-        4. Сохраняет запись о платеже в нашей БД.
+        1. Находит тариф.
+        2. Параллельно проверяет пользователя и подписку для продления в БД и создает платеж
+           во внешней системе (для новой подписки ничего не создается: она выдается из пула
+           при подтверждении оплаты).
+        3. Сохраняет запись о платеже в нашей БД.
+        Если проверка или сохранение не удались, созданный во внешней системе платеж отменяется.
+        Длительность этапов пишется в checkout_metrics.
         """
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
         try:
             method = PaymentMethod(method_str)
             gateway = self._get_gateway(method)
@@ -75,80 +168,254 @@ class PaymentService:
                 logger.error(f"Платежный шлюз '{method_str}' не настроен.")
                 return None
 
-            async with get_session() as session:
-                tariff = await Tariff.get_by_id(session, tariff_id)
-                user_db = await User.get_by_telegram_id(session, user_tg.id)
-                if not tariff or not user_db:
-                    logger.error("Тариф или пользователь не найдены при создании платежа.")
-                    return None
-
-                if sub_id_to_extend:
-                    subscription = await Subscription.get_by_id(session, sub_id_to_extend)
-                    if not subscription or subscription.telegram_id != user_tg.id:
-                        logger.error("Подписка для продления не найдена.")
-                        return None
-                else:
-                    subscription = await subscription_service.create_pending_subscription(user_db, tariff)
-
-                payment_details = await gateway.create_payment(tariff)
-                if not payment_details:
-                    logger.error(f"Шлюз '{method_str}' не смог создать платеж.")
-                    return None
-
-                external_id, payment_url = payment_details
-
-                payment = await Payment.create(
-                    session=session,
-                    user_id=user_tg.id, amount=tariff.price, method=method,
-                    tariff_id=tariff.id, subscription_id=subscription.id,
-                    external_payment_id=external_id
-                )
-                return payment, tariff, subscription, payment_url
+            with checkout_metrics.measure("tariff", timings):
+                async with get_session() as session:
+                    tariff = await Tariff.get_by_id(session, tariff_id)
+            if not tariff:
+                logger.error("Тариф не найден при создании платежа.")
+                return None
+
+            validation, payment_details = await asyncio.gather(
+                self._validate_checkout(user_tg.id, sub_id_to_extend, timings),
+                self._create_gateway_payment(gateway, tariff, timings),
+                return_exceptions=True
+            )
+            if isinstance(payment_details, BaseException) or not payment_details:
+                logger.error(f"Шлюз '{method_str}' не смог создать платеж: {payment_details}")
+                return None
+            external_id, payment_url = payment_details
+
+            if isinstance(validation, BaseException) or not validation[0]:
+                logger.error(f"Оформление оплаты для {user_tg.id} отклонено: {validation}")
+                await self._compensate(gateway, external_id)
+                return None
+            subscription = validation[1]
+
+            try:
+                with checkout_metrics.measure("save", timings):
+                    async with get_session() as session:
+                        payment = await Payment.create(
+                            session=session,
+                            user_id=user_tg.id, amount=tariff.price, method=method,
+                            tariff_id=tariff.id, subscription_id=subscription.id if subscription else None,
+                            external_payment_id=external_id
+                        )
+            except Exception:
+                await self._compensate(gateway, external_id)
+                raise
+            return payment, tariff, subscription, payment_url
 
         except Exception as e:
             logger.error(f"Ошибка при создании ссылки на оплату для пользователя {user_tg.id}: {e}")
             return None
+        finally:
+            timings["total"] = time.perf_counter() - started
+            checkout_metrics.observe("total", timings["total"])
+            logger.debug(f"Оформление оплаты {user_tg.id}: " + ", ".join(f"{k}={v * 1000:.0f}мс" for k, v in timings.items()))
 
-    async def confirm_payment(self, payment_id: int) -> Optional[Payment]:
+    @staticmethod
+    async def _validate_checkout(
+            telegram_id: int,
+            sub_id_to_extend: Optional[int],
+            timings: Dict[str, float]
+    ) -> Tuple[bool, Optional[Subscription]]:
+        """Проверяет, что пользователь существует и продлевает свою подписку."""
+        with checkout_metrics.measure("validate", timings):
+            async with get_session() as session:
+                user_db = await User.get_profile(session, telegram_id)
+                if not user_db:
+                    logger.error("Пользователь не найден при создании платежа.")
+                    return False, None
+                if not sub_id_to_extend:
+                    return True, None
+                subscription = await Subscription.get_by_id(session, sub_id_to_extend)
+                if not subscription or subscription.telegram_id != telegram_id:
+                    logger.error("Подписка для продления не найдена.")
+                    return False, None
+                return True, subscription
+
+    @staticmethod
+    async def _create_gateway_payment(
+            gateway: BaseGateway,
+            tariff: Tariff,
+            timings: Dict[str, float]
+    ) -> Optional[Tuple[str, str]]:
+        with checkout_metrics.measure("gateway", timings):
+            return await gateway.create_payment(tariff)
+
+    @staticmethod
+    async def _compensate(gateway: BaseGateway, external_id: str) -> None:
+        """Отменяет платеж во внешней системе, который не будет показан пользователю."""
+        if await gateway.cancel_payment(external_id):
+            logger.info(f"Платеж {external_id} отменен во внешней системе")
+        else:
+            logger.warning(f"Платеж {external_id} создан во внешней системе, но не сохранен: ссылка не выдана")
+
+    async def process_payment(self, external_id: str, succeeded: bool) -> PaymentResult:
         """
-        Подтверждает оплату, продлевает подписку и начисляет реферальные бонусы.
-        Вызывается из вебхуков (ЮKassa) или хендлеров (Telegram Stars).
+        Обрабатывает уведомление платежной системы за один проход: находит и блокирует
+        платеж по внешнему ID (вместе с пользователем, тарифом и подпиской), переводит его
+        из ожидания и выдает или продлевает подписку. Уведомление пользователю пишется
+        в outbox той же транзакцией и отправляется в фоне (см. notification_service).
+        Вызывается из вебхуков (ЮKassa) и хендлеров (Telegram Stars).
+
+        :param external_id: Внешний ID платежа.
+        :param succeeded: True — оплата прошла, False — платеж отменен или не удался.
         """
         async with get_session() as session:
-            payment = await Payment.get_by_id_with_relations(session, payment_id)
-            if not payment or payment.status != "pending":
+            payment = await Payment.get_for_update_by_external_id(session, external_id)
+            if not payment:
+                logger.error(f"Не найден платеж с external_id={external_id} в нашей БД.")
+                return PaymentResult(PaymentOutcome.NOT_FOUND)
+            if succeeded and payment.status in ("processing", "paid"):
+                # Обработка начата другим запросом или отложена; если она зависла, _confirm заберет платеж себе
+                return await self._confirm(session, payment)
+            if payment.status != "pending":
+                logger.warning(f"Платеж {payment.id} уже был обработан. Текущий статус: {payment.status}")
+                return PaymentResult(PaymentOutcome.ALREADY_PROCESSED, payment)
+            if succeeded:
+                return await self._confirm(session, payment)
+            return await self._cancel(session, payment)
+
+    async def confirm_payment(self, payment_id: int) -> Optional[Payment]:
+        """Подтверждает оплату по внутреннему ID платежа (см. process_payment)."""
+        async with get_session() as session:
+            payment = await Payment.get_for_update(session, payment_id)
+            if not payment or payment.status not in ("pending", "paid"):
                 logger.warning(f"Попытка подтвердить уже обработанный или несуществующий платеж ID: {payment_id}")
                 return None
+            result = await self._confirm(session, payment)
+            return result.payment if result.outcome == PaymentOutcome.SUCCEEDED else None
 
-            # 1. Обновляем подписку
-            subscription: Subscription = payment.subscription
-            tariff: Tariff = payment.tariff
-            current_end_date = subscription.end_date if subscription.status == SubscriptionStatus.ACTIVE and subscription.end_date > datetime.now() else datetime.now()
-            new_end_date = current_end_date + timedelta(days=tariff.duration_days)
+    @staticmethod
+    async def _confirm(session: AsyncSession, payment: Payment) -> PaymentResult:
+        """
+        Подтверждает заблокированный платеж, продлевает подписку и начисляет реферальные бонусы.
 
-            # Обновляем дату в Remnawave
-            await remna_service.update_user_expiration(subscription.remnawave_uuid, new_end_date)
+        1. Платеж забирается в обработку условным UPDATE ... SET status='processing' и коммитом,
+           который снимает блокировку строки. Повторный или параллельный вебхук (в том числе на SQLite,
+           где FOR UPDATE не работает) дальше не пройдет.
+        2. Пользователь для новой подписки выдается в панели без открытых транзакций и блокировок.
+        3. Подписка, статус платежа, реферальный бонус и уведомление фиксируются одной транзакцией.
+           Если она не удалась, выданный пользователь удаляется из панели.
 
-            # Обновляем дату и статус в нашей БД
-            await subscription.update(session, end_date=new_end_date, status=SubscriptionStatus.ACTIVE)
+        При любой неудаче платеж отмечается 'paid': оплата получена, выдачу повторит retry_unconfirmed.
+        """
+        # После rollback атрибуты объектов истекают, поэтому ID запоминаем заранее
+        payment_id = payment.id
+        tariff: Tariff = payment.tariff
+        buyer: User = payment.user
 
-            # 2. Обновляем статус платежа
-            payment.status = "succeeded"  # Используем succeeded для консистентности с YooKassa
+        # 1. Забираем платеж в обработку
+        stale_before = datetime.now() - timedelta(seconds=settings.PAYMENT_PROCESSING_TIMEOUT)
+        if not await Payment.claim_for_processing(session, payment_id, stale_before):
+            await session.rollback()
+            logger.warning(f"Платеж ID:{payment_id} уже обрабатывается параллельным запросом")
+            return PaymentResult(PaymentOutcome.IN_PROGRESS, payment)
+        await session.commit()
+
+        # 2. Новая подписка: выдаем пользователя из пула Remnawave (HTTP-запросы к панели)
+        issued: Optional[Subscription] = None
+        if payment.subscription is None:
+            new_end_date = datetime.now() + timedelta(days=tariff.duration_days)
+            issued = await subscription_service.create_paid_subscription(buyer, tariff, new_end_date)
+            if not issued:
+                logger.error(f"Не удалось выдать подписку по платежу ID:{payment_id}, выдача будет повторена")
+                await PaymentService._defer(session, payment_id)
+                return PaymentResult(PaymentOutcome.DEFERRED, payment)
+
+        # 3. Фиксируем результат одной транзакцией
+        try:
+            if issued:
+                subscription = issued
+                session.add(subscription)
+                await session.flush()
+            else:
+                subscription = await Subscription.get_for_update(session, payment.subscription.id)
+                current_end_date = subscription.end_date if subscription.status == SubscriptionStatus.ACTIVE and subscription.end_date > datetime.now() else datetime.now()
+                new_end_date = current_end_date + timedelta(days=tariff.duration_days)
+                subscription.end_date = new_end_date
+                subscription.status = SubscriptionStatus.ACTIVE
 
-            # 3. Начисляем реферальный бонус (если это первая покупка)
-            buyer: User = payment.user
-            if buyer.inviter_id and not buyer.had_first_purchase:
-                inviter = await User.get_by_telegram_id(session, buyer.inviter_id)
-                if inviter:
-                    commission = int(payment.amount * (settings.REFERRAL_COMMISSION_PERCENT / 100))
-                    await inviter.update(session, balance=inviter.balance + commission)
-                    logger.info(f"Начислен реф. бонус {commission}р. пользователю {inviter.telegram_id}")
+            # Статус succeeded для консистентности с YooKassa
+            if not await Payment.set_status_if_processing(session, payment_id, "succeeded", subscription_id=subscription.id):
+                # Обработку посчитали зависшей и забрал другой запрос
+                raise RuntimeError("платеж больше не в обработке")
 
-            await buyer.update(session, had_first_purchase=True)
+            # Реферальный бонус (если это первая покупка)
+            if await User.mark_first_purchase(session, buyer.telegram_id) and buyer.inviter_id:
+                commission = int(payment.amount * (settings.REFERRAL_COMMISSION_PERCENT / 100))
+                if await User.add_balance(session, buyer.inviter_id, commission):
+                    logger.info(f"Начислен реф. бонус {commission}р. пользователю {buyer.inviter_id}")
 
+            # Уведомление покупателю отправится в фоне после коммита
+            Notification.add(
+                session,
+                chat_id=payment.user_id,
+                text_key="subscription_purchased_with_config_message",
+                params={
+                    "tariff_name": tariff.name,
+                    "sub_name": subscription.subscription_name,
+                    "logo_name": settings.LOGO_NAME,
+                },
+                locale=buyer.language_code,
+                button_url=subscription.subscription_url,
+                message_effect_id="5159385139981059251"
+            )
             await session.commit()
-            logger.info(f"Платеж ID:{payment.id} успешно подтвержден.")
-            return payment
+        except Exception as e:
+            issued_uuid = issued.remnawave_uuid if issued else None
+            await session.rollback()
+            logger.error(f"Не удалось сохранить подтверждение платежа ID:{payment_id}: {e}")
+            if issued_uuid and not await remna_service.delete_user(issued_uuid):
+                logger.critical(
+                    f"Пользователь Remnawave uuid={issued_uuid} выдан по платежу ID:{payment_id}, "
+                    f"но не сохранен в БД и не удален из панели"
+                )
+            await PaymentService._defer(session, payment_id)
+            return PaymentResult(PaymentOutcome.DEFERRED, payment)
+
+        set_committed_value(payment, "status", "succeeded")
+        set_committed_value(payment, "subscription_id", subscription.id)
+        set_committed_value(payment, "subscription", subscription)
+        notification_service.wakeup()
+
+        if not issued:
+            # Новая дата уходит в панель уже без блокировок. Если панель недоступна, изменение будет дослано в фоне
+            await remna_service.sync_user_expiration(subscription.remnawave_uuid, subscription.end_date)
+
+        logger.info(f"Платеж ID:{payment_id} успешно подтвержден.")
+        return PaymentResult(PaymentOutcome.SUCCEEDED, payment)
+
+    @staticmethod
+    async def _defer(session: AsyncSession, payment_id: int) -> None:
+        """
+        Отмечает платеж оплаченным без выданной подписки ('paid'). Если и это не удалось,
+        платеж остается в 'processing' и будет повторен как зависший.
+        """
+        try:
+            await Payment.set_status_if_processing(session, payment_id, "paid")
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Не удалось отметить платеж ID:{payment_id} оплаченным: {e}")
+
+    @staticmethod
+    async def _cancel(session: AsyncSession, payment: Payment) -> PaymentResult:
+        if not await Payment.set_status_if_pending(session, payment.id, "canceled"):
+            return PaymentResult(PaymentOutcome.ALREADY_PROCESSED, payment)
+        Notification.add(
+            session,
+            chat_id=payment.user_id,
+            text_key="payment_cancelled_message",
+            params={"tariff_name": payment.tariff.name},
+            locale=payment.user.language_code
+        )
+        await session.commit()
+        notification_service.wakeup()
+        set_committed_value(payment, "status", "canceled")
+        logger.warning(f"Платеж ID:{payment.id} отмечен как отмененный.")
+        return PaymentResult(PaymentOutcome.CANCELED, payment)
 
     async def fail_payment(self, payment_id: int) -> Optional[Payment]:
         """Отмечает платеж как отмененный или неудачный."""
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.core.circuit_breaker import CircuitState
+from app.core.config import settings
+from app.logger import logger
+from app.services.lease_service import lease_service
+from app.services.remnawave_service import remna_service
+from database.enums import SubscriptionStatus
+from database.models import RemnaPoolUser, Subscription
+from database.session import get_session
+
+
+class PoolService:
+    """
+    Пул заранее созданных пользователей Remnawave.
+
+    Фоновая задача держит в пуле REMNA_POOL_SIZE пользователей в статусе DISABLED без владельца.
+    Покупка новой подписки не ходит в панель при создании ссылки на оплату, а при подтверждении
+    оплаты забирает пользователя из пула (SubscriptionService.create_paid_subscription).
+    Та же задача удаляет неоплаченные заготовки подписок старше REMNA_PENDING_TTL_HOURS,
+    оставшиеся от прежней схемы оформления.
+
+    Пул общий для всех процессов, поэтому обслуживает его только держатель аренды "remna_pool":
+    он продлевает ее на каждом шаге, а если процесс остановится, аренду подхватит другой.
+    """
+
+    LEASE_NAME = "remna_pool"
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._last_reap_at = 0.0
+
+    async def start(self) -> None:
+        """Запускает обслуживание пула. Вызывается в lifespan."""
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await lease_service.release(self.LEASE_NAME)
+
+    async def _loop(self) -> None:
+        # Аренда переживает один пропущенный шаг, но не дольше пары интервалов
+        lease_ttl = settings.REMNA_POOL_REFILL_INTERVAL * 3
+        while True:
+            try:
+                if not await lease_service.acquire(self.LEASE_NAME, lease_ttl):
+                    await asyncio.sleep(settings.REMNA_POOL_REFILL_INTERVAL)
+                    continue
+                await self.refill()
+                if time.monotonic() - self._last_reap_at >= settings.REMNA_PENDING_REAP_INTERVAL:
+                    await self.reap_orphaned_pending()
+                    self._last_reap_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания пула пользователей Remnawave: {e}")
+            await asyncio.sleep(settings.REMNA_POOL_REFILL_INTERVAL)
+
+    async def refill(self) -> int:
+        """Досоздает пользователей до REMNA_POOL_SIZE. Пока панель недоступна, ничего не делает."""
+        if remna_service.breaker.state != CircuitState.CLOSED:
+            return 0
+        async with get_session() as session:
+            missing = settings.REMNA_POOL_SIZE - await RemnaPoolUser.count(session)
+        if missing <= 0:
+            return 0
+
+        semaphore = asyncio.Semaphore(settings.REMNA_POOL_REFILL_CONCURRENCY)
+
+        async def create_one() -> bool:
+            async with semaphore:
+                username = f"{settings.LOGO_NAME}-pool-{uuid.uuid4().hex[:10]}"
+                remna_user = await remna_service.create_user_subscription(
+                    telegram_id=None,
+                    subscription_name=username,
+                    expire_date=datetime.now(),
+                    description="Bot pool user"
+                )
+                if not remna_user:
+                    return False
+                async with get_session() as session:
+                    await RemnaPoolUser.create(
+                        session=session,
+                        remna_uuid=str(remna_user.uuid),
+                        remna_short_uuid=str(remna_user.short_uuid),
+                        username=remna_user.username,
+                        subscription_url=remna_user.subscription_url
+                    )
+                return True
+
+        results: List[bool] = await asyncio.gather(*(create_one() for _ in range(missing)))
+        created = sum(results)
+        if created:
+            logger.info(f"Пул пользователей Remnawave пополнен на {created}")
+        return created
+
+    async def reap_orphaned_pending(self, limit: int = 100) -> int:
+        """Удаляет из панели и БД брошенные заготовки покупки (см. Subscription.get_orphaned_pending)."""
+        created_before = datetime.now() - timedelta(hours=settings.REMNA_PENDING_TTL_HOURS)
+        async with get_session() as session:
+            orphaned = await Subscription.get_orphaned_pending(session, created_before, limit)
+            reaped = 0
+            for subscription in orphaned:
+                if subscription.status != SubscriptionStatus.DISABLED:
+                    continue
+                if not await remna_service.delete_user(subscription.remnawave_uuid):
+                    continue
+                await Subscription.delete_orphaned(session, subscription.id)
+                reaped += 1
+        if reaped:
+            logger.info(f"Удалено неоплаченных заготовок подписок: {reaped}")
+        return reaped
+
+
+# --- Единственный экземпляр сервиса ---
+pool_service = PoolService()
@@ -1,44 +1,144 @@
+import asyncio
+import time
 from datetime import datetime
-from typing import Optional, List
+from typing import Awaitable, Callable, List, Optional, TypeVar
 
+import httpx
+from remnawave.exceptions import NetworkError, NotFoundError, ServerError
+
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
 from app.core.config import settings
 from app.logger import logger
+from app.services.lease_service import lease_service
 from remnawave.models import (
     CreateUserRequestDto,
     UpdateUserRequestDto,
     UserResponseDto,
 )
 from database.enums import SubscriptionStatus
+from database.models import RemnaDeferredUpdate
+from database.session import get_session
+
+T = TypeVar("T")
+
+# Ошибки, говорящие о недоступности панели. Остальные (4xx) означают, что панель отвечает.
+_PANEL_FAILURES = (asyncio.TimeoutError, httpx.TransportError, ServerError, NetworkError)
 
 
 class RemnaService:
     """
     Класс-сервис для инкапсуляции всей логики взаимодействия с Remnawave API.
     Предоставляет простые методы для других частей приложения.
+
+    Список отрядов кэшируется на REMNA_SQUADS_CACHE_TTL секунд. Одновременные запросы
+    ждут один общий запрос к панели. Если включен REMNA_SQUADS_STALE_WHILE_REVALIDATE,
+    устаревший список отдается сразу, а обновляется в фоне. Вебхуки об изменении
+    топологии сбрасывают кэш (invalidate_squads).
+
+    Вызовы панели ограничены REMNA_CALL_TIMEOUT и идут через circuit breaker: пока панель
+    недоступна, запросы отклоняются сразу, а не висят до таймаута. Изменения даты окончания
+    и передачи пользователей пула покупателям, которые не удалось отправить, сохраняются
+    в remna_deferred_updates и досылаются в фоне, когда панель снова отвечает.
     """
 
+    REPLAY_LEASE_NAME = "remna_replay"
+
+    def __init__(self):
+        self._squads: Optional[List[str]] = None
+        self._squads_fetched_at: float = 0.0
+        self._squads_generation: int = 0
+        self._squads_refresh: Optional[asyncio.Task] = None
+        self.breaker = CircuitBreaker(
+            name="remnawave",
+            failure_threshold=settings.REMNA_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.REMNA_BREAKER_RESET_TIMEOUT
+        )
+        self._replay_task: Optional[asyncio.Task] = None
+
+    async def _call(self, request: Callable[[], Awaitable[T]]) -> T:
+        """Выполняет запрос к панели с таймаутом через circuit breaker."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Remnawave недоступна, повтор через {self.breaker.retry_after or 0:.0f} сек.")
+        try:
+            result = await asyncio.wait_for(request(), timeout=settings.REMNA_CALL_TIMEOUT)
+        except _PANEL_FAILURES:
+            self.breaker.record_failure()
+            if self.breaker.state == CircuitState.OPEN:
+                logger.warning("Remnawave не отвечает, цепь разомкнута")
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def start(self) -> None:
+        """Запускает фоновую досылку отложенных изменений. Вызывается в lifespan."""
+        self._replay_task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self) -> None:
+        if self._replay_task:
+            self._replay_task.cancel()
+            await asyncio.gather(self._replay_task, return_exceptions=True)
+            self._replay_task = None
+            await lease_service.release(self.REPLAY_LEASE_NAME)
+
     async def _get_all_squad_uuids(self) -> List[str]:
         """Приватный метод для получения UUID всех отрядов в панели."""
         if not settings.REMNA_SDK:
             return []
+        if self._squads is not None:
+            if time.monotonic() - self._squads_fetched_at < settings.REMNA_SQUADS_CACHE_TTL:
+                return self._squads
+            if settings.REMNA_SQUADS_STALE_WHILE_REVALIDATE:
+                self._refresh_squads()
+                return self._squads
+        # shield: отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(self._refresh_squads())
+
+    def _refresh_squads(self) -> asyncio.Task:
+        """Запускает обновление списка отрядов, если оно еще не идет (single-flight)."""
+        if self._squads_refresh is None or self._squads_refresh.done():
+            self._squads_refresh = asyncio.create_task(self._fetch_squads(self._squads_generation))
+        return self._squads_refresh
+
+    async def _fetch_squads(self, generation: int) -> List[str]:
         try:
-            response = await settings.REMNA_SDK.internal_squads.get_internal_squads()
-            if response and response.internal_squads:
-                return [str(squad.uuid) for squad in response.internal_squads]
+            response = await self._call(settings.REMNA_SDK.internal_squads.get_internal_squads)
         except Exception as e:
             logger.error(f"Не удалось получить список отрядов из Remnawave: {e}")
-        return []
+            return self._squads or []
+
+        squads = [str(squad.uuid) for squad in response.internal_squads] if response and response.internal_squads else []
+        # Если кэш сбросили, пока шел запрос, ответ мог устареть — не сохраняем его
+        if generation == self._squads_generation:
+            self._squads = squads
+            self._squads_fetched_at = time.monotonic()
+        return squads
+
+    def invalidate_squads(self) -> None:
+        """Сбрасывает кэш отрядов и сразу запускает его обновление в фоне."""
+        self._squads = None
+        self._squads_generation += 1
+        self._squads_refresh = None
+        if settings.REMNA_SDK:
+            self._refresh_squads()
 
     async def create_user_subscription(
         self,
-        telegram_id: int,
+        telegram_id: Optional[int],
         subscription_name: str,
         expire_date: datetime,
         status=SubscriptionStatus.DISABLED,
+        description: Optional[str] = None,
     ) -> Optional[UserResponseDto]:
         """
         Создает нового пользователя в Remnawave и сразу добавляет его во все отряды.
         Это основной метод для создания новой подписки.
+        Без telegram_id создается пользователь для пула (см. pool_service).
         """
         if not settings.REMNA_SDK:
             logger.critical("Попытка создать пользователя Remnawave, но SDK не инициализирован.")
@@ -52,23 +152,120 @@ class RemnaService:
             create_dto = CreateUserRequestDto(
                 username=subscription_name,
                 telegram_id=telegram_id,
-                description=f"Bot user, tg_id: {telegram_id}",
+                description=description or f"Bot user, tg_id: {telegram_id}",
                 expire_at=expire_date,
                 active_internal_squads=all_squads,
                 status=status
             )
 
-            response = await settings.REMNA_SDK.users.create_user(create_dto)
+            response = await self._call(lambda: settings.REMNA_SDK.users.create_user(create_dto))
 
             if response:
                 logger.info(f"Успешно создан пользователь в Remnawave: {response.username} (uuid: {response.uuid})")
                 return response
             return None
 
+        except CircuitOpenError as e:
+            logger.warning(f"Пользователь Remnawave для tg_id={telegram_id} не создан: {e}")
+            return None
         except Exception as e:
             logger.error(f"Ошибка при создании пользователя Remnawave для tg_id={telegram_id}: {e}")
             return None
 
+    async def assign_user(
+        self,
+        remna_uuid: str,
+        telegram_id: int,
+        subscription_name: str,
+        expire_date: datetime
+    ) -> Optional[UserResponseDto]:
+        """
+        Передает пользователя из пула покупателю: переименовывает, привязывает telegram_id,
+        обновляет отряды и активирует до expire_date.
+        """
+        if not settings.REMNA_SDK:
+            logger.critical("Попытка обновить пользователя Remnawave, но SDK не инициализирован.")
+            return None
+
+        try:
+            response = await self._assign_user(remna_uuid, telegram_id, subscription_name, expire_date)
+            if response:
+                logger.info(f"Пользователь пула {remna_uuid} передан tg_id={telegram_id} как {subscription_name}")
+            return response
+        except CircuitOpenError as e:
+            logger.warning(f"Пользователь пула {remna_uuid} не передан tg_id={telegram_id}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при передаче пользователя пула {remna_uuid} tg_id={telegram_id}: {e}")
+            return None
+
+    async def _assign_user(
+        self,
+        remna_uuid: str,
+        telegram_id: int,
+        subscription_name: str,
+        expire_date: datetime
+    ) -> Optional[UserResponseDto]:
+        all_squads = await self._get_all_squad_uuids()
+        update_dto = UpdateUserRequestDto(
+            uuid=remna_uuid,
+            username=subscription_name,
+            telegram_id=telegram_id,
+            description=f"Bot user, tg_id: {telegram_id}",
+            expire_at=expire_date,
+            status=SubscriptionStatus.ACTIVE,
+            active_internal_squads=all_squads or None
+        )
+        return await self._call(lambda: settings.REMNA_SDK.users.update_user(update_dto))
+
+    async def assign_or_defer(
+        self,
+        remna_uuid: str,
+        telegram_id: int,
+        subscription_name: str,
+        expire_date: datetime
+    ) -> bool:
+        """
+        Передает пользователя пула покупателю (assign_user). Если панель недоступна,
+        сохраняет передачу целиком для фоновой досылки и сразу возвращает управление.
+
+        :return: True, если пользователь передан сразу, False — если передача отложена.
+        """
+        if await self.assign_user(remna_uuid, telegram_id, subscription_name, expire_date):
+            return True
+        async with get_session() as session:
+            await RemnaDeferredUpdate.upsert(
+                session, remna_uuid, expire_date, telegram_id=telegram_id, username=subscription_name
+            )
+        logger.warning(f"Передача пользователя пула {remna_uuid} tg_id={telegram_id} отложена до восстановления панели")
+        return False
+
+    async def delete_user(self, remna_uuid: str) -> bool:
+        """
+        Удаляет пользователя из панели вместе с его отложенными изменениями.
+        Уже удаленный пользователь считается успехом.
+        """
+        if not settings.REMNA_SDK:
+            return False
+        try:
+            await self._call(lambda: settings.REMNA_SDK.users.delete_user(remna_uuid))
+        except NotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось удалить пользователя Remnawave uuid={remna_uuid}: {e}")
+            return False
+        async with get_session() as session:
+            await RemnaDeferredUpdate.discard(session, remna_uuid)
+        return True
+
+    async def _update_expiration(self, remna_uuid: str, new_expire_date: datetime) -> Optional[UserResponseDto]:
+        update_dto = UpdateUserRequestDto(
+            uuid=remna_uuid,
+            expire_at=new_expire_date,
+            status=SubscriptionStatus.ACTIVE
+        )
+        return await self._call(lambda: settings.REMNA_SDK.users.update_user(update_dto))
+
     async def update_user_expiration(
         self,
         remna_uuid: str,
@@ -82,20 +279,85 @@ class RemnaService:
             return None
 
         try:
-            update_dto = UpdateUserRequestDto(
-                uuid=remna_uuid,
-                expire_at=new_expire_date,
-                status=SubscriptionStatus.ACTIVE
-            )
-            response = await settings.REMNA_SDK.users.update_user(update_dto)
+            response = await self._update_expiration(remna_uuid, new_expire_date)
 
             if response:
                 logger.info(f"Успешно обновлена дата подписки для Remnawave uuid={remna_uuid}")
                 return response
             return None
+        except CircuitOpenError as e:
+            logger.warning(f"Дата подписки для Remnawave uuid={remna_uuid} не обновлена: {e}")
+            return None
         except Exception as e:
             logger.error(f"Ошибка при обновлении подписки для Remnawave uuid={remna_uuid}: {e}")
             return None
 
+    async def sync_user_expiration(self, remna_uuid: str, new_expire_date: datetime) -> bool:
+        """
+        Отправляет в панель новую дату окончания подписки. Если панель недоступна,
+        сохраняет изменение для фоновой досылки и сразу возвращает управление.
+
+        :return: True, если панель обновлена сразу, False — если изменение отложено.
+        """
+        async with get_session() as session:
+            # Пока пользователь пула не передан покупателю, новая дата уходит вместе с передачей
+            assignment_pending = await RemnaDeferredUpdate.has_assignment(session, remna_uuid)
+        if not assignment_pending and await self.update_user_expiration(remna_uuid, new_expire_date):
+            async with get_session() as session:
+                # Более старое отложенное изменение больше не нужно и не должно перезаписать новое
+                await RemnaDeferredUpdate.delete_applied(session, remna_uuid)
+            return True
+        async with get_session() as session:
+            await RemnaDeferredUpdate.upsert(session, remna_uuid, new_expire_date)
+        logger.warning(f"Обновление даты для Remnawave uuid={remna_uuid} отложено до восстановления панели")
+        return False
+
+    async def _replay_loop(self) -> None:
+        # Досылает только один процесс: держатель аренды, продлеваемой на каждом шаге
+        lease_ttl = settings.REMNA_DEFERRED_REPLAY_INTERVAL * 3
+        while True:
+            await asyncio.sleep(settings.REMNA_DEFERRED_REPLAY_INTERVAL)
+            try:
+                if not await lease_service.acquire(self.REPLAY_LEASE_NAME, lease_ttl):
+                    continue
+                await self.replay_deferred()
+            except Exception as e:
+                logger.error(f"Ошибка досылки отложенных изменений в Remnawave: {e}")
+
+    async def replay_deferred(self, limit: int = 100) -> int:
+        """
+        Досылает в панель отложенные изменения дат и передачи пользователей пула в порядке поступления.
+        Пока цепь разомкнута, ничего не делает; в half-open первый запрос служит пробным.
+
+        :return: Количество успешно отправленных изменений.
+        """
+        if not settings.REMNA_SDK or self.breaker.state == CircuitState.OPEN:
+            return 0
+        async with get_session() as session:
+            batch = await RemnaDeferredUpdate.get_batch(
+                session, limit=limit, max_attempts=settings.REMNA_DEFERRED_MAX_ATTEMPTS
+            )
+            applied = 0
+            for deferred in batch:
+                try:
+                    if deferred.telegram_id is not None:
+                        await self._assign_user(
+                            deferred.remna_uuid, deferred.telegram_id, deferred.username, deferred.expire_at
+                        )
+                    else:
+                        await self._update_expiration(deferred.remna_uuid, deferred.expire_at)
+                except CircuitOpenError:
+                    break
+                except Exception as e:
+                    await RemnaDeferredUpdate.mark_failed(session, deferred.remna_uuid, str(e))
+                    if self.breaker.state == CircuitState.OPEN:
+                        break
+                    continue
+                await RemnaDeferredUpdate.delete_applied(session, deferred.remna_uuid, deferred.expire_at)
+                applied += 1
+        if applied:
+            logger.info(f"Дослано отложенных изменений в Remnawave: {applied}")
+        return applied
+
 # --- Создаем единственный экземпляр сервиса ---
-remna_service = RemnaService()
\ No newline at end of file
+remna_service = RemnaService()
@@ -4,7 +4,7 @@ from aiogram.types import User as UserTG
 from app.core.config import settings
 from app.logger import logger
 from app.services.remnawave_service import remna_service
-from database.models import Subscription, User, Tariff
+from database.models import Subscription, User, Tariff, RemnaPoolUser
 from database.session import get_session
 import re
 from transliterate import translit
@@ -112,43 +112,59 @@ class SubscriptionService:
                         f"{user_db.username}|{user_db.telegram_id}")
             return new_subscription
 
-    async def create_pending_subscription(
+    async def create_paid_subscription(
             self,
             user_db: User,
-            tariff: Optional[Tariff]
+            tariff: Tariff,
+            expire_date: datetime
     ) -> Optional[Subscription]:
         """
-        Создает неактивную подписку в Remnawave и в локальной БД перед оплатой.
-        Это "заготовка", которая будет активирована после успешного платежа.
+        Выдает оплаченную новую подписку в панели. Берет готового пользователя из пула
+        (см. pool_service), а если пул пуст — создает пользователя в Remnawave.
+
+        Возвращает еще не сохраненную подписку: ее добавляет транзакция подтверждения платежа
+        вместе со статусом платежа. Вызывается без открытых транзакций и блокировок, а если
+        транзакция не зафиксируется, пользователя нужно удалить из панели (remna_service.delete_user).
         """
-        async with get_session() as session:
-            unique_suffix = uuid.uuid4().hex[:6]
-            tg_user_name = self.normalize_username(user_db.username)
-            subscription_name = f"{tg_user_name}-{settings.LOGO_NAME}-{unique_suffix}"
-            expire_date = datetime.now()
-            # Создаем пользователя в Remnawave с датой окончания "в прошлом",
-            # чтобы он был неактивен до момента оплаты.
+        unique_suffix = uuid.uuid4().hex[:6]
+        tg_user_name = self.normalize_username(user_db.username)
+        subscription_name = f"{tg_user_name}-{settings.LOGO_NAME}-{unique_suffix}"
+
+        # Пользователь из пула забирается в отдельной транзакции, чтобы не фиксировать раньше времени основную
+        async with get_session() as pool_session:
+            pool_user = await RemnaPoolUser.take(pool_session)
+        if pool_user:
+            remna_uuid = pool_user.remna_uuid
+            short_uuid = pool_user.remna_short_uuid
+            subscription_url = pool_user.subscription_url
+            # Если панель недоступна, передача (имя, telegram_id, отряды, дата) будет дослана в фоне
+            await remna_service.assign_or_defer(remna_uuid, user_db.telegram_id, subscription_name, expire_date)
+        else:
+            logger.warning(f"Пул пользователей Remnawave пуст, создаем пользователя для {user_db.telegram_id}")
             remna_user = await remna_service.create_user_subscription(
                 telegram_id=user_db.telegram_id,
                 subscription_name=subscription_name,
-                expire_date=expire_date
+                expire_date=expire_date,
+                status=SubscriptionStatus.ACTIVE
             )
             if not remna_user:
-                logger.error(f"Не удалось создать пользователя в Remnawave для заготовки {user_db.telegram_id}")
+                logger.error(f"Не удалось создать пользователя в Remnawave для оплаченной подписки {user_db.telegram_id}")
                 return None
-
-            subscription = await Subscription.create(
-                session=session,
-                telegram_id=user_db.telegram_id,
-                end_date=expire_date,
-                subscription_name=subscription_name,
-                remnawave_uuid=str(remna_user.uuid),
-                remnawave_short_uuid=str(remna_user.short_uuid),
-                subscription_url=remna_user.subscription_url,
-                status = SubscriptionStatus.DISABLED,
-                tariff_id=tariff.id
-            )
-            return subscription
+            remna_uuid = str(remna_user.uuid)
+            short_uuid = str(remna_user.short_uuid)
+            subscription_url = remna_user.subscription_url
+
+        subscription = Subscription(
+            telegram_id=user_db.telegram_id,
+            end_date=expire_date,
+            subscription_name=subscription_name,
+            remnawave_uuid=remna_uuid,
+            remnawave_short_uuid=short_uuid,
+            subscription_url=subscription_url,
+            status=SubscriptionStatus.ACTIVE,
+            tariff_id=tariff.id
+        )
+        return subscription
 
     async def get_by_remna_uuid(self, remna_uuid: str) -> Optional[Subscription]:
         """
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from remnawave.models import UserResponseDto
+
+from app.core.config import settings
+from app.logger import logger
+from app.services.user_service import _generate_referral_code
+from app.services.utils import to_naive_utc
+from database.enums import SubscriptionStatus
+from database.models import User, Subscription
+from database.session import get_session
+
+
+@dataclass
+class SyncReport:
+    """Итоги сверки подписок с панелью Remnawave."""
+    panel_total: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    orphaned: int = 0        # Есть в БД, но нет в панели
+    skipped: int = 0         # Есть в панели, но без telegram_id
+    users_created: int = 0
+    failed_chunks: int = 0
+    fetch_seconds: float = 0.0
+    diff_seconds: float = 0.0
+    apply_seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.failed_chunks == 0
+
+
+def _panel_values(dto: UserResponseDto) -> Dict[str, Any]:
+    """
+    Поля подписки по данным панели. Пустые значения отбрасываются,
+    как и в map_user_dto_to_subscription, чтобы не затирать данные в БД.
+    """
+    values = {
+        "telegram_id": dto.telegram_id,
+        "start_date": to_naive_utc(dto.created_at),
+        "end_date": to_naive_utc(dto.expire_at),
+        "remnawave_uuid": str(dto.uuid),
+        "remnawave_short_uuid": dto.short_uuid,
+        "subscription_name": dto.username,
+        "subscription_url": dto.subscription_url,
+        "description": dto.description,
+        "hwidDeviceLimit": dto.hwid_device_limit,
+        "first_connected": to_naive_utc(dto.first_connected),
+        "updated_at": to_naive_utc(dto.updated_at),
+    }
+    if dto.status is not None:
+        try:
+            values["status"] = SubscriptionStatus(dto.status.value)
+        except ValueError:
+            logger.warning(f"Несовпадение статуса, нужно добавить: {dto.status.value}")
+    return {key: value for key, value in values.items() if value is not None}
+
+
+def _normalize(value: Any) -> Any:
+    return to_naive_utc(value) if isinstance(value, datetime) else value
+
+
+class SyncService:
+    """
+    Сверка подписок в БД с пользователями панели Remnawave.
+
+    Пользователи панели выгружаются страницами параллельно (не больше REMNA_SYNC_CONCURRENCY
+    запросов одновременно), подписки из БД читаются одним запросом без ORM-объектов.
+    Расхождения ищутся в памяти по UUID, а изменения пишутся пакетными UPDATE/INSERT —
+    по одной транзакции на чанк из REMNA_SYNC_CHUNK_SIZE строк. Ошибка в чанке откатывает
+    только его, остальные чанки применяются.
+    """
+
+    async def reconcile(self) -> SyncReport:
+        report = SyncReport()
+
+        started = time.monotonic()
+        panel_users = await self._fetch_panel_users()
+        report.panel_total = len(panel_users)
+        report.fetch_seconds = time.monotonic() - started
+
+        started = time.monotonic()
+        async with get_session() as session:
+            local_rows = await Subscription.get_sync_snapshot(session)
+        to_update, to_insert = self._diff(panel_users, local_rows, report)
+        report.diff_seconds = time.monotonic() - started
+
+        started = time.monotonic()
+        await self._apply_updates(to_update, report)
+        await self._apply_inserts(to_insert, report)
+        report.apply_seconds = time.monotonic() - started
+
+        logger.info(f"Синхронизация с Remnawave завершена: {report}")
+        return report
+
+    async def _fetch_panel_users(self) -> Dict[str, UserResponseDto]:
+        """Выгружает всех пользователей панели. Ошибка любой страницы прерывает сверку до записи в БД."""
+        page_size = settings.REMNA_SYNC_PAGE_SIZE
+        first_page = await settings.REMNA_SDK.users.get_all_users(start=0, size=page_size)
+        semaphore = asyncio.Semaphore(settings.REMNA_SYNC_CONCURRENCY)
+
+        async def fetch(start: int) -> List[UserResponseDto]:
+            async with semaphore:
+                page = await settings.REMNA_SDK.users.get_all_users(start=start, size=page_size)
+                return page.users
+
+        pages = await asyncio.gather(*(fetch(start) for start in range(page_size, first_page.total, page_size)))
+        # Пока идет выгрузка, страницы могут сдвинуться — дубли схлопываются по UUID
+        users: Dict[str, UserResponseDto] = {}
+        for page_users in (first_page.users, *pages):
+            for user in page_users:
+                users[str(user.uuid)] = user
+        return users
+
+    @staticmethod
+    def _diff(
+            panel_users: Dict[str, UserResponseDto],
+            local_rows: List[Dict[str, Any]],
+            report: SyncReport
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Возвращает строки для пакетного UPDATE (с id) и INSERT."""
+        local_by_uuid = {row["remnawave_uuid"]: row for row in local_rows}
+        to_update: List[Dict[str, Any]] = []
+        to_insert: List[Dict[str, Any]] = []
+
+        for remna_uuid, dto in panel_users.items():
+            values = _panel_values(dto)
+            local = local_by_uuid.get(remna_uuid)
+            if local is None:
+                if dto.telegram_id is None:
+                    report.skipped += 1
+                    continue
+                to_insert.append(values)
+                continue
+
+            changed = {key: value for key, value in values.items() if _normalize(local.get(key)) != value}
+            if changed:
+                to_update.append({"id": local["id"], **changed})
+            else:
+                report.unchanged += 1
+
+        orphaned = [uuid for uuid in local_by_uuid if uuid not in panel_users]
+        report.orphaned = len(orphaned)
+        if orphaned:
+            logger.warning(f"Подписок в БД без пользователя в панели: {len(orphaned)}")
+        return to_update, to_insert
+
+    async def _apply_updates(self, rows: List[Dict[str, Any]], report: SyncReport) -> None:
+        chunk_size = settings.REMNA_SYNC_CHUNK_SIZE
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i + chunk_size]
+            async with get_session() as session:
+                try:
+                    await Subscription.bulk_update(session, chunk)
+                    await session.commit()
+                    report.updated += len(chunk)
+                except Exception as e:
+                    await session.rollback()
+                    report.failed_chunks += 1
+                    logger.error(f"Не удалось обновить чанк подписок ({len(chunk)} шт.): {e}")
+
+    async def _apply_inserts(self, rows: List[Dict[str, Any]], report: SyncReport) -> None:
+        chunk_size = settings.REMNA_SYNC_CHUNK_SIZE
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i + chunk_size]
+            async with get_session() as session:
+                try:
+                    users_created = await self._create_missing_users(session, chunk)
+                    await Subscription.bulk_insert(session, chunk)
+                    await session.commit()
+                    report.created += len(chunk)
+                    report.users_created += users_created
+                except Exception as e:
+                    await session.rollback()
+                    report.failed_chunks += 1
+                    logger.error(f"Не удалось добавить чанк подписок ({len(chunk)} шт.): {e}")
+
+    @staticmethod
+    async def _create_missing_users(session, rows: List[Dict[str, Any]]) -> int:
+        """Добавляет в текущую транзакцию владельцев подписок, которых еще нет в БД."""
+        names = {row["telegram_id"]: row.get("subscription_name") for row in rows}
+        missing = set(names) - await User.get_existing_ids(session, names)
+        if not missing:
+            return 0
+
+        codes = {telegram_id: _generate_referral_code() for telegram_id in missing}
+        while True:
+            taken = await User.get_existing_referral_codes(session, codes.values())
+            used = set()
+            collisions = []
+            for telegram_id, code in codes.items():
+                if code in taken or code in used:
+                    collisions.append(telegram_id)
+                used.add(code)
+            if not collisions:
+                break
+            for telegram_id in collisions:
+                codes[telegram_id] = _generate_referral_code()
+
+        await User.bulk_insert(session, [
+            {
+                "telegram_id": telegram_id,
+                "username": names[telegram_id],
+                "referral_code": codes[telegram_id],
+                "is_admin": telegram_id in settings.ADMIN_IDS,
+            }
+            for telegram_id in missing
+        ])
+        return len(missing)
+
+
+# --- Единственный экземпляр сервиса ---
+sync_service = SyncService()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+
+from app.core.config import settings
+from app.core.metrics import QueueMetrics
+from app.logger import logger
+
+# Метрики очереди апдейтов Telegram
+update_queue_metrics = QueueMetrics()
+
+
+def _chat_key(update: Update) -> Tuple[str, int]:
+    """Ключ упорядочивания: чат апдейта, иначе пользователь, иначе сам апдейт (без упорядочивания)."""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat:
+        return "chat", context.chat.id
+    if context.user:
+        return "user", context.user.id
+    return "update", update.update_id
+
+
+class UpdateQueue:
+    """
+    Асинхронная обработка апдейтов Telegram.
+
+    Эндпоинт вебхука только проверяет апдейт, кладет его в очередь и сразу отвечает 200,
+    поэтому медленные хендлеры (например, выдача триала с походом в панель) не задерживают
+    доставку апдейтов. Апдейты одного чата обрабатываются строго по порядку и по одному,
+    разные чаты — параллельно пулом из BOT_UPDATE_WORKERS воркеров.
+
+    Очередь ограничена BOT_UPDATE_QUEUE_SIZE апдейтами: при переполнении эндпоинт ждет
+    свободного места, и Telegram сам снижает темп доставки. При остановке очередь
+    дорабатывает принятые апдейты (не дольше BOT_UPDATE_DRAIN_TIMEOUT секунд).
+    """
+
+    def __init__(self):
+        # Апдейты, ожидающие обработки, по чатам. Чат есть в словаре, пока его апдейты в работе
+        self._chats: Dict[Tuple[str, int], Deque[Tuple[Update, float]]] = {}
+        self._ready: asyncio.Queue[Tuple[str, int]] = asyncio.Queue()
+        self._space = asyncio.Condition()
+        self._size = 0
+        self._tasks: List[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._dispatcher: Optional[Dispatcher] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def put(self, update: Update) -> None:
+        """Ставит апдейт в очередь. Если очередь заполнена, ждет освобождения места."""
+        if self._size >= settings.BOT_UPDATE_QUEUE_SIZE:
+            started = time.perf_counter()
+            async with self._space:
+                await self._space.wait_for(lambda: self._size < settings.BOT_UPDATE_QUEUE_SIZE)
+                self._size += 1
+            waited = time.perf_counter() - started
+            update_queue_metrics.full_waits += 1
+            update_queue_metrics.full_wait_seconds += waited
+            logger.bind(source="bot").warning(
+                f"Очередь апдейтов переполнена, апдейт {update.update_id} ждал {waited:.2f} сек."
+            )
+        else:
+            self._size += 1
+
+        update_queue_metrics.enqueue()
+        key = _chat_key(update)
+        pending = self._chats.get(key)
+        if pending is None:
+            self._chats[key] = deque([(update, time.perf_counter())])
+            self._ready.put_nowait(key)
+        else:
+            # Чат уже в работе или ждет воркера: апдейт обработает тот же воркер следом
+            pending.append((update, time.perf_counter()))
+
+    async def start(self, dispatcher: Dispatcher, bot: Bot) -> None:
+        """Запускает воркеры. Вызывается в lifespan."""
+        self._dispatcher = dispatcher
+        self._bot = bot
+        for _ in range(settings.BOT_UPDATE_WORKERS):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """Дорабатывает принятые апдейты и останавливает воркеры."""
+        if self._size:
+            logger.bind(source="bot").info(f"Дорабатываем апдейты Telegram в очереди: {self._size}")
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: self._size == 0),
+                        timeout=settings.BOT_UPDATE_DRAIN_TIMEOUT
+                    )
+            except asyncio.TimeoutError:
+                logger.bind(source="bot").warning(f"Не дождались обработки апдейтов Telegram: {self._size}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            try:
+                while pending:
+                    update, enqueued_at = pending[0]
+                    await self._handle(update, enqueued_at)
+                    pending.popleft()
+                    await self._release()
+            finally:
+                if pending:
+                    # Воркер остановлен посреди чата: оставшиеся апдейты вернутся другому воркеру
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+    async def _handle(self, update: Update, enqueued_at: float) -> None:
+        started = time.perf_counter()
+        error = False
+        try:
+            await self._dispatcher.feed_update(bot=self._bot, update=update)
+        except Exception as e:
+            error = True
+            logger.bind(source="bot").error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            update_queue_metrics.done(
+                waited=started - enqueued_at,
+                duration=time.perf_counter() - started,
+                error=error
+            )
+
+    async def _release(self) -> None:
+        self._size -= 1
+        async with self._space:
+            self._space.notify_all()
+
+
+# --- Единственный экземпляр очереди ---
+update_queue = UpdateQueue()
@@ -8,7 +8,8 @@ from app.logger import logger
 
 from database.models import User
 from database.session import get_session
-from app.bot.middlewares.i18n import i18n
+from app.bot.middlewares.i18n import i18n, locale_cache
+from app.bot.middlewares.user_context import UserContext
 
 
 def _generate_referral_code(length: int = 8) -> str:
@@ -25,7 +26,8 @@ class UserService:
     async def register_or_update_user(
             self,
             message: Message,
-            referral_code: Optional[str] = None
+            referral_code: Optional[str] = None,
+            user_ctx: Optional[UserContext] = None
     ) -> User:
         """
         Регистрирует нового пользователя или обновляет данные существующего.
@@ -33,13 +35,17 @@ class UserService:
 
         :param message: Объект сообщения от пользователя.
         :param referral_code: Опциональный реферальный код из команды /start.
+        :param user_ctx: Контекст пользователя текущего апдейта, чтобы не загружать его из БД повторно.
         :return: Объект User из БД (созданный или обновленный).
         """
         async with get_session() as session:
             user_from_tg = message.from_user
 
-            # 1. Пытаемся найти пользователя в нашей БД
-            user = await User.get_by_telegram_id(session, user_from_tg.id)
+            # 1. Пытаемся найти пользователя в нашей БД (или берем уже загруженного в middleware)
+            if user_ctx is not None:
+                user = await user_ctx.get()
+            else:
+                user = await User.get_profile(session, user_from_tg.id)
 
             if user:
                 # 2. Если пользователь найден - обновляем его данные, если они изменились
@@ -48,9 +54,12 @@ class UserService:
                     update_data['username'] = user_from_tg.first_name
                 if user.link != user_from_tg.username:
                     update_data['link'] = user_from_tg.username
-                update_data["is_active"] = True
+                if not user.is_active:
+                    update_data["is_active"] = True
                 if update_data:
                     logger.info(f"Обновление данных для пользователя {user.telegram_id}: {update_data}")
+                    # Объект мог быть загружен в другой сессии (UserContext), привязываем его к текущей
+                    session.add(user)
                     await user.update(session, **update_data)
 
                 return user
@@ -85,8 +94,26 @@ class UserService:
                 is_admin=(user_from_tg.id in settings.ADMIN_IDS),  # Сразу назначаем админа
                 has_trial=(settings.TRIAL_DAYS > 0)  # Устанавливаем флаг триала на основе настроек
             )
+            locale_cache.set(new_user.telegram_id, new_user.language_code)
+            if user_ctx is not None:
+                user_ctx.set(new_user)
             return new_user
 
+    async def is_admin(self, telegram_id: int) -> bool:
+        """Проверяет, является ли пользователь администратором (один легкий SELECT)."""
+        async with get_session() as session:
+            return await User.get_is_admin(session, telegram_id)
+
+    async def count_invited_users(self, telegram_id: int) -> int:
+        """Возвращает количество приглашенных пользователем рефералов."""
+        async with get_session() as session:
+            return await User.count_invited_users(session, telegram_id)
+
+    async def count_active_subscriptions(self, telegram_id: int) -> int:
+        """Возвращает количество активных подписок пользователя."""
+        async with get_session() as session:
+            return await User.count_active_subscriptions(session, telegram_id)
+
 
 
 user_service = UserService()
\ No newline at end of file
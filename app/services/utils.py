@@ -1,9 +1,20 @@
+from datetime import datetime, timezone
 from typing import Optional
 from app.logger import logger
 from database.models import Subscription, SubscriptionStatus
 from remnawave.models.users import UserResponseDto
 
 
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Приводит дату к naive UTC, чтобы сравнивать даты из Remnawave (с таймзоной)
+    с датами из БД (без таймзоны).
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 def map_user_dto_to_subscription(dto: UserResponseDto, sub: Subscription) -> Optional[Subscription]:
     """
     Безопасно обновляет Subscription по данным из Remnawave UserResponseDto,
@@ -32,8 +43,8 @@ def map_user_dto_to_subscription(dto: UserResponseDto, sub: Subscription) -> Opt
         if getattr(dto, "description", None) is not None:
             sub.description = dto.description
 
-        if getattr(dto, "hwidDeviceLimit", None) is not None:
-            sub.hwidDeviceLimit = dto.hwidDeviceLimit
+        if getattr(dto, "hwid_device_limit", None) is not None:
+            sub.hwidDeviceLimit = dto.hwid_device_limit
 
         if getattr(dto, "first_connected", None) is not None:
             sub.first_connected = dto.first_connected
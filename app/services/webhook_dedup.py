@@ -0,0 +1,43 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+class WebhookDeduplicator:
+    """
+    Отсеивает повторные вебхуки Remnawave.
+    Ключ — (событие, uuid, updatedAt, хэш тела): панель при ретраях и пачечных правках
+    присылает побайтно одинаковые события, обрабатывать их повторно незачем.
+    """
+
+    def __init__(self):
+        self._seen: TTLCache[bool] = TTLCache(
+            maxsize=settings.REMNA_WEBHOOK_DEDUP_SIZE,
+            ttl=settings.REMNA_WEBHOOK_DEDUP_TTL
+        )
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any], body: Optional[bytes] = None) -> tuple:
+        if body is None:
+            body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        data = payload.get("data") if isinstance(payload.get("data"), dict) else {}
+        return (
+            payload.get("event"),
+            data.get("uuid"),
+            data.get("updatedAt"),
+            hashlib.sha256(body).hexdigest(),
+        )
+
+    def is_duplicate(self, payload: Dict[str, Any], body: Optional[bytes] = None) -> bool:
+        """Возвращает True, если такой вебхук уже принимался, иначе запоминает его."""
+        key = self.make_key(payload, body)
+        if key in self._seen:
+            return True
+        self._seen.set(key, True)
+        return False
+
+
+webhook_deduplicator = WebhookDeduplicator()
@@ -0,0 +1,262 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.logger import logger
+from app.services.webhook_dedup import webhook_deduplicator
+from app.services.webhook_remna_service import webhook_service
+from database.enums import WebhookJobStatus
+from database.models import WebhookJob
+from database.session import get_session
+
+
+@dataclass
+class QueuedWebhook:
+    """Задача в памяти процесса. job_id=None означает, что вебхук не удалось сохранить в БД."""
+    payload: Dict[str, Any]
+    remna_uuid: Optional[str]
+    job_id: Optional[int] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+
+
+def _extract_uuid(payload: Dict[str, Any]) -> Optional[str]:
+    data = payload.get("data")
+    if isinstance(data, dict):
+        return data.get("uuid")
+    return None
+
+
+class WebhookQueue:
+    """
+    Очередь вебхуков Remnawave.
+
+    Эндпоинт только валидирует подпись и кладет вебхук в таблицу webhook_jobs
+    (или в локальную очередь процесса, если БД недоступна) и сразу отвечает 200.
+    Диспетчер забирает задачи из БД и раздает их ограниченному пулу воркеров.
+    Задача UUID забирается только после того, как все его более ранние задачи завершены
+    (условие в WebhookJob.claim), поэтому события одного пользователя применяются строго
+    по порядку, даже если очередь разбирают несколько процессов. Ошибки обработки
+    повторяются с экспоненциальной задержкой. Обработанные задачи старше
+    REMNA_WEBHOOK_RETENTION_DAYS раз в час удаляются.
+
+    При остановке процесс возвращает в очередь забранные, но не обработанные задачи,
+    а задачи упавшего процесса диспетчеры возвращают через REMNA_WEBHOOK_LOCK_TIMEOUT.
+
+    Перед постановкой в очередь повторные вебхуки отсеиваются (webhook_deduplicator),
+    а события из REMNA_WEBHOOK_COALESCE_EVENTS ждут REMNA_WEBHOOK_DEBOUNCE секунд:
+    если за это время по тому же UUID пришло такое же событие, оно заменяет payload
+    ожидающей задачи, и применяется только последнее состояние.
+    """
+    CLEANUP_INTERVAL = 3600  # Как часто удалять старые обработанные задачи (сек)
+    RELEASE_STALE_INTERVAL = 60  # Как часто возвращать в очередь задачи, брошенные упавшими процессами (сек)
+
+    def __init__(self):
+        self._queue: asyncio.Queue[QueuedWebhook] = asyncio.Queue(maxsize=settings.REMNA_WEBHOOK_WORKERS * 2)
+        self._local: Deque[QueuedWebhook] = deque()
+        self._inflight_uuids: Set[str] = set()
+        self._held_job_ids: Set[int] = set()  # Задачи из БД, забранные этим процессом и еще не обработанные
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._last_cleanup_at = 0.0
+        self._last_release_at = 0.0
+
+    async def enqueue(self, payload: Dict[str, Any], body: Optional[bytes] = None) -> None:
+        """
+        Сохраняет вебхук для фоновой обработки.
+
+        :param payload: Разобранное тело вебхука.
+        :param body: Исходное тело запроса, используется для дедупликации.
+        """
+        if webhook_deduplicator.is_duplicate(payload, body):
+            logger.debug(f"Повторный вебхук {payload.get('event')} отброшен")
+            return
+
+        event = payload.get("event") or ""
+        remna_uuid = _extract_uuid(payload)
+        next_attempt_at = datetime.now()
+        coalescable = bool(remna_uuid) and event in settings.REMNA_WEBHOOK_COALESCE_EVENTS
+        if coalescable:
+            next_attempt_at += timedelta(seconds=settings.REMNA_WEBHOOK_DEBOUNCE)
+        try:
+            async with get_session() as session:
+                if coalescable and await WebhookJob.coalesce_pending(
+                        session, event, remna_uuid, payload, next_attempt_at):
+                    logger.debug(f"Вебхук {event} для {remna_uuid} склеен с ожидающим")
+                    return
+                await WebhookJob.create(
+                    session=session,
+                    event=event,
+                    remna_uuid=remna_uuid,
+                    payload=payload,
+                    next_attempt_at=next_attempt_at
+                )
+        except Exception as e:
+            logger.error(f"Не удалось сохранить вебхук в БД, обрабатываем из памяти процесса: {e}")
+            self._local.append(QueuedWebhook(payload=payload, remna_uuid=remna_uuid))
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        """Запускает диспетчер и воркеры. Вызывается в lifespan."""
+        self._tasks.append(asyncio.create_task(self._dispatcher()))
+        for _ in range(settings.REMNA_WEBHOOK_WORKERS):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """
+        Останавливает обработку. Забранные, но не обработанные задачи возвращаются в очередь,
+        и их сразу подхватит другой процесс или следующий запуск.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        if self._held_job_ids:
+            try:
+                async with get_session() as session:
+                    released = await WebhookJob.release(session, self._held_job_ids)
+                logger.info(f"Возвращено в очередь необработанных вебхуков: {released}")
+            except Exception as e:
+                logger.error(f"Не удалось вернуть в очередь необработанные вебхуки: {e}")
+            self._held_job_ids.clear()
+
+    async def _dispatcher(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._last_release_at >= self.RELEASE_STALE_INTERVAL:
+                    await self._release_stale()
+                    self._last_release_at = time.monotonic()
+                await self._dispatch_local()
+                await self._dispatch_db()
+                if time.monotonic() - self._last_cleanup_at >= self.CLEANUP_INTERVAL:
+                    await self._cleanup()
+                    self._last_cleanup_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка диспетчера очереди вебхуков: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.REMNA_WEBHOOK_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _dispatch_db(self) -> None:
+        async with get_session() as session:
+            jobs = await WebhookJob.get_pending(session, limit=100)
+            now = datetime.now()
+            # UUID, чьи более ранние события еще не обработаны: более поздние события ждут
+            blocked_uuids: Set[str] = set()
+            for job in jobs:
+                if job.remna_uuid and (job.remna_uuid in self._inflight_uuids or job.remna_uuid in blocked_uuids):
+                    continue
+                if job.next_attempt_at > now:
+                    if job.remna_uuid:
+                        blocked_uuids.add(job.remna_uuid)
+                    continue
+                if not await WebhookJob.claim(session, job.id):
+                    # Задачу забрали или раньше нее в очереди есть событие того же UUID
+                    if job.remna_uuid:
+                        blocked_uuids.add(job.remna_uuid)
+                    continue
+                self._held_job_ids.add(job.id)
+                await self._put(QueuedWebhook(
+                    payload=job.payload,
+                    remna_uuid=job.remna_uuid,
+                    job_id=job.id,
+                    attempts=job.attempts
+                ))
+
+    @staticmethod
+    async def _release_stale() -> None:
+        """Возвращает в очередь задачи, зависшие в обработке (например, у упавшего процесса)."""
+        locked_before = datetime.now() - timedelta(seconds=settings.REMNA_WEBHOOK_LOCK_TIMEOUT)
+        async with get_session() as session:
+            released = await WebhookJob.release_stale(session, locked_before)
+        if released:
+            logger.warning(f"Возвращено в очередь зависших вебхуков: {released}")
+
+    @staticmethod
+    async def _cleanup() -> None:
+        created_before = datetime.now() - timedelta(days=settings.REMNA_WEBHOOK_RETENTION_DAYS)
+        async with get_session() as session:
+            deleted = await WebhookJob.delete_done(session, created_before)
+        if deleted:
+            logger.info(f"Удалено обработанных вебхуков: {deleted}")
+
+    async def _dispatch_local(self) -> None:
+        now = datetime.now()
+        for _ in range(len(self._local)):
+            item = self._local.popleft()
+            if (item.remna_uuid and item.remna_uuid in self._inflight_uuids) or (
+                    item.next_attempt_at and item.next_attempt_at > now):
+                self._local.append(item)
+                continue
+            await self._put(item)
+
+    async def _put(self, item: QueuedWebhook) -> None:
+        if item.remna_uuid:
+            self._inflight_uuids.add(item.remna_uuid)
+        await self._queue.put(item)
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._handle(item)
+                # При отмене задача остается в _held_job_ids, и stop() вернет ее в очередь
+                self._held_job_ids.discard(item.job_id)
+            finally:
+                if item.remna_uuid:
+                    self._inflight_uuids.discard(item.remna_uuid)
+                self._queue.task_done()
+                self._wakeup.set()
+
+    async def _handle(self, item: QueuedWebhook) -> None:
+        try:
+            await webhook_service.process_webhook(item.payload)
+        except Exception as e:
+            await self._on_failure(item, e)
+            return
+        if item.job_id is not None:
+            await self._save_result(item.job_id, status=WebhookJobStatus.DONE, locked_at=None)
+
+    async def _on_failure(self, item: QueuedWebhook, error: Exception) -> None:
+        item.attempts += 1
+        event = item.payload.get("event")
+        if item.attempts >= settings.REMNA_WEBHOOK_MAX_ATTEMPTS:
+            logger.error(f"Вебхук {event} ({item.remna_uuid}) не обработан за {item.attempts} попыток: {error}")
+            if item.job_id is not None:
+                await self._save_result(
+                    item.job_id, status=WebhookJobStatus.FAILED, attempts=item.attempts,
+                    locked_at=None, last_error=str(error)
+                )
+            return
+
+        delay = settings.REMNA_WEBHOOK_RETRY_DELAY * 2 ** (item.attempts - 1)
+        item.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+        logger.warning(f"Ошибка обработки вебхука {event} ({item.remna_uuid}), повтор через {delay} сек.: {error}")
+        if item.job_id is None:
+            self._local.append(item)
+            return
+        await self._save_result(
+            item.job_id, status=WebhookJobStatus.PENDING, attempts=item.attempts,
+            next_attempt_at=item.next_attempt_at, locked_at=None, last_error=str(error)
+        )
+
+    async def _save_result(self, job_id: int, **values) -> None:
+        try:
+            async with get_session() as session:
+                await WebhookJob.set_result(session, job_id, **values)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить результат обработки вебхука ID:{job_id}: {e}")
+
+
+# --- Единственный экземпляр очереди ---
+webhook_queue = WebhookQueue()
@@ -1,13 +1,16 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from pydantic import ValidationError
+from remnawave.models import UserResponseDto
+
 from app.logger import logger
 from database.session import get_session
 from app.core.config import settings
-from app.services.subscription_service import subscription_service
-from database.models import User, Subscription
+from app.services.remnawave_service import remna_service
+from app.services.notification_service import notification_service
+from database.models import User, Subscription, Notification
 from app.services.user_service import _generate_referral_code
-from app.bot.keyboards.inlines import get_config_webapp_button
-from app.bot.middlewares.i18n import i18n
-from aiogram.utils.i18n import gettext as _
+from app.services.utils import map_user_dto_to_subscription, to_naive_utc
 
 
 class UserEventsHandler:
@@ -15,6 +18,29 @@ class UserEventsHandler:
     Класс для обработки всех событий, связанных с пользователями (user.*).
     """
 
+    async def _resolve_remna_user(
+            self,
+            user_data: Dict[str, Any],
+            subscription: Optional[Subscription] = None
+    ) -> UserResponseDto:
+        """
+        Возвращает состояние пользователя Remnawave из поля data вебхука.
+        В панель идем, только если в payload не хватает полей или его updatedAt
+        старше того, что уже сохранено в нашей БД.
+        """
+        remna_uuid = user_data.get("uuid")
+        try:
+            dto = UserResponseDto.model_validate(user_data)
+        except ValidationError as e:
+            logger.debug(f"Неполные данные пользователя {remna_uuid} в вебхуке, запрашиваем панель: {e.error_count()} ошибок")
+            return await settings.REMNA_SDK.users.get_user_by_uuid(remna_uuid)
+
+        if subscription and subscription.updated_at and \
+                to_naive_utc(dto.updated_at) < to_naive_utc(subscription.updated_at):
+            logger.debug(f"Устаревшие данные пользователя {remna_uuid} в вебхуке, запрашиваем панель")
+            return await settings.REMNA_SDK.users.get_user_by_uuid(remna_uuid)
+        return dto
+
     async def created(self, payload: Dict[str, Any]):
         user_data = payload.get("data", {})
         remna_uuid = user_data.get("uuid")
@@ -28,7 +54,7 @@ class UserEventsHandler:
             if existing_sub:
                 logger.info(f"Подписка с remna_uuid={remna_uuid} уже существует. Синхронизация не требуется.")
                 return
-            subscription_from_remna = await settings.REMNA_SDK.users.get_user_by_uuid(remna_uuid)
+            subscription_from_remna = await self._resolve_remna_user(user_data)
             logger.info(f"WEBHOOK: 'user.created' для {subscription_from_remna.username}")
             if not subscription_from_remna.telegram_id:
                 logger.info(f"Подписка с remna_uuid={remna_uuid} без телеграмма")
@@ -45,6 +71,15 @@ class UserEventsHandler:
                     username=subscription_from_remna.username, referral_code=new_ref_code,
                     is_admin=(subscription_from_remna.telegram_id in settings.ADMIN_IDS)
                 )
+            # Приветствие сохраняется вместе с подпиской и отправляется в фоне
+            Notification.add(
+                session,
+                chat_id=subscription_from_remna.telegram_id,
+                text_key="welcome_message_universal",
+                params={"logo_name": settings.LOGO_NAME},
+                locale=user_db.language_code,
+                button_url=subscription_from_remna.subscription_url
+            )
             new_subscription = await Subscription.create(
                 session=session,
                 telegram_id=subscription_from_remna.telegram_id,
@@ -61,49 +96,24 @@ class UserEventsHandler:
                 updated_at=subscription_from_remna.updated_at
             )
             logger.info(f"Создана локальная подписка ID:{new_subscription.id} для синхронизации с Remnawave.")
-
-            try:
-                i18n.current_locale = user_db.language_code
-                with i18n.context():
-                    await settings.BOT.send_message(
-                        chat_id=subscription_from_remna.telegram_id,
-                        text=_("welcome_message_universal").format(
-                            logo_name=settings.LOGO_NAME
-                        ),
-                        reply_markup=get_config_webapp_button(subscription_from_remna.subscription_url)
-                    )
-                    logger.info(f"Отправлено приветственное сообщение пользователю {subscription_from_remna.telegram_id}.")
-            except Exception as e:
-                logger.error(f"Не удалось отправить сообщение пользователю {subscription_from_remna.telegram_id}: {e}")
+        notification_service.wakeup()
 
 
     async def modified(self, payload: Dict[str, Any]):
         user_data = payload.get("data", {})
         remna_uuid = user_data.get("uuid")
-        subscription_from_remna = await settings.REMNA_SDK.users.get_user_by_uuid(remna_uuid)
-        logger.info(f"WEBHOOK: Получено событие 'user.modified' для подписки {subscription_from_remna.username} ({subscription_from_remna.telegram_id})")
+        logger.info(f"WEBHOOK: Получено событие 'user.modified' для подписки {user_data.get('username')} ({user_data.get('telegramId')})")
         async with get_session() as session:
             subscription_from_db = await Subscription.get_by_remna_uuid(session, remna_uuid)
-            if subscription_from_db:
-                if subscription_from_remna.updated_at == subscription_from_db.updated_at:
-                    logger.debug("Экранирование хука модифи ремна")
-                    return
-                await subscription_from_db.update(
-                    session=session,
-                    telegram_id=subscription_from_remna.telegram_id,
-                    start_date=subscription_from_remna.created_at,
-                    end_date=subscription_from_remna.expire_at,
-                    subscription_name=subscription_from_remna.username,
-                    remnawave_uuid=str(subscription_from_remna.uuid),
-                    remnawave_short_uuid=subscription_from_remna.short_uuid,
-                    subscription_url=subscription_from_remna.subscription_url,
-                    status=subscription_from_remna.status,
-                    description=subscription_from_remna.description,
-                    hwidDeviceLimit=subscription_from_remna.hwid_device_limit,
-                    first_connected=subscription_from_remna.first_connected,
-                    updated_at=subscription_from_remna.updated_at
-                )
-                logger.info(f"Данные обновлены {subscription_from_remna.username} {subscription_from_remna.expire_at}")
+            if not subscription_from_db:
+                return
+            subscription_from_remna = await self._resolve_remna_user(user_data, subscription_from_db)
+            if to_naive_utc(subscription_from_remna.updated_at) == to_naive_utc(subscription_from_db.updated_at):
+                logger.debug("Экранирование хука модифи ремна")
+                return
+            map_user_dto_to_subscription(subscription_from_remna, subscription_from_db)
+            await session.commit()
+            logger.info(f"Данные обновлены {subscription_from_remna.username} {subscription_from_remna.expire_at}")
 
 
     async def expired(self, payload: Dict[str, Any]):
@@ -116,35 +126,20 @@ class UserEventsHandler:
         # Логика: деактивируем подписку в нашей БД и отправляем уведомление
         async with get_session() as session:  # <-- Открываем сессию ОДИН РАЗ
             subscription = await Subscription.get_by_remna_uuid(session, remna_uuid)
-            subscription_from_remna = await settings.REMNA_SDK.users.get_user_by_uuid(remna_uuid)
             if not subscription:
                 logger.warning(f"Получен вебхук 'user.expired', но подписка с remna_uuid={remna_uuid} не найдена.")
                 return
-            await subscription.update(
-                session=session,
-                telegram_id=subscription_from_remna.telegram_id,
-                start_date=subscription_from_remna.created_at,
-                end_date=subscription_from_remna.expire_at,
-                subscription_name=subscription_from_remna.username,
-                remnawave_uuid=str(subscription_from_remna.uuid),
-                remnawave_short_uuid=subscription_from_remna.short_uuid,
-                subscription_url=subscription_from_remna.subscription_url,
-                status=subscription_from_remna.status,
-                description=subscription_from_remna.description,
-                hwidDeviceLimit=subscription_from_remna.hwid_device_limit,
-                first_connected=subscription_from_remna.first_connected,
-                updated_at=subscription_from_remna.updated_at
+            subscription_from_remna = await self._resolve_remna_user(user_data, subscription)
+            map_user_dto_to_subscription(subscription_from_remna, subscription)
+            Notification.add(
+                session,
+                chat_id=subscription.telegram_id,
+                text_key="subscription_deactivated_message",
+                params={"sub_name": subscription.subscription_name},
+                locale=subscription.user.language_code
             )
-            try:
-                i18n.current_locale = subscription.user.language_code
-                with i18n.context():
-                    await settings.BOT.send_message(
-                        chat_id=subscription.telegram_id,
-                        text=_("subscription_deactivated_message").format(
-                            sub_name=subscription.subscription_name)
-                    )
-            except Exception as e:
-                logger.warning(f"Не удалось отправить уведомление о 'user.expired' пользователю {telegram_id}: {e}")
+            await session.commit()
+        notification_service.wakeup()
 
     async def expires_in_24_hours(self, payload: Dict[str, Any]):
         user_data = payload.get("data", {})
@@ -153,21 +148,21 @@ class UserEventsHandler:
         subscription_name = user_data.get("username")
         logger.info(f"WEBHOOK: Получено событие 'user.expires_in_24_hours' для {subscription_name} ({telegram_id})")
 
-        # Логика: отправляем уведомление о скором окончании
-        subscription = await subscription_service.get_by_remna_uuid(remna_uuid)
-        if not subscription:
-            logger.warning(f"Получен вебхук 'user.expires_in_24_hours', но подписка с remna_uuid={remna_uuid} не найдена в локальной БД.")
-            return
-        try:
-            i18n.current_locale = subscription.user.language_code
-            with i18n.context():
-                await settings.BOT.send_message(
-                    chat_id=subscription.telegram_id,
-                    text=_("subscription_expiration_warning_message").format(sub_name=subscription.subscription_name)
-                )
-        except Exception as e:
-            logger.warning(
-                f"Не удалось отправить уведомление о 'user.expires_in_24_hours' пользователю {subscription.telegram_id}: {e}")
+        # Логика: ставим в очередь уведомление о скором окончании
+        async with get_session() as session:
+            subscription = await Subscription.get_by_remna_uuid(session, remna_uuid)
+            if not subscription:
+                logger.warning(f"Получен вебхук 'user.expires_in_24_hours', но подписка с remna_uuid={remna_uuid} не найдена в локальной БД.")
+                return
+            Notification.add(
+                session,
+                chat_id=subscription.telegram_id,
+                text_key="subscription_expiration_warning_message",
+                params={"sub_name": subscription.subscription_name},
+                locale=subscription.user.language_code
+            )
+            await session.commit()
+        notification_service.wakeup()
 
     async def _unhandled_event(self, event_name: str, payload: Dict[str, Any]):
         """Обрабатывает любое другое событие пользователя, для которого нет метода."""
@@ -192,6 +187,10 @@ class WebhookService:
             logger.warning("Получен вебхук без поля 'event'.")
             return
 
+        if event_name in settings.REMNA_SQUADS_INVALIDATE_EVENTS:
+            logger.info(f"Событие {event_name}: сбрасываем кэш отрядов Remnawave")
+            remna_service.invalidate_squads()
+
         try:
             event_category, event_action = event_name.split('.', 1)
         except ValueError:
@@ -10,3 +10,28 @@ class SubscriptionStatus(str, enum.Enum):
     DISABLED = "DISABLED"
     LIMITED = "LIMITED"
     EXPIRED = "EXPIRED"
+
+class BroadcastStatus(str, enum.Enum):
+    RUNNING = "RUNNING"
+    FINISHED = "FINISHED"
+
+class BroadcastSegment(str, enum.Enum):
+    ALL = "ALL"                                    # Все активные пользователи
+    LOCALE = "LOCALE"                              # Пользователи с выбранным языком
+    ACTIVE_SUBSCRIPTION = "ACTIVE_SUBSCRIPTION"    # Есть активная подписка
+    EXPIRED_SUBSCRIPTION = "EXPIRED_SUBSCRIPTION"  # Подписки были, активных нет
+    TRIAL_ONLY = "TRIAL_ONLY"                      # Взяли триал, но не платили
+    NEVER_PAID = "NEVER_PAID"                      # Ни разу не платили
+    EXPIRING_SOON = "EXPIRING_SOON"                # Подписка истекает в ближайшие N дней
+
+class WebhookJobStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+class NotificationStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    SENT = "SENT"
+    FAILED = "FAILED"
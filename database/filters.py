@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+
+@dataclass
+class UserFilter:
+    """
+    Условия выборки пользователей для массовых операций (рассылки, выгрузки и т.п.).
+    Значение None означает, что условие не применяется.
+    """
+    language_code: Optional[str] = None
+    is_active: Optional[bool] = True
+    has_active_subscription: Optional[bool] = None
+    has_any_subscription: Optional[bool] = None
+    has_trial: Optional[bool] = None
+    # Есть подписка без тарифа: ее выдает только триал (или ее завели в панели вручную).
+    # has_trial=False этого не означает: при TRIAL_DAYS=0 флаг снят у всех новых пользователей
+    took_trial: Optional[bool] = None
+    had_first_purchase: Optional[bool] = None
+    # Активная подписка заканчивается в промежутке [сейчас, active_subscription_expires_before]
+    active_subscription_expires_before: Optional[datetime] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
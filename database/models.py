@@ -1,14 +1,20 @@
 from __future__ import annotations
-from datetime import datetime
-from typing import List, Optional, Self
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Self
 
 from sqlalchemy import (
-    String, ForeignKey, func, MetaData, select, or_, Enum
+    String, ForeignKey, func, MetaData, select, or_, Enum, update, insert, delete, exists, Index, JSON
 )
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship, selectinload
+from sqlalchemy.orm import (
+    declarative_base, Mapped, mapped_column, relationship, selectinload, joinedload, load_only, aliased
+)
 
-from .enums import PaymentMethod, SubscriptionStatus
+from .enums import (
+    PaymentMethod, SubscriptionStatus, BroadcastStatus, BroadcastSegment, WebhookJobStatus, NotificationStatus
+)
+from .filters import UserFilter
 
 naming_convention = {
     "ix": "ix_%(column_0_label)s",
@@ -22,6 +28,11 @@ Base = declarative_base(metadata=MetaData(naming_convention=naming_convention))
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Индексы под сегменты рассылок
+        Index("ix_users_is_active_language_code", "is_active", "language_code"),
+        Index("ix_users_had_first_purchase_has_trial", "had_first_purchase", "has_trial"),
+    )
 
     # --- Колонки с типами ---
     telegram_id: Mapped[int] = mapped_column(primary_key=True, index=True)
@@ -99,11 +110,78 @@ class User(Base):
 
     # --- CRUD МЕТОДЫ ДЛЯ МОДЕЛИ USER ---
     @classmethod
-    async def get_all_telegram_ids(cls, session: AsyncSession) -> List[int]:
-        """Возвращает список всех telegram_id пользователей."""
-        stmt = select(cls.telegram_id)
+    def filter_conditions(cls, user_filter: UserFilter) -> list:
+        """Преобразует UserFilter в список SQL-условий для WHERE."""
+        conditions = []
+        if user_filter.language_code is not None:
+            conditions.append(cls.language_code == user_filter.language_code)
+        if user_filter.is_active is not None:
+            conditions.append(cls.is_active == user_filter.is_active)
+        if user_filter.has_active_subscription is not None:
+            has_active = exists().where(
+                Subscription.telegram_id == cls.telegram_id,
+                Subscription.status == SubscriptionStatus.ACTIVE
+            )
+            conditions.append(has_active if user_filter.has_active_subscription else ~has_active)
+        if user_filter.has_any_subscription is not None:
+            has_any = exists().where(Subscription.telegram_id == cls.telegram_id)
+            conditions.append(has_any if user_filter.has_any_subscription else ~has_any)
+        if user_filter.has_trial is not None:
+            conditions.append(cls.has_trial == user_filter.has_trial)
+        if user_filter.took_trial is not None:
+            took_trial = exists().where(
+                Subscription.telegram_id == cls.telegram_id,
+                Subscription.tariff_id.is_(None)
+            )
+            conditions.append(took_trial if user_filter.took_trial else ~took_trial)
+        if user_filter.had_first_purchase is not None:
+            conditions.append(cls.had_first_purchase == user_filter.had_first_purchase)
+        if user_filter.active_subscription_expires_before is not None:
+            conditions.append(
+                exists().where(
+                    Subscription.telegram_id == cls.telegram_id,
+                    Subscription.status == SubscriptionStatus.ACTIVE,
+                    Subscription.end_date >= datetime.now(),
+                    Subscription.end_date <= user_filter.active_subscription_expires_before
+                )
+            )
+        if user_filter.created_from is not None:
+            conditions.append(cls.created_at >= user_filter.created_from)
+        if user_filter.created_to is not None:
+            conditions.append(cls.created_at < user_filter.created_to)
+        return conditions
+
+    @classmethod
+    async def count_by_filter(cls, session: AsyncSession, user_filter: UserFilter) -> int:
+        """Считает пользователей, подходящих под фильтр, через SQL COUNT."""
+        stmt = select(func.count(cls.telegram_id)).where(*cls.filter_conditions(user_filter))
         result = await session.execute(stmt)
-        return result.scalars().all()
+        return result.scalar_one()
+
+    @classmethod
+    async def get_telegram_id_page(
+            cls,
+            session: AsyncSession,
+            user_filter: Optional[UserFilter] = None,
+            after_id: int = 0,
+            limit: int = 1000
+    ) -> List[int]:
+        """
+        Одна страница telegram_id по возрастанию (keyset-пагинация по telegram_id).
+        Каждую страницу можно читать в своей короткой сессии, передавая последний ID предыдущей.
+
+        :param user_filter: Условия выборки, по умолчанию только активные пользователи.
+        :param after_id: Продолжить строго после этого telegram_id (курсор возобновления).
+        :param limit: Размер страницы.
+        """
+        stmt = (
+            select(cls.telegram_id)
+            .where(cls.telegram_id > after_id, *cls.filter_conditions(user_filter or UserFilter()))
+            .order_by(cls.telegram_id)
+            .limit(limit)
+        )
+        result = await session.scalars(stmt)
+        return result.all()
 
     @classmethod
     async def get_by_telegram_id(cls, session: AsyncSession, telegram_id: int) -> Optional[Self]:
@@ -120,6 +198,120 @@ class User(Base):
         result = await session.execute(stmt)
         return result.scalar_one_or_none()
 
+    @classmethod
+    async def get_profile(cls, session: AsyncSession, telegram_id: int) -> Optional[Self]:
+        """
+        Загружает только колонки профиля пользователя, без связанных подписок и рефералов.
+        Связи у такого объекта не загружены, для счетчиков используйте count_* методы.
+        """
+        stmt = (
+            select(cls)
+            .options(
+                load_only(
+                    cls.telegram_id, cls.username, cls.link, cls.balance, cls.inviter_id,
+                    cls.referral_code, cls.is_admin, cls.is_active, cls.has_trial,
+                    cls.had_first_purchase, cls.language_code,
+                )
+            )
+            .where(cls.telegram_id == telegram_id)
+        )
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_language_code(cls, session: AsyncSession, telegram_id: int) -> Optional[str]:
+        """Возвращает язык пользователя или None, если пользователя нет."""
+        stmt = select(cls.language_code).where(cls.telegram_id == telegram_id)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_is_admin(cls, session: AsyncSession, telegram_id: int) -> bool:
+        """Проверяет флаг администратора без загрузки всего пользователя."""
+        stmt = select(cls.is_admin).where(cls.telegram_id == telegram_id)
+        result = await session.execute(stmt)
+        return bool(result.scalar_one_or_none())
+
+    @classmethod
+    async def count_invited_users(cls, session: AsyncSession, telegram_id: int) -> int:
+        """Считает приглашенных пользователей через SQL COUNT."""
+        stmt = select(func.count(cls.telegram_id)).where(cls.inviter_id == telegram_id)
+        result = await session.execute(stmt)
+        return result.scalar_one()
+
+    @classmethod
+    async def count_active_subscriptions(cls, session: AsyncSession, telegram_id: int) -> int:
+        """Считает активные подписки пользователя через SQL COUNT."""
+        stmt = select(func.count(Subscription.id)).where(
+            Subscription.telegram_id == telegram_id,
+            Subscription.status == SubscriptionStatus.ACTIVE
+        )
+        result = await session.execute(stmt)
+        return result.scalar_one()
+
+    @classmethod
+    async def deactivate_many(cls, session: AsyncSession, telegram_ids: Iterable[int], chunk_size: int = 500) -> int:
+        """
+        Помечает пользователей неактивными пачками: один UPDATE ... WHERE telegram_id IN (...) на чанк.
+
+        :return: Количество обновленных строк.
+        """
+        telegram_ids = list(telegram_ids)
+        updated = 0
+        for i in range(0, len(telegram_ids), chunk_size):
+            chunk = telegram_ids[i:i + chunk_size]
+            stmt = (
+                update(cls)
+                .where(cls.telegram_id.in_(chunk), cls.is_active == True)
+                .values(is_active=False)
+            )
+            result = await session.execute(stmt)
+            updated += result.rowcount
+        await session.commit()
+        return updated
+
+    @classmethod
+    async def mark_first_purchase(cls, session: AsyncSession, telegram_id: int) -> bool:
+        """
+        Атомарно отмечает первую покупку. Не коммитит.
+
+        :return: True, если покупка действительно первая (флаг переключил этот вызов).
+        """
+        stmt = (
+            update(cls)
+            .where(cls.telegram_id == telegram_id, cls.had_first_purchase == False)
+            .values(had_first_purchase=True)
+        )
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
+    @classmethod
+    async def add_balance(cls, session: AsyncSession, telegram_id: int, amount: int) -> bool:
+        """Атомарно увеличивает баланс (UPDATE ... SET balance = balance + amount). Не коммитит."""
+        stmt = update(cls).where(cls.telegram_id == telegram_id).values(balance=cls.balance + amount)
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
+    @classmethod
+    async def get_existing_ids(cls, session: AsyncSession, telegram_ids: Iterable[int]) -> set[int]:
+        """Возвращает те из переданных telegram_id, которые уже есть в БД."""
+        stmt = select(cls.telegram_id).where(cls.telegram_id.in_(list(telegram_ids)))
+        result = await session.execute(stmt)
+        return set(result.scalars().all())
+
+    @classmethod
+    async def bulk_insert(cls, session: AsyncSession, rows: list[dict]) -> None:
+        """Пакетно вставляет пользователей. Не коммитит: транзакцией управляет вызывающий код."""
+        if rows:
+            await session.execute(insert(cls), rows)
+
+    @classmethod
+    async def get_existing_referral_codes(cls, session: AsyncSession, codes: Iterable[str]) -> set[str]:
+        """Возвращает те из переданных реферальных кодов, которые уже заняты."""
+        stmt = select(cls.referral_code).where(cls.referral_code.in_(list(codes)))
+        result = await session.execute(stmt)
+        return set(result.scalars().all())
+
     @classmethod
     async def get_by_referral_code(cls, session: AsyncSession, referral_code: str) -> Optional[Self]:
         """Находит пользователя по его реферальному коду."""
@@ -147,6 +339,10 @@ class User(Base):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        Index("ix_subscriptions_telegram_id_status", "telegram_id", "status"),
+        Index("ix_subscriptions_status_end_date", "status", "end_date"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     telegram_id: Mapped[int] = mapped_column(ForeignKey("users.telegram_id"))
@@ -186,6 +382,20 @@ class Subscription(Base):
     async def get_by_id(cls, session: AsyncSession, sub_id: int) -> Optional[Self]:
         return await session.get(cls, sub_id)
 
+    @classmethod
+    async def get_for_update(cls, session: AsyncSession, sub_id: int) -> Optional[Self]:
+        """
+        Загружает подписку с блокировкой строки до конца транзакции (поверх уже загруженного объекта),
+        чтобы параллельные продления не перезаписали дату окончания друг друга.
+        """
+        stmt = (
+            select(cls).where(cls.id == sub_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
     @classmethod
     async def get_by_remna_uuid(cls, session: AsyncSession, remna_uuid: str) -> Optional[Self]:
         """
@@ -229,6 +439,72 @@ class Subscription(Base):
         return result.scalars().all()
 
 
+    @classmethod
+    async def get_sync_snapshot(cls, session: AsyncSession) -> list[dict]:
+        """
+        Возвращает все подписки в виде словарей только с полями, которые синхронизируются с Remnawave.
+        Без загрузки связей и ORM-объектов, чтобы сравнение в памяти было дешевым.
+        """
+        columns = (
+            cls.id, cls.telegram_id, cls.start_date, cls.end_date, cls.status,
+            cls.remnawave_uuid, cls.remnawave_short_uuid, cls.subscription_name,
+            cls.subscription_url, cls.description, cls.hwidDeviceLimit,
+            cls.first_connected, cls.updated_at,
+        )
+        result = await session.execute(select(*columns))
+        return [dict(row._mapping) for row in result]
+
+    @classmethod
+    async def bulk_update(cls, session: AsyncSession, rows: list[dict]) -> None:
+        """
+        Пакетно обновляет подписки по первичному ключу (каждый словарь содержит id).
+        Не коммитит: транзакцией управляет вызывающий код.
+        """
+        if rows:
+            await session.execute(update(cls), rows)
+
+    @classmethod
+    async def bulk_insert(cls, session: AsyncSession, rows: list[dict]) -> None:
+        """Пакетно вставляет подписки. Не коммитит: транзакцией управляет вызывающий код."""
+        if rows:
+            await session.execute(insert(cls), rows)
+
+    @classmethod
+    async def get_orphaned_pending(cls, session: AsyncSession, created_before: datetime, limit: int) -> list[Self]:
+        """
+        Возвращает неоплаченные заготовки покупки: DISABLED-подписки с тарифом, созданные до created_before,
+        к которым привязан ожидающий платеж и нет ни одного успешного или оплаченного (в том числе в обработке).
+        Триалы, подписки из панели (без тарифа) и отключенные оплаченные подписки сюда не попадают.
+        """
+        pending = exists().where(Payment.subscription_id == cls.id, Payment.status == "pending")
+        paid = exists().where(
+            Payment.subscription_id == cls.id, Payment.status.in_(("succeeded", "paid", "processing"))
+        )
+        stmt = (
+            select(cls)
+            .where(
+                cls.status == SubscriptionStatus.DISABLED,
+                cls.tariff_id.is_not(None),
+                cls.start_date < created_before,
+                pending,
+                ~paid,
+            )
+            .order_by(cls.id)
+            .limit(limit)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def delete_orphaned(cls, session: AsyncSession, sub_id: int) -> None:
+        """
+        Удаляет неоплаченную заготовку. Ее платежи отвязываются, а не удаляются:
+        если такой платеж все же придет, подписка будет выдана из пула.
+        """
+        await session.execute(update(Payment).where(Payment.subscription_id == sub_id).values(subscription_id=None))
+        await session.execute(delete(cls).where(cls.id == sub_id))
+        await session.commit()
+
     async def update(self, session: AsyncSession, **kwargs) -> Self:
         """Обновляет поля текущей подписки."""
         for key, value in kwargs.items():
@@ -248,12 +524,15 @@ class Payment(Base):
     status: Mapped[str] = mapped_column(default="pending")
     method: Mapped[PaymentMethod]
     external_payment_id: Mapped[Optional[str]] = mapped_column(unique=True)
-    subscription_id: Mapped[int] = mapped_column(ForeignKey("subscriptions.id"))
+    # Пусто у покупки новой подписки до оплаты: подписка создается при подтверждении платежа
+    subscription_id: Mapped[Optional[int]] = mapped_column(ForeignKey("subscriptions.id"))
     tariff_id: Mapped[int] = mapped_column(ForeignKey("tariffs.id"))
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    # Когда платеж взят в обработку (status='processing'), см. claim_for_processing
+    processing_started_at: Mapped[Optional[datetime]]
 
     user: Mapped["User"] = relationship(back_populates="payments")
-    subscription: Mapped["Subscription"] = relationship(back_populates="payments")
+    subscription: Mapped[Optional["Subscription"]] = relationship(back_populates="payments")
     tariff: Mapped["Tariff"] = relationship(back_populates="payments")
 
     @classmethod
@@ -275,6 +554,85 @@ class Payment(Base):
         result = await session.execute(stmt)
         return result.scalar_one_or_none()
 
+    @classmethod
+    async def get_for_update(cls, session: AsyncSession, payment_id: int) -> Optional[Self]:
+        """
+        Загружает платеж с блокировкой строки (SELECT ... FOR UPDATE) до конца транзакции.
+        Параллельное подтверждение того же платежа ждет и затем видит уже новый статус.
+        """
+        return await cls._get_for_update(session, cls.id == payment_id)
+
+    @classmethod
+    async def get_for_update_by_external_id(cls, session: AsyncSession, external_id: str) -> Optional[Self]:
+        """То же, что get_for_update, но по внешнему ID (ID из ЮKassa или payload из Telegram Stars)."""
+        return await cls._get_for_update(session, cls.external_payment_id == external_id)
+
+    @classmethod
+    async def _get_for_update(cls, session: AsyncSession, condition) -> Optional[Self]:
+        # Один запрос: пользователь, тариф и подписка подтягиваются JOIN'ами, блокируется только строка платежа
+        stmt = (
+            select(cls).where(condition).options(
+                joinedload(cls.user, innerjoin=True),
+                joinedload(cls.tariff, innerjoin=True),
+                joinedload(cls.subscription),
+            ).with_for_update(of=cls)
+        )
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def set_status_if_pending(cls, session: AsyncSession, payment_id: int, status: str, **values) -> bool:
+        """
+        Меняет статус (и переданные поля), только если платеж еще в ожидании. Не коммитит.
+        Защищает от двойной обработки и там, где FOR UPDATE не поддерживается (SQLite).
+        """
+        stmt = update(cls).where(cls.id == payment_id, cls.status == "pending").values(status=status, **values)
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
+    @classmethod
+    async def claim_for_processing(cls, session: AsyncSession, payment_id: int, stale_before: datetime) -> bool:
+        """
+        Переводит платеж в 'processing' условным UPDATE: из ожидания, из 'paid' (оплата получена,
+        но подписку выдать не удалось) или из обработки, начатой до stale_before (процесс упал,
+        не завершив ее). Не коммитит.
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id == payment_id, cls._unconfirmed(stale_before) | (cls.status == "pending"))
+            .values(status="processing", processing_started_at=datetime.now())
+        )
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
+    @classmethod
+    async def get_unconfirmed_ids(cls, session: AsyncSession, stale_before: datetime, limit: int) -> List[int]:
+        """
+        ID оплаченных платежей, по которым подписка еще не выдана: в статусе 'paid'
+        или с обработкой, зависшей с stale_before.
+        """
+        stmt = select(cls.id).where(cls._unconfirmed(stale_before)).order_by(cls.id).limit(limit)
+        result = await session.scalars(stmt)
+        return result.all()
+
+    @classmethod
+    def _unconfirmed(cls, stale_before: datetime):
+        return or_(
+            cls.status == "paid",
+            (cls.status == "processing") & (cls.processing_started_at < stale_before),
+        )
+
+    @classmethod
+    async def set_status_if_processing(cls, session: AsyncSession, payment_id: int, status: str, **values) -> bool:
+        """Завершает обработку: меняет статус, только если платеж все еще в 'processing'. Не коммитит."""
+        stmt = (
+            update(cls)
+            .where(cls.id == payment_id, cls.status == "processing")
+            .values(status=status, processing_started_at=None, **values)
+        )
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
     @classmethod
     async def get_by_external_id(cls, session: AsyncSession, external_id: str) -> Optional[Self]:
         stmt = select(cls).where(cls.external_payment_id == external_id).options(
@@ -330,4 +688,613 @@ class Tariff(Base):
 
     @classmethod
     async def get_by_id(cls, session: AsyncSession, tariff_id: int) -> Optional[Self]:
-        return await session.get(cls, tariff_id)
\ No newline at end of file
+        return await session.get(cls, tariff_id)
+
+
+class BroadcastJob(Base):
+    __tablename__ = "broadcast_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    admin_id: Mapped[int]
+    # Сообщение-источник, которое копируется пользователям через copy_message
+    from_chat_id: Mapped[int]
+    message_id: Mapped[int]
+    status: Mapped[BroadcastStatus] = mapped_column(
+        Enum(BroadcastStatus),
+        default=BroadcastStatus.RUNNING,
+        nullable=False
+    )
+    segment: Mapped[BroadcastSegment] = mapped_column(
+        Enum(BroadcastSegment),
+        default=BroadcastSegment.ALL,
+        nullable=False
+    )
+    segment_param: Mapped[Optional[str]]  # Язык для LOCALE, количество дней для EXPIRING_SOON
+    # Последний обработанный telegram_id, с него рассылка продолжится после рестарта
+    cursor: Mapped[int] = mapped_column(default=0)
+    success_count: Mapped[int] = mapped_column(default=0)
+    failed_count: Mapped[int] = mapped_column(default=0)
+    progress_message_id: Mapped[Optional[int]]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    finished_at: Mapped[Optional[datetime]]
+    # Процесс, который сейчас отправляет рассылку, и до какого времени он ее держит (см. claim)
+    owner: Mapped[Optional[str]] = mapped_column(String(128))
+    locked_until: Mapped[Optional[datetime]]
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> Self:
+        job = cls(**kwargs)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+    @classmethod
+    async def get_by_id(cls, session: AsyncSession, job_id: int) -> Optional[Self]:
+        return await session.get(cls, job_id)
+
+    @classmethod
+    async def get_running(cls, session: AsyncSession) -> List[Self]:
+        """Возвращает незавершенные рассылки (например, прерванные рестартом)."""
+        stmt = select(cls).where(cls.status == BroadcastStatus.RUNNING).order_by(cls.id)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, job_id: int, owner: str, ttl: float) -> bool:
+        """
+        Забирает незавершенную рассылку процессу owner на ttl секунд условным UPDATE.
+        Удается, если рассылку никто не держит, аренда истекла или уже принадлежит owner.
+        """
+        now = datetime.now()
+        stmt = (
+            update(cls)
+            .where(
+                cls.id == job_id,
+                cls.status == BroadcastStatus.RUNNING,
+                or_(cls.owner.is_(None), cls.owner == owner, cls.locked_until < now),
+            )
+            .values(owner=owner, locked_until=now + timedelta(seconds=ttl))
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def save_progress(cls, session: AsyncSession, job_id: int, owner: str, ttl: float, **values) -> bool:
+        """
+        Сохраняет прогресс и продлевает аренду, только если рассылку все еще держит owner.
+        Возвращает False, если ее забрал другой процесс.
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id == job_id, cls.owner == owner)
+            .values(locked_until=datetime.now() + timedelta(seconds=ttl), **values)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def finish(cls, session: AsyncSession, job_id: int, owner: str, finished_at: datetime) -> bool:
+        """Отмечает рассылку завершенной, если ее все еще держит owner."""
+        stmt = (
+            update(cls)
+            .where(cls.id == job_id, cls.owner == owner)
+            .values(status=BroadcastStatus.FINISHED, finished_at=finished_at, owner=None, locked_until=None)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def release(cls, session: AsyncSession, job_id: int, owner: str) -> None:
+        """Отпускает рассылку, чтобы ее сразу продолжил другой процесс."""
+        stmt = update(cls).where(cls.id == job_id, cls.owner == owner).values(owner=None, locked_until=None)
+        await session.execute(stmt)
+        await session.commit()
+
+    async def update(self, session: AsyncSession, **kwargs) -> Self:
+        """Обновляет поля рассылки."""
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        await session.commit()
+        await session.refresh(self)
+        return self
+
+
+class WebhookJob(Base):
+    """Входящий вебхук Remnawave, ожидающий обработки воркерами очереди."""
+    __tablename__ = "webhook_jobs"
+    __table_args__ = (
+        Index("ix_webhook_jobs_status_id", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    event: Mapped[str]
+    remna_uuid: Mapped[Optional[str]] = mapped_column(String(36), index=True)
+    payload: Mapped[dict] = mapped_column(JSON)
+    status: Mapped[WebhookJobStatus] = mapped_column(
+        Enum(WebhookJobStatus),
+        default=WebhookJobStatus.PENDING,
+        nullable=False
+    )
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    locked_at: Mapped[Optional[datetime]]
+    last_error: Mapped[Optional[str]]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> Self:
+        job = cls(**kwargs)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+    @classmethod
+    async def get_pending(cls, session: AsyncSession, limit: int) -> List[Self]:
+        """
+        Возвращает ожидающие задачи в порядке поступления (включая отложенные ретраи).
+        Задачи UUID, событие которого уже обрабатывает какой-либо процесс, пропускаются.
+        """
+        processing = aliased(cls)
+        stmt = (
+            select(cls)
+            .where(
+                cls.status == WebhookJobStatus.PENDING,
+                ~exists().where(
+                    processing.remna_uuid == cls.remna_uuid,
+                    processing.status == WebhookJobStatus.PROCESSING
+                )
+            )
+            .order_by(cls.id)
+            .limit(limit)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, job_id: int) -> bool:
+        """
+        Атомарно забирает задачу в работу. Возвращает False, если ее уже забрал другой процесс
+        или у этого UUID есть более ранняя незавершенная задача: так события одного пользователя
+        применяются по порядку, даже когда очередь разбирают несколько процессов.
+        """
+        earlier = aliased(cls)
+        stmt = (
+            update(cls)
+            .where(
+                cls.id == job_id,
+                cls.status == WebhookJobStatus.PENDING,
+                ~exists().where(
+                    earlier.remna_uuid == cls.remna_uuid,
+                    earlier.id < cls.id,
+                    earlier.status.in_([WebhookJobStatus.PENDING, WebhookJobStatus.PROCESSING])
+                )
+            )
+            .values(status=WebhookJobStatus.PROCESSING, locked_at=datetime.now())
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def coalesce_pending(
+            cls,
+            session: AsyncSession,
+            event: str,
+            remna_uuid: str,
+            payload: dict,
+            next_attempt_at: datetime
+    ) -> bool:
+        """
+        Подменяет payload последней ожидающей задачи этого UUID, если это то же событие
+        и задача еще не бралась в работу. Возвращает False, если склеивать не с чем.
+        """
+        last_id = (
+            select(func.max(cls.id))
+            .where(cls.remna_uuid == remna_uuid, cls.status == WebhookJobStatus.PENDING)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(cls)
+            .where(
+                cls.id == last_id,
+                cls.event == event,
+                cls.attempts == 0,
+                cls.status == WebhookJobStatus.PENDING
+            )
+            .values(payload=payload, next_attempt_at=next_attempt_at)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def release_stale(cls, session: AsyncSession, locked_before: datetime) -> int:
+        """Возвращает в очередь задачи, зависшие в обработке (например, после падения процесса)."""
+        stmt = (
+            update(cls)
+            .where(cls.status == WebhookJobStatus.PROCESSING, cls.locked_at < locked_before)
+            .values(status=WebhookJobStatus.PENDING, locked_at=None)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+    @classmethod
+    async def release(cls, session: AsyncSession, job_ids: Iterable[int]) -> int:
+        """Возвращает в очередь задачи, которые процесс забрал, но не обработал (при остановке)."""
+        stmt = (
+            update(cls)
+            .where(cls.id.in_(list(job_ids)), cls.status == WebhookJobStatus.PROCESSING)
+            .values(status=WebhookJobStatus.PENDING, locked_at=None)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+    @classmethod
+    async def set_result(cls, session: AsyncSession, job_id: int, **values) -> None:
+        """Сохраняет результат обработки задачи одним UPDATE."""
+        await session.execute(update(cls).where(cls.id == job_id).values(**values))
+        await session.commit()
+
+    @classmethod
+    async def delete_done(cls, session: AsyncSession, created_before: datetime) -> int:
+        """Удаляет успешно обработанные задачи, созданные раньше created_before."""
+        stmt = delete(cls).where(cls.status == WebhookJobStatus.DONE, cls.created_at < created_before)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+
+class RemnaDeferredUpdate(Base):
+    """
+    Изменение даты окончания подписки, которое не удалось сразу отправить в Remnawave.
+    На один UUID хранится одна запись с последней датой; воркер RemnaService досылает их в панель.
+    Если заполнен telegram_id, пользователь пула еще не передан покупателю: досылается вся
+    передача (telegram_id, username, описание, отряды), а не только дата.
+    """
+    __tablename__ = "remna_deferred_updates"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    remna_uuid: Mapped[str] = mapped_column(String(36), unique=True)
+    expire_at: Mapped[datetime]
+    telegram_id: Mapped[Optional[int]]
+    username: Mapped[Optional[str]]
+    attempts: Mapped[int] = mapped_column(default=0)
+    last_error: Mapped[Optional[str]]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    @classmethod
+    async def upsert(
+            cls,
+            session: AsyncSession,
+            remna_uuid: str,
+            expire_at: datetime,
+            telegram_id: Optional[int] = None,
+            username: Optional[str] = None
+    ) -> None:
+        """
+        Сохраняет отложенное изменение, заменяя дату предыдущего для того же UUID.
+        Отложенная передача пользователя пула (telegram_id, username) при этом сохраняется.
+        """
+        stmt = select(cls).where(cls.remna_uuid == remna_uuid)
+        deferred = (await session.execute(stmt)).scalar_one_or_none()
+        if deferred:
+            deferred.expire_at = expire_at
+            if telegram_id is not None:
+                deferred.telegram_id, deferred.username = telegram_id, username
+        else:
+            session.add(cls(remna_uuid=remna_uuid, expire_at=expire_at, telegram_id=telegram_id, username=username))
+        await session.commit()
+
+    @classmethod
+    async def has_assignment(cls, session: AsyncSession, remna_uuid: str) -> bool:
+        """Есть ли у UUID отложенная передача пользователя пула покупателю."""
+        stmt = select(exists().where(cls.remna_uuid == remna_uuid, cls.telegram_id.is_not(None)))
+        return bool(await session.scalar(stmt))
+
+    @classmethod
+    async def get_batch(cls, session: AsyncSession, limit: int, max_attempts: int) -> List[Self]:
+        """Возвращает отложенные изменения, которые еще не исчерпали попытки."""
+        stmt = select(cls).where(cls.attempts < max_attempts).order_by(cls.id).limit(limit)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def delete_applied(
+            cls,
+            session: AsyncSession,
+            remna_uuid: str,
+            expire_at: Optional[datetime] = None
+    ) -> None:
+        """
+        Удаляет запись после успешной отправки в панель.
+        С expire_at удаляет, только если пока ее досылали, дату не заменили на более новую.
+        Без expire_at (дата отправлена напрямую) отложенная передача пользователя пула не удаляется.
+        """
+        stmt = delete(cls).where(cls.remna_uuid == remna_uuid)
+        if expire_at is not None:
+            stmt = stmt.where(cls.expire_at == expire_at)
+        else:
+            stmt = stmt.where(cls.telegram_id.is_(None))
+        await session.execute(stmt)
+        await session.commit()
+
+    @classmethod
+    async def discard(cls, session: AsyncSession, remna_uuid: str) -> None:
+        """Удаляет отложенные изменения пользователя, удаленного из панели."""
+        await session.execute(delete(cls).where(cls.remna_uuid == remna_uuid))
+        await session.commit()
+
+    @classmethod
+    async def mark_failed(cls, session: AsyncSession, remna_uuid: str, error: str) -> None:
+        stmt = (
+            update(cls)
+            .where(cls.remna_uuid == remna_uuid)
+            .values(attempts=cls.attempts + 1, last_error=error)
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+class RemnaPoolUser(Base):
+    """
+    Заранее созданный в Remnawave пользователь (DISABLED, без владельца).
+    При оплате новой подписки он переименовывается, привязывается к покупателю и активируется.
+    """
+    __tablename__ = "remna_pool_users"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    remna_uuid: Mapped[str] = mapped_column(String(36), unique=True)
+    remna_short_uuid: Mapped[str] = mapped_column(String(48))
+    username: Mapped[str]
+    subscription_url: Mapped[str]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> Self:
+        pool_user = cls(**kwargs)
+        session.add(pool_user)
+        await session.commit()
+        await session.refresh(pool_user)
+        return pool_user
+
+    @classmethod
+    async def count(cls, session: AsyncSession) -> int:
+        result = await session.execute(select(func.count(cls.id)))
+        return result.scalar_one()
+
+    @classmethod
+    async def take(cls, session: AsyncSession, attempts: int = 5) -> Optional[Self]:
+        """
+        Забирает пользователя из пула: удаляет строку условным DELETE, поэтому
+        одновременные покупки не получат одного и того же пользователя.
+        """
+        for _ in range(attempts):
+            stmt = select(cls).order_by(cls.id).limit(1)
+            pool_user = (await session.execute(stmt)).scalar_one_or_none()
+            if not pool_user:
+                return None
+            result = await session.execute(delete(cls).where(cls.id == pool_user.id))
+            await session.commit()
+            if result.rowcount == 1:
+                return pool_user
+        return None
+
+
+class Notification(Base):
+    """
+    Исходящее сообщение пользователю (outbox). Пишется в той же транзакции, что и изменение
+    состояния, и отправляется в фоне воркерами notification_service.
+    """
+    __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_status_id", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    chat_id: Mapped[int]
+    # Ключ перевода и параметры для .format(); текст собирается при отправке на языке locale
+    text_key: Mapped[str]
+    params: Mapped[dict] = mapped_column(JSON, default=dict)
+    locale: Mapped[Optional[str]] = mapped_column(String(5))
+    button_url: Mapped[Optional[str]]  # Кнопка Web App с конфигурацией
+    message_effect_id: Mapped[Optional[str]]
+    status: Mapped[NotificationStatus] = mapped_column(
+        Enum(NotificationStatus),
+        default=NotificationStatus.PENDING,
+        nullable=False
+    )
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    locked_at: Mapped[Optional[datetime]]
+    last_error: Mapped[Optional[str]]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    @classmethod
+    def add(cls, session: AsyncSession, **kwargs) -> Self:
+        """Добавляет уведомление в сессию без коммита: оно сохранится вместе с остальными изменениями."""
+        # Время задаем явно: server_default в SQLite пишет UTC, а get_pending сравнивает с локальным
+        now = datetime.now()
+        kwargs.setdefault("next_attempt_at", now)
+        kwargs.setdefault("created_at", now)
+        notification = cls(**kwargs)
+        session.add(notification)
+        return notification
+
+    @classmethod
+    async def get_pending(cls, session: AsyncSession, limit: int) -> List[Self]:
+        """Возвращает уведомления, которые пора отправить, в порядке поступления."""
+        stmt = (
+            select(cls)
+            .where(cls.status == NotificationStatus.PENDING, cls.next_attempt_at <= datetime.now())
+            .order_by(cls.id)
+            .limit(limit)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, notification_id: int) -> bool:
+        """Атомарно забирает уведомление в отправку. Возвращает False, если его уже забрал другой процесс."""
+        stmt = (
+            update(cls)
+            .where(cls.id == notification_id, cls.status == NotificationStatus.PENDING)
+            .values(status=NotificationStatus.PROCESSING, locked_at=datetime.now())
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def release_stale(cls, session: AsyncSession, locked_before: datetime) -> int:
+        """Возвращает в очередь уведомления, зависшие в отправке (например, после падения процесса)."""
+        stmt = (
+            update(cls)
+            .where(cls.status == NotificationStatus.PROCESSING, cls.locked_at < locked_before)
+            .values(status=NotificationStatus.PENDING, locked_at=None)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+    @classmethod
+    async def release(cls, session: AsyncSession, notification_ids: Iterable[int]) -> int:
+        """Возвращает в очередь уведомления, которые процесс забрал, но не отправил (при остановке)."""
+        stmt = (
+            update(cls)
+            .where(cls.id.in_(list(notification_ids)), cls.status == NotificationStatus.PROCESSING)
+            .values(status=NotificationStatus.PENDING, locked_at=None)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+    @classmethod
+    async def set_result(cls, session: AsyncSession, notification_id: int, **values) -> None:
+        """Сохраняет результат отправки одним UPDATE."""
+        await session.execute(update(cls).where(cls.id == notification_id).values(**values))
+        await session.commit()
+
+    @classmethod
+    async def delete_sent(cls, session: AsyncSession, created_before: datetime) -> int:
+        """Удаляет отправленные уведомления, созданные раньше created_before."""
+        stmt = delete(cls).where(cls.status == NotificationStatus.SENT, cls.created_at < created_before)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram, общее для всех воркеров приложения (см. DatabaseStorage)."""
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[Optional[str]]
+    data: Mapped[dict] = mapped_column(JSON, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+    @classmethod
+    async def get(cls, session: AsyncSession, key: str) -> Optional[Self]:
+        return await session.get(cls, key)
+
+    @classmethod
+    async def save(cls, session: AsyncSession, key: str, **values) -> None:
+        """Обновляет запись или создает ее, если ее еще нет (в том числе при гонке с другим воркером)."""
+        result = await session.execute(update(cls).where(cls.key == key).values(**values))
+        if result.rowcount == 0:
+            try:
+                session.add(cls(key=key, **values))
+                await session.commit()
+                return
+            except IntegrityError:
+                await session.rollback()
+                await session.execute(update(cls).where(cls.key == key).values(**values))
+        await session.commit()
+
+    @classmethod
+    async def clear_data(cls, session: AsyncSession, key: str) -> None:
+        """
+        Очищает данные. Запись без состояния удаляется, чтобы таблица не росла
+        с каждым пользователем, у записи с состоянием обнуляется data.
+        """
+        result = await session.execute(delete(cls).where(cls.key == key, cls.state.is_(None)))
+        if result.rowcount == 0:
+            await session.execute(update(cls).where(cls.key == key).values(data={}))
+        await session.commit()
+
+
+class AppLease(Base):
+    """
+    Аренда (lease) именованной роли между процессами приложения: владеет тот,
+    кто последним продлил ее до истечения expires_at.
+    """
+    __tablename__ = "app_leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    owner: Mapped[str] = mapped_column(String(128))
+    expires_at: Mapped[datetime]
+
+    @classmethod
+    async def acquire(cls, session: AsyncSession, name: str, owner: str, ttl: float) -> bool:
+        """
+        Захватывает или продлевает аренду на ttl секунд. Удается, если аренды нет,
+        она истекла или уже принадлежит owner.
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl)
+        stmt = (
+            update(cls)
+            .where(cls.name == name, or_(cls.owner == owner, cls.expires_at < now))
+            .values(owner=owner, expires_at=expires_at)
+        )
+        result = await session.execute(stmt)
+        if result.rowcount == 1:
+            await session.commit()
+            return True
+        try:
+            session.add(cls(name=name, owner=owner, expires_at=expires_at))
+            await session.commit()
+            return True
+        except IntegrityError:
+            # Аренда есть и принадлежит другому процессу
+            await session.rollback()
+            return False
+
+    @classmethod
+    async def release(cls, session: AsyncSession, name: str, owner: str) -> None:
+        await session.execute(delete(cls).where(cls.name == name, cls.owner == owner))
+        await session.commit()
+
+
+class AppSetting(Base):
+    """Служебные значения приложения, общие для всех процессов (например, хэш зарегистрированных команд бота)."""
+    __tablename__ = "app_settings"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[dict] = mapped_column(JSON)
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+    @classmethod
+    async def get_value(cls, session: AsyncSession, key: str) -> Optional[dict]:
+        result = await session.execute(select(cls.value).where(cls.key == key))
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def set_value(cls, session: AsyncSession, key: str, value: dict) -> None:
+        """Обновляет значение или создает запись, если ее еще нет (в том числе при гонке с другим процессом)."""
+        result = await session.execute(update(cls).where(cls.key == key).values(value=value))
+        if result.rowcount == 0:
+            try:
+                session.add(cls(key=key, value=value))
+                await session.commit()
+                return
+            except IntegrityError:
+                await session.rollback()
+                await session.execute(update(cls).where(cls.key == key).values(value=value))
+        await session.commit()
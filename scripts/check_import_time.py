@@ -0,0 +1,91 @@
+"""
+Проверка времени импорта модулей приложения (бюджет на python -X importtime).
+
+Импорт модуля не должен создавать клиентов, ходить в сеть или на диск: это замедляет
+холодный старт воркеров, Alembic и любые скрипты. Скрипт импортирует каждый модуль
+в отдельном процессе, берет лучшее из нескольких запусков и завершается с кодом 1,
+если суммарное время импорта превышает бюджет.
+
+Запуск из корня проекта (нужны переменные окружения, как для приложения):
+    python scripts/check_import_time.py
+    python scripts/check_import_time.py app.main=6000 --runs 5 --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Бюджеты в миллисекундах. app.main неизбежно импортирует aiogram и FastAPI,
+# остальные модули используются Alembic и скриптами и должны оставаться легкими.
+DEFAULT_BUDGETS_MS: Dict[str, float] = {
+    "app.core.config": 500,
+    "database.models": 1000,
+    "app.main": 8000,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_import(module: str) -> List[Tuple[str, int, int]]:
+    """Импортирует модуль в новом процессе. Возвращает строки importtime: (имя, собственное, суммарное) в мкс."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(module: str, runs: int) -> Tuple[int, List[Tuple[str, int, int]]]:
+    """Лучшее из runs запусков: суммарное время импорта модуля (мкс) и профиль этого запуска."""
+    best_total, best_rows = None, []
+    for _ in range(runs):
+        rows = profile_import(module)
+        total = next((cumulative for name, _, cumulative in rows if name.strip() == module), 0)
+        if best_total is None or total < best_total:
+            best_total, best_rows = total, rows
+    return best_total, best_rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта модулей")
+    parser.add_argument(
+        "budgets", nargs="*", metavar="МОДУЛЬ=МС",
+        help="Модули и бюджеты в миллисекундах (по умолчанию: %s)"
+             % ", ".join(f"{m}={b:g}" for m, b in DEFAULT_BUDGETS_MS.items()),
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Сколько раз импортировать каждый модуль")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых дорогих модулей показать")
+    args = parser.parse_args()
+
+    budgets = DEFAULT_BUDGETS_MS
+    if args.budgets:
+        budgets = {}
+        for item in args.budgets:
+            module, _, budget = item.partition("=")
+            budgets[module] = float(budget) if budget else DEFAULT_BUDGETS_MS.get(module, float("inf"))
+
+    failed = False
+    for module, budget_ms in budgets.items():
+        total_us, rows = measure(module, args.runs)
+        total_ms = total_us / 1000
+        over = total_ms > budget_ms
+        failed |= over
+        print(f"{'ПРЕВЫШЕН' if over else 'OK':8} {module}: {total_ms:.0f} мс (бюджет {budget_ms:g} мс)")
+        for name, self_us, cumulative_us in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+            print(f"{'':8}   {self_us / 1000:8.1f} мс собств. {cumulative_us / 1000:8.1f} мс всего  {name.strip()}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())